@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import importlib
 import base64
 
@@ -9,31 +10,30 @@ os.environ['STREAMLIT_SERVER_FILE_WATCHER_TYPE'] = 'none'
 import streamlit as st
 import time
 
-# Store pipeline functions to be loaded lazily
-pipeline_functions = {}
+# Pipeline modules import each other by module name, so put src/ on the path
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
 
-def lazy_import_functions():
-    """Lazily import pipeline functions when needed."""
-    try:
-        from src.extract_frames import extract_frames
-        from src.jumble_frames import jumble_frames
-        from src.feature_extraction import extract_features
-        from src.build_similarity import build_similarity
-        from src.tsp_solver import solve_tsp
-        from src.rebuild_video import rebuild_video
-        
-        return {
-            'extract_frames': extract_frames,
-            'jumble_frames': jumble_frames,
-            'extract_features': extract_features,
-            'build_similarity': build_similarity,
-            'solve_tsp': solve_tsp,
-            'rebuild_video': rebuild_video
-        }
-    except ImportError as e:
-        st.error(f"Error importing pipeline modules: {str(e)}")
-        st.stop()
-        return {}
+STAGE_LABELS = {
+    'extract_frames': "Extracting frames",
+    'jumble_frames': "Jumbling frames",
+    'extract_features': "Extracting features",
+    'build_similarity': "Building similarity matrix",
+    'solve_tsp': "Solving optimal frame order",
+    'rebuild_video': "Reconstructing video"
+}
+
+@st.cache_resource(validate=lambda worker: worker.is_alive())
+def get_job_worker():
+    """
+    One background worker process per Streamlit server (see src/job_worker.py).
+
+    The worker keeps the feature model loaded between jobs, so reruns and new
+    uploads do not pay for loading it, and the UI never blocks on processing.
+    """
+    from job_worker import JobWorker
+    return JobWorker()
 
 # Page config
 st.set_page_config(
@@ -105,6 +105,10 @@ with st.sidebar:
     with st.expander("Advanced Options"):
         fps = st.slider("Frames per second (FPS)", 1, 60, 30)
         resolution_scale = st.slider("Resolution scale", 0.1, 1.0, 0.5)
+        from feature_backends import BACKENDS, DEFAULT_BACKEND
+        feature_backend = st.selectbox(
+            "Feature backend", list(BACKENDS), index=list(BACKENDS).index(DEFAULT_BACKEND),
+            help="thumbnail, histogram and phash are handcrafted descriptors: much faster, no model download")
         
     # Process button
     process_btn = st.button("Start Processing")
@@ -116,24 +120,11 @@ def ensure_directories():
     os.makedirs("output", exist_ok=True)
     os.makedirs("data/features", exist_ok=True)
 
-# Initialize lazy-loaded functions when needed
-def get_pipeline_functions():
-    if not pipeline_functions:
-        pipeline_functions.update(lazy_import_functions())
-    return pipeline_functions
-
 # Main content area
 if uploaded_file is not None:
     # Ensure all required directories exist
     ensure_directories()
     
-    # Save uploaded file
-    video_path = os.path.join("data", uploaded_file.name)
-    os.makedirs("data", exist_ok=True)
-    
-    with open(video_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    
     # Display video with better error handling
     st.subheader("Uploaded Video Preview")
     
@@ -177,66 +168,67 @@ if uploaded_file is not None:
             pass
     
     # Processing section
+    worker = get_job_worker()
     if process_btn:
+        # The job gets its own copy of the upload, so reruns cannot change its input
+        st.session_state['job_id'] = worker.submit(
+            uploaded_file, jumble=jumble_frames_option, feature_backend=feature_backend)
+
+    job_id = st.session_state.get('job_id')
+    job = worker.job(job_id) if job_id is not None else None
+    if job is not None:
         st.subheader("🔄 Processing Pipeline")
-        
+
+        if job['state'] in ('queued', 'running') and st.button("Cancel Processing"):
+            worker.cancel(job_id)
+
         # Initialize progress
-        progress_bar = st.progress(0)
+        progress_bar = st.progress(0.0)
         status_text = st.empty()
-        
-        try:
-            # Get pipeline functions
-            pipeline = get_pipeline_functions()
-            
-            # Step 1: Extract frames
-            status_text.markdown("### 🔄 Step 1/6: Extracting frames...")
-            output_dir = os.path.join("data", "frames")
-            pipeline['extract_frames'](video_path, output_dir)
-            progress_bar.progress(16)
-            
-            # Step 2: Jumble frames (if enabled)
-            if jumble_frames_option:
-                status_text.markdown("### 🔄 Step 2/6: Jumbling frames...")
-                pipeline['jumble_frames']()
+
+        # Follow the job's progress events until it finishes
+        from job_worker import STAGES, overall_progress
+        while job['state'] in ('queued', 'running'):
+            progress_bar.progress(overall_progress(job))
+            if job['state'] == 'queued':
+                status_text.markdown(f"### ⏳ Waiting for {job.get('ahead', 0)} job(s) ahead of this one...")
+            elif job['stage'] is None:
+                status_text.markdown("### 🔄 Starting...")
             else:
-                status_text.markdown("### ⏩ Skipping frame jumbling")
-                # If not jumbling, make sure frames_jumbled directory exists
-                frames_dir = os.path.join("data", "frames")
-                frames_jumbled_dir = os.path.join("data", "frames_jumbled")
-                if not os.path.exists(frames_jumbled_dir):
-                    import shutil
-                    if os.path.exists(frames_dir):
-                        shutil.copytree(frames_dir, frames_jumbled_dir)
-            progress_bar.progress(32)
-            
-            # Step 3: Extract features
-            status_text.markdown("### 🔄 Step 3/6: Extracting features...")
-            frames_dir = os.path.join("data", "frames_jumbled" if jumble_frames_option else "frames")
-            output_path = os.path.join("data", "frame_features.npy")
-            pipeline['extract_features'](frames_dir, output_path)
-            progress_bar.progress(48)
-            
-            # Step 4: Build similarity matrix
-            status_text.markdown("### 🔄 Step 4/6: Building similarity matrix...")
-            pipeline['build_similarity']()
-            progress_bar.progress(64)
-            
-            # Step 5: Solve TSP
-            status_text.markdown("### 🔄 Step 5/6: Solving optimal frame order...")
-            pipeline['solve_tsp']()
-            progress_bar.progress(80)
-            
-            # Step 6: Rebuild video
-            status_text.markdown("### 🔄 Step 6/6: Reconstructing video...")
-            pipeline['rebuild_video']()
-            progress_bar.progress(100)
+                counter = f" ({job['done']}/{job['total']})" if job['total'] else ""
+                status_text.markdown(f"### 🔄 Step {job['index'] + 1}/{len(STAGES)}: "
+                                     f"{STAGE_LABELS[job['stage']]}...{counter}")
+            time.sleep(0.5)
+            job = worker.job(job_id)
+
+        if job['state'] == 'cancelled':
+            status_text.markdown("### 🛑 Processing cancelled")
+        elif job['state'] == 'failed':
+            status_text.empty()
+            st.error(f"An error occurred: {job.get('error')}")
+            if job.get('traceback'):
+                with st.expander("Traceback"):
+                    st.code(job['traceback'])
+        else:
+            progress_bar.progress(1.0)
+            status_text.empty()
             
             # Display result
             st.success("✅ Processing complete!")
             
+            # Show where the time went
+            with st.expander("⏱️ Stage timings"):
+                st.table([{
+                    'Stage': s['stage'],
+                    'Wall (s)': s['wall_seconds'],
+                    'CPU (s)': s['cpu_seconds'],
+                    'Peak RSS (MB)': round(s.get('peak_rss_bytes', 0) / (1024 * 1024), 1),
+                    'Frames/s': s.get('frames_per_second')
+                } for s in job['stages']])
+            
             # Show result
             st.subheader("🎥 Reconstructed Video")
-            output_video = os.path.join("output", "reconstructed_video.mp4")
+            output_video = job['output']
             
             try:
                 if os.path.exists(output_video):
@@ -267,10 +259,6 @@ if uploaded_file is not None:
                         file_name="reconstructed_video.mp4",
                         mime="video/mp4"
                     )
-                
-        except Exception as e:
-            st.error(f"An error occurred: {str(e)}")
-            st.exception(e)
 
 # Add some empty space at the bottom
 for _ in range(5):
@@ -0,0 +1,172 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+
+# Benchmark suite for the reconstruction pipeline.
+#
+# For every frame count N a synthetic video is rendered (see synthetic_video.py),
+# its frames are shuffled with a fixed seed, and the pipeline stages are run
+# one by one inside a scratch workspace, each timed with the pipeline profiler.
+# The solved order is scored against the saved shuffle, so every run reports
+# speed and reconstruction accuracy. Results go to benchmarks/results/ as one
+# JSON file per run and are compared with the previous run.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_video import make_video
+from instrumentation import PipelineProfiler
+from scoring import score_order
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+WORK_DIR = os.path.join(BENCH_DIR, 'work')
+STAGES = ('extract_frames', 'extract_features', 'build_similarity', 'tsp_reorder', 'rebuild_video')
+
+
+def benchmark_size(n_frames, args):
+    """Run every stage on an N-frame synthetic video and return its results."""
+    from extract_frames import extract_frames
+    from jumble_frames import jumble_frames, permutation_path_for
+    from feature_extraction import extract_features
+    from build_similarity import normalize_features, dense_similarity
+    from tsp_solver import SOLVERS
+    from rebuild_video import rebuild_video
+
+    # extract_frames writes metadata to <workspace>/data, so mirror that layout
+    workspace = os.path.join(WORK_DIR, f"n{n_frames}")
+    shutil.rmtree(workspace, ignore_errors=True)
+    data_dir = os.path.join(workspace, 'data')
+    frames_dir = os.path.join(data_dir, 'frames')
+    jumbled_dir = os.path.join(data_dir, 'frames_jumbled')
+    os.makedirs(frames_dir)
+
+    video_path = os.path.join(workspace, 'input.mp4')
+    make_video(video_path, n_frames, args.width, args.height, seed=args.seed)
+
+    profiler = PipelineProfiler()
+    with profiler.stage('extract_frames', frames=n_frames):
+        extract_frames(video_path, frames_dir)
+
+    jumble_frames(frames_dir, jumbled_dir, seed=args.seed)
+    permutation = np.load(permutation_path_for(jumbled_dir))
+
+    features_path = os.path.join(data_dir, 'frame_features.npy')
+    with profiler.stage('extract_features', frames=n_frames):
+        extract_features(jumbled_dir, features_path, batch_size=args.batch_size,
+                         backend=args.feature_backend, optimize=args.inference)
+
+    sim_path = os.path.join(data_dir, 'similarity_matrix.npy')
+    with profiler.stage('build_similarity', frames=n_frames):
+        dense_similarity(normalize_features(np.load(features_path)), sim_path)
+
+    order_path = os.path.join(data_dir, 'frame_order_final.npy')
+    with profiler.stage('tsp_reorder', frames=n_frames):
+        order = SOLVERS[args.solver](np.load(sim_path, mmap_mode='r'))
+        np.save(order_path, np.asarray(order))
+
+    with profiler.stage('rebuild_video', frames=n_frames):
+        rebuild_video(fps=25, frames_dir=jumbled_dir, order_path=order_path,
+                      output_path=os.path.join(workspace, 'reconstructed_video.mp4'))
+
+    if not args.keep_work:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    result = {'frames': n_frames, 'stages': {s['stage']: s for s in profiler.stages}}
+    result['total_wall_seconds'] = round(sum(s['wall_seconds'] for s in profiler.stages), 4)
+    result.update(score_order(order, permutation))
+    return result
+
+
+def latest_result(exclude=None):
+    runs = sorted(glob.glob(os.path.join(RESULTS_DIR, 'bench_*.json')))
+    runs = [r for r in runs if r != exclude]
+    return runs[-1] if runs else None
+
+
+def print_comparison(current, baseline_path):
+    """Print per-stage wall time and accuracy of this run next to a baseline run."""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    previous = {r['frames']: r for r in baseline['results']}
+
+    print(f"\n📊 Compared with {os.path.basename(baseline_path)}:")
+    for result in current['results']:
+        before = previous.get(result['frames'])
+        if before is None:
+            continue
+        print(f"  N={result['frames']}:")
+        for stage in STAGES:
+            if stage not in result['stages'] or stage not in before['stages']:
+                continue
+            new = result['stages'][stage]['wall_seconds']
+            old = before['stages'][stage]['wall_seconds']
+            change = (new - old) / old * 100 if old > 0 else 0.0
+            print(f"    - {stage:<17} {old:8.3f}s -> {new:8.3f}s ({change:+.1f}%)")
+        for metric in ('kendall_tau', 'adjacency_accuracy'):
+            if metric in before:
+                print(f"    - {metric:<17} {before[metric]:8.4f}  -> {result[metric]:8.4f}")
+
+
+def run_benchmarks(sizes, args):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    report = {
+        'started_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': {'sizes': sizes, 'width': args.width, 'height': args.height, 'seed': args.seed,
+                   'solver': args.solver, 'batch_size': args.batch_size,
+                   'feature_backend': args.feature_backend, 'inference': args.inference},
+        'host': PipelineProfiler().report()['host'],
+        'results': []
+    }
+
+    for n in sizes:
+        print(f"\n🏁 Benchmarking N={n} frames ({args.width}x{args.height})...")
+        result = benchmark_size(n, args)
+        report['results'].append(result)
+
+    print("\n📈 Benchmark results:")
+    header = (f"  {'N':>6} " + " ".join(f"{s:>17}" for s in STAGES)
+              + f" {'total':>8} {'tau':>6} {'adjacency':>9} {'run':>6}")
+    print(header)
+    for result in report['results']:
+        times = " ".join(f"{result['stages'][s]['wall_seconds']:>16.3f}s" for s in STAGES)
+        print(f"  {result['frames']:>6} {times} {result['total_wall_seconds']:>7.2f}s"
+              f" {result['kendall_tau']:>6.3f} {result['adjacency_accuracy']:>9.4f}"
+              f" {result['longest_correct_run']:>6}")
+
+    output_path = os.path.join(RESULTS_DIR, f"bench_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Saved benchmark results to {output_path}")
+
+    baseline = args.compare or latest_result(exclude=output_path)
+    if baseline:
+        print_comparison(report, baseline)
+    return report
+
+
+if __name__ == "__main__":
+    from tsp_solver import SOLVERS
+    from feature_backends import BACKENDS
+    from inference_optim import OPTIMIZE_MODES
+
+    parser = argparse.ArgumentParser(description="Benchmark the reconstruction pipeline on synthetic videos.")
+    parser.add_argument("--sizes", type=str, default="100,250,500", help="Comma-separated frame counts (default: 100,250,500)")
+    parser.add_argument("--width", type=int, default=320, help="Frame width (default: 320)")
+    parser.add_argument("--height", type=int, default=240, help="Frame height (default: 240)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic video and the shuffle (default: 0)")
+    parser.add_argument("--solver", choices=sorted(SOLVERS), default="greedy_fast", help="Frame ordering engine (default: greedy_fast)")
+    parser.add_argument("--feature_backend", choices=list(BACKENDS), default="resnet18", help="Feature backend (default: resnet18)")
+    parser.add_argument("--inference", choices=OPTIMIZE_MODES, default=None, help="Optimised CPU inference for CNN backends (default: float32)")
+    parser.add_argument("--batch_size", type=int, default=None, help="Feature-extraction batch size (default: pick from available memory)")
+    parser.add_argument("--compare", type=str, default=None, help="Results file to compare against (default: the previous run)")
+    parser.add_argument("--keep_work", action="store_true", help="Keep the per-N scratch workspaces in benchmarks/work")
+    args = parser.parse_args()
+
+    run_benchmarks([int(n) for n in args.sizes.split(',')], args)
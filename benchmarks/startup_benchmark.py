@@ -0,0 +1,157 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+# Cold-start benchmark.
+#
+# Every case runs in a fresh Python process, so nothing is already imported or
+# loaded, and reports its wall time. The light cases (the CLI's --help, importing
+# the pipeline modules, asking a backend for its model_id) must not import any
+# heavy library; the benchmark fails if one of them does. The model cases load
+# a CNN backbone twice against an empty model cache: the first load builds it
+# from torchvision and caches it, the second loads the cached copy (see
+# TorchvisionBackend.load). Results go to benchmarks/results/ and are compared
+# with the previous run.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+HEAVY_MODULES = ('torch', 'torchvision', 'sklearn', 'cv2', 'onnxruntime')
+
+LIGHT_MODULES = ('run_pipeline', 'feature_backends', 'build_similarity', 'tsp_solver',
+                 'jumble_frames', 'scoring', 'workspace', 'embedding_server',
+                 'job_worker', 'batch_pipeline')
+
+PRELUDE = f"""
+import sys, json, time
+start = time.perf_counter()
+sys.path.insert(0, {SRC_DIR!r})
+"""
+
+EPILOGUE = f"""
+elapsed = time.perf_counter() - start
+heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+sys.stdout.flush()
+print('\\n' + json.dumps({{'seconds': elapsed, 'heavy_modules': heavy}}))
+"""
+
+LIGHT_CASES = {
+    'cli_help': f"""
+import runpy
+sys.argv = ['run_pipeline.py', '--help']
+try:
+    runpy.run_path({os.path.join(SRC_DIR, 'run_pipeline.py')!r}, run_name='__main__')
+except SystemExit:
+    pass
+""",
+    'import_modules': "\n".join(f"import {name}" for name in LIGHT_MODULES),
+    'backend_model_id': """
+from feature_backends import get_backend
+print(get_backend('resnet18').model_id)
+""",
+}
+
+
+def model_case(weights, cache_dir):
+    return f"""
+from feature_backends import BACKENDS
+backend = BACKENDS['resnet18'](weights={weights!r}, cache_dir={cache_dir!r})
+backend.load()
+"""
+
+
+def run_case(code):
+    """Run a snippet in a fresh interpreter and return its timing record."""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', PRELUDE + code + EPILOGUE],
+                               capture_output=True, text=True, cwd=REPO_DIR)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else
+                           f"exit code {completed.returncode}")
+    record = json.loads(completed.stdout.strip().splitlines()[-1])
+    record['process_seconds'] = wall
+    return record
+
+
+def latest_result(exclude=None):
+    runs = sorted(glob.glob(os.path.join(RESULTS_DIR, 'startup_*.json')))
+    runs = [r for r in runs if r != exclude]
+    return runs[-1] if runs else None
+
+
+def print_comparison(current, baseline_path):
+    """Print each case's process time next to a baseline run."""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    print(f"\n📊 Compared with {os.path.basename(baseline_path)}:")
+    for name, result in current['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            continue
+        new, old = result['process_seconds'], before['process_seconds']
+        change = (new - old) / old * 100 if old > 0 else 0.0
+        print(f"  - {name:<18} {old:8.3f}s -> {new:8.3f}s ({change:+.1f}%)")
+
+
+def run_startup_benchmark(args):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    cases = dict(LIGHT_CASES)
+    cache_dir = None
+    if not args.skip_model:
+        cache_dir = tempfile.mkdtemp(prefix='startup-models-')
+        cases['model_load_cold'] = model_case(args.feature_weights, cache_dir)
+        cases['model_load_cached'] = model_case(args.feature_weights, cache_dir)
+
+    report = {'started_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': sys.version.split()[0],
+              'cases': {}}
+    violations = []
+    try:
+        for name, code in cases.items():
+            samples = [run_case(code) for _ in range(1 if name.startswith('model_load') else args.repeat)]
+            best = min(samples, key=lambda sample: sample['process_seconds'])
+            report['cases'][name] = best
+            heavy = best['heavy_modules'] if name in LIGHT_CASES else []
+            if heavy:
+                violations.append(f"{name} imported {', '.join(heavy)}")
+            print(f"  {name:<18} {best['process_seconds']:7.3f}s process, "
+                  f"{best['seconds']:7.3f}s in Python" + (f"  ❌ imported {', '.join(heavy)}" if heavy else ""))
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    output_path = os.path.join(RESULTS_DIR, f"startup_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Saved startup results to {output_path}")
+
+    baseline = args.compare or latest_result(exclude=output_path)
+    if baseline:
+        print_comparison(report, baseline)
+
+    if violations:
+        print("\n❌ Heavy imports on a light path:")
+        for violation in violations:
+            print(f"  - {violation}")
+    return report, violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the pipeline's cold-start time in fresh processes.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per light case, best one kept (default: 3)")
+    parser.add_argument("--skip_model", action="store_true", help="Skip the model load cases (they need torch and the weights)")
+    parser.add_argument("--feature_weights", type=str, default=None, help="Local ResNet-18 weights file instead of downloading them")
+    parser.add_argument("--compare", type=str, default=None, help="Results file to compare against (default: the previous run)")
+    args = parser.parse_args()
+
+    print("⏱️ Measuring cold start...")
+    _, violations = run_startup_benchmark(args)
+    sys.exit(1 if violations else 0)
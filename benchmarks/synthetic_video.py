@@ -0,0 +1,84 @@
+import os
+import argparse
+import numpy as np
+import cv2
+
+# Synthetic benchmark videos: a few coloured shapes moving and bouncing over a
+# slowly shifting gradient background. Every frame is fully determined by the
+# seed, so the same arguments always produce the same video.
+
+
+def render_frames(n_frames, width=320, height=240, shapes=6, seed=0):
+    """
+    Yield the frames of a synthetic video.
+
+    Args:
+        n_frames: Number of frames
+        width, height: Frame size in pixels
+        shapes: Number of moving shapes
+        seed: Random seed for shape sizes, colours, positions and velocities
+
+    Yields:
+        np.ndarray: HxWx3 uint8 BGR frame
+    """
+    rng = np.random.default_rng(seed)
+    radius = rng.integers(min(width, height) // 16, min(width, height) // 6, size=shapes)
+    colour = rng.integers(0, 256, size=(shapes, 3))
+    pos = rng.uniform([0, 0], [width, height], size=(shapes, 2))
+    vel = rng.uniform(-4, 4, size=(shapes, 2))
+    is_circle = rng.random(shapes) < 0.5
+
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+
+    for t in range(n_frames):
+        phase = 2 * np.pi * t / max(n_frames, 1)
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[..., 0] = (127 + 100 * np.sin(phase + 3 * xs) * np.ones_like(ys)).astype(np.uint8)
+        frame[..., 1] = (127 + 100 * np.cos(phase + 3 * ys) * np.ones_like(xs)).astype(np.uint8)
+        frame[..., 2] = 96
+
+        for s in range(shapes):
+            x, y = int(pos[s, 0]), int(pos[s, 1])
+            c = tuple(int(v) for v in colour[s])
+            if is_circle[s]:
+                cv2.circle(frame, (x, y), int(radius[s]), c, -1)
+            else:
+                r = int(radius[s])
+                cv2.rectangle(frame, (x - r, y - r), (x + r, y + r), c, -1)
+
+        yield frame
+
+        pos += vel
+        for axis, limit in ((0, width), (1, height)):
+            bounce = (pos[:, axis] < 0) | (pos[:, axis] > limit)
+            vel[bounce, axis] *= -1
+            pos[:, axis] = np.clip(pos[:, axis], 0, limit)
+
+
+def make_video(output_path, n_frames, width=320, height=240, fps=25, shapes=6, seed=0):
+    """Write a synthetic video to `output_path` (mp4)."""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise IOError(f"Could not open video writer for {output_path}")
+    try:
+        for frame in render_frames(n_frames, width, height, shapes, seed):
+            writer.write(frame)
+    finally:
+        writer.release()
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a synthetic moving-shapes video.")
+    parser.add_argument("output", type=str, help="Output video path (.mp4)")
+    parser.add_argument("--frames", type=int, default=200, help="Number of frames (default: 200)")
+    parser.add_argument("--width", type=int, default=320, help="Frame width (default: 320)")
+    parser.add_argument("--height", type=int, default=240, help="Frame height (default: 240)")
+    parser.add_argument("--fps", type=float, default=25, help="Frames per second (default: 25)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    make_video(args.output, args.frames, args.width, args.height, args.fps, seed=args.seed)
+    print(f"✅ Wrote {args.frames} frames to {args.output}")
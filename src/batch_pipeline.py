@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import queue
+from workspace import job_workspace, REPO_DIR
+
+# Batch reconstruction of a directory of videos.
+#
+# Every video is its own job with its own workspace (see workspace.py). Its
+# intermediate files go to <jobs_dir>/<video name>/data and its video and
+# report to <output_dir>/<video name>/. Jobs run on a pool of `workers`
+# processes. Each process is pinned to its own slice of cores, with a matching
+# torch thread count and decode worker count, so concurrent jobs share the host
+# without oversubscribing it. A failed job is recorded and the rest carry on. A
+# summary of every job is written to <output_dir>/batch_report.json.
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+_worker_cores = None
+
+
+def find_videos(input_dir):
+    """
+    Videos directly inside a directory, with a unique job name for each.
+
+    Returns:
+        list: (job name, video path) pairs, sorted by file name
+    """
+    files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(VIDEO_EXTENSIONS))
+    stems = [os.path.splitext(f)[0] for f in files]
+    videos = []
+    for name, stem in zip(files, stems):
+        # clip.mp4 and clip.mov would share a workspace; keep the extension for those
+        job_name = stem if stems.count(stem) == 1 else name.replace('.', '_')
+        videos.append((job_name, os.path.join(input_dir, name)))
+    return videos
+
+
+def _init_worker(core_slots):
+    """Pool initializer: pin this worker process to the next free slice of cores."""
+    global _worker_cores
+    try:
+        cores = core_slots.get_nowait()
+    except queue.Empty:
+        return
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    _worker_cores = cores
+
+
+def run_job(video_path, workspace, keep_workspace=False, **options):
+    """
+    Run the pipeline on one video in its workspace.
+
+    Args:
+        video_path: Input video
+        workspace: The job's Workspace
+        keep_workspace: Keep the intermediate files after a successful run
+        **options: Passed through to run_pipeline.run_pipeline
+
+    Returns:
+        dict: Video, output, status ('ok' or 'failed'), error and wall time
+    """
+    from run_pipeline import run_pipeline
+
+    if _worker_cores:
+        if options.get('threads') is None:
+            options['threads'] = len(_worker_cores)
+        if options.get('num_workers') is None:
+            options['num_workers'] = len(_worker_cores)
+
+    result = {'video': video_path, 'output': workspace.output_video, 'workspace': workspace.root}
+    start = time.perf_counter()
+    try:
+        run_pipeline(video_path, workspace=workspace.create(), **options)
+        result['status'] = 'ok'
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    result['seconds'] = round(time.perf_counter() - start, 2)
+
+    # Failed jobs keep their intermediate files for inspection
+    if result['status'] == 'ok' and not keep_workspace:
+        workspace.remove_data()
+    return result
+
+
+def run_batch(input_dir, output_dir, workers=2, jobs_dir=None, keep_workspaces=False, **options):
+    """
+    Reconstruct every video in a directory, `workers` jobs at a time.
+
+    Args:
+        input_dir: Directory with the input videos
+        output_dir: One sub-directory per video is created here for its output
+        workers: Jobs running at once, each in its own process on its own cores
+        jobs_dir: Where the per-job workspaces go. Defaults to data/jobs.
+        keep_workspaces: Keep the intermediate files of successful jobs
+        **options: Passed through to run_pipeline.run_pipeline
+                   (jumble_frames, fps, solver, feature_backend, ...)
+
+    Returns:
+        list: One result dict per video (see run_job)
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from sharded_features import split_cores
+
+    videos = find_videos(input_dir)
+    if not videos:
+        print(f"❌ No videos ({', '.join(VIDEO_EXTENSIONS)}) found in {input_dir}")
+        return []
+    jobs_dir = jobs_dir or os.path.join(REPO_DIR, 'data', 'jobs')
+    workers = max(1, min(workers, len(videos)))
+
+    # spawn, not fork: torch and OpenMP thread pools do not survive a fork
+    context = multiprocessing.get_context('spawn')
+    core_slots = context.Queue()
+    core_slices = split_cores(workers)
+    for cores in core_slices:
+        core_slots.put(cores)
+    print(f"🎬 Processing {len(videos)} videos with {workers} workers "
+          f"({', '.join(str(len(cores)) for cores in core_slices)} cores each)")
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(core_slots,)) as pool:
+        futures = {pool.submit(run_job, video_path, job_workspace(jobs_dir, name, output_dir),
+                               keep_workspaces, **options): video_path
+                   for name, video_path in videos}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. killed for running out of memory)
+                result = {'video': futures[future], 'status': 'failed', 'error': str(e)}
+            results.append(result)
+            mark = "✅" if result['status'] == 'ok' else "❌"
+            print(f"{mark} [{len(results)}/{len(videos)}] {os.path.basename(result['video'])}"
+                  + (f" in {result['seconds']:.1f}s" if 'seconds' in result else "")
+                  + (f": {result['error']}" if result['status'] != 'ok' else ""))
+
+    elapsed = time.perf_counter() - start
+    results.sort(key=lambda result: result['video'])
+    failed = sum(1 for result in results if result['status'] != 'ok')
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, 'batch_report.json')
+    with open(report_path, 'w') as f:
+        json.dump({'input_dir': os.path.abspath(input_dir), 'workers': workers,
+                   'wall_seconds': round(elapsed, 2), 'failed': failed, 'jobs': results}, f, indent=2)
+
+    print(f"\n🏁 {len(results) - failed}/{len(results)} videos reconstructed in {elapsed:.1f}s")
+    print(f"   Batch report saved to: {report_path}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    from feature_backends import BACKENDS, DEFAULT_BACKEND
+    from tsp_solver import SOLVERS
+
+    parser = argparse.ArgumentParser(description="Reconstruct every video in a directory, several at a time.")
+    parser.add_argument("--input_dir", type=str, required=True, help="Directory with the input videos")
+    parser.add_argument("--output_dir", type=str, default=os.path.join(REPO_DIR, 'output', 'batch'), help="Output root, one sub-directory per video (default: output/batch)")
+    parser.add_argument("--workers", type=int, default=2, help="Videos processed at once (default: 2)")
+    parser.add_argument("--jobs_dir", type=str, default=None, help="Where per-video workspaces go (default: data/jobs)")
+    parser.add_argument("--keep_workspaces", action="store_true", help="Keep the intermediate files of successful jobs")
+    parser.add_argument("--no_jumble", action="store_true", help="Skip frame jumbling")
+    parser.add_argument("--fps", type=float, default=None, help="Frames per second for the output videos (default: each video's own FPS)")
+    parser.add_argument("--streaming", action="store_true", help="Decode each video once in memory without writing frame images to disk")
+    parser.add_argument("--frame_store", action="store_true", help="Store frames in one memory-mapped file instead of per-frame JPEGs")
+    parser.add_argument("--solver", choices=sorted(SOLVERS), default="greedy_fast", help="Frame ordering engine (default: greedy_fast)")
+    parser.add_argument("--similarity", choices=["dense", "knn", "clustered"], default="dense", help="Dense NxN similarity matrix, sparse top-k neighbour graph or hierarchical scene clusters (default: dense)")
+    parser.add_argument("--feature_backend", choices=list(BACKENDS), default=DEFAULT_BACKEND, help="Feature extractor (default: resnet18)")
+    parser.add_argument("--inference", choices=["int8", "torchscript", "onnx"], default=None, help="Optimised CPU inference for CNN feature backends (default: float32)")
+    parser.add_argument("--batch_size", type=int, default=None, help="Frames per feature-extraction forward pass (default: pick from available memory)")
+    args = parser.parse_args()
+
+    run_batch(args.input_dir, args.output_dir, workers=args.workers, jobs_dir=args.jobs_dir,
+              keep_workspaces=args.keep_workspaces, jumble_frames=not args.no_jumble, fps=args.fps,
+              streaming=args.streaming, frame_store=args.frame_store, solver=args.solver,
+              similarity=args.similarity, feature_backend=args.feature_backend,
+              inference=args.inference, batch_size=args.batch_size)
@@ -1,14 +1,225 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import os
+import time
+from feature_index import load_features, save_frame_ids
+from progress import report
+from workspace import Workspace
 
-def build_similarity():
-    # Get the base directory (one level up from src)
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+def normalize_features(features):
+    """L2-normalise feature rows (float32) so dot products are cosine similarities."""
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
+
+def knn_similarity(features, k, block_size=2048):
+    """
+    Top-k cosine neighbours of every frame, computed block by block.
+
+    Only a block_size x block_size tile of similarities and the running
+    N x k result are held at once, so peak memory is O(N*k + block_size^2)
+    instead of the O(N^2) of a dense matrix.
+
+    Args:
+        features: NxD feature matrix
+        k: Neighbours to keep per frame (the frame itself is excluded)
+        block_size: Rows/columns per tile
+
+    Returns:
+        tuple: (indices, scores), both N x k, each row sorted by descending
+               similarity with ties broken towards the lower frame index
+    """
+    features = normalize_features(features)
+    n = features.shape[0]
+    k = max(1, min(k, n - 1))
+
+    indices = np.empty((n, k), dtype=np.int64)
+    scores = np.empty((n, k), dtype=np.float32)
+
+    for r0 in range(0, n, block_size):
+        rows = features[r0:r0 + block_size]
+        r1 = r0 + rows.shape[0]
+        best_idx = np.empty((rows.shape[0], 0), dtype=np.int64)
+        best_sim = np.empty((rows.shape[0], 0), dtype=np.float32)
+
+        for c0 in range(0, n, block_size):
+            cols = features[c0:c0 + block_size]
+            tile = rows @ cols.T
+            col_idx = np.arange(c0, c0 + cols.shape[0])
+
+            # Never list a frame as its own neighbour
+            overlap = np.arange(max(r0, c0), min(r1, c0 + cols.shape[0]))
+            tile[overlap - r0, overlap - c0] = -np.inf
+
+            cand_idx = np.concatenate([best_idx, np.broadcast_to(col_idx, tile.shape)], axis=1)
+            cand_sim = np.concatenate([best_sim, tile], axis=1)
+            if cand_sim.shape[1] > k:
+                keep = np.argpartition(-cand_sim, k - 1, axis=1)[:, :k]
+                cand_idx = np.take_along_axis(cand_idx, keep, axis=1)
+                cand_sim = np.take_along_axis(cand_sim, keep, axis=1)
+            best_idx, best_sim = cand_idx, cand_sim
+
+        rank = np.lexsort((best_idx, -best_sim), axis=1)
+        indices[r0:r1] = np.take_along_axis(best_idx, rank, axis=1)
+        scores[r0:r1] = np.take_along_axis(best_sim, rank, axis=1)
+        report('build_similarity', r1, n)
+
+    return indices, scores
+
+def _split_along_principal_axis(features, members, size, iterations=20):
+    """Cut an oversized cluster into contiguous runs of `size` frames along its main direction of change."""
+    x = features[members] - features[members].mean(axis=0)
+    v = np.random.default_rng(0).standard_normal(x.shape[1]).astype(np.float32)
+    for _ in range(iterations):
+        v = x.T @ (x @ v)
+        norm = np.linalg.norm(v)
+        if norm == 0:
+            break
+        v /= norm
+    ranked = members[np.argsort(x @ v, kind='stable')]
+    return [ranked[i:i + size] for i in range(0, len(ranked), size)]
+
+def cluster_features(features, cluster_size=512, batch_size=1024, iterations=None, seed=0,
+                     block_size=8192):
+    """
+    Group frames into scene clusters with mini-batch spherical k-means.
+
+    Centroids are seeded with k-means++ on a sample of the frames and refined
+    on random mini-batches, so the cost is O(N * clusters * D) rather than
+    O(N^2 * D). The number of clusters is N / cluster_size. Clusters of more
+    than twice cluster_size (a long static shot, say) are cut into runs along
+    their first principal component, which keeps every cluster small enough
+    to order with a dense similarity matrix.
+
+    Args:
+        features: NxD feature matrix
+        cluster_size: Target frames per cluster
+        batch_size: Frames per mini-batch update
+        iterations: Mini-batch updates. Defaults to about two passes over the
+                    frames (between 20 and 500 updates).
+        seed: Seed of the sampling
+        block_size: Rows per block in the final assignment pass
+
+    Returns:
+        np.ndarray: Cluster label of every frame, 0..clusters-1
+    """
+    features = normalize_features(features)
+    n = features.shape[0]
+    n_clusters = max(1, min(n, -(-n // cluster_size)))
+    rng = np.random.default_rng(seed)
+
+    labels = np.zeros(n, dtype=np.int64)
+    if n_clusters > 1:
+        # k-means++ seeding: squared distance between unit vectors is 2 - 2 * cosine
+        sample = features[np.sort(rng.choice(n, min(n, max(20 * n_clusters, 4096)), replace=False))]
+        centroids = np.empty((n_clusters, features.shape[1]), dtype=np.float32)
+        centroids[0] = sample[rng.integers(len(sample))]
+        best = sample @ centroids[0]
+        for c in range(1, n_clusters):
+            weights = np.maximum(2.0 - 2.0 * best, 0.0).astype(np.float64)
+            total = weights.sum()
+            pick = rng.choice(len(sample), p=weights / total) if total > 0 else rng.integers(len(sample))
+            centroids[c] = sample[pick]
+            np.maximum(best, sample @ centroids[c], out=best)
+
+        if iterations is None:
+            iterations = min(500, max(20, 2 * n // batch_size))
+        counts = np.zeros(n_clusters, dtype=np.float64)
+        for step in range(iterations):
+            batch = features[rng.integers(0, n, min(batch_size, n))]
+            assigned = (batch @ centroids.T).argmax(axis=1)
+            batch_counts = np.bincount(assigned, minlength=n_clusters)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, batch)
+            updated = batch_counts > 0
+            # Running mean of everything each centroid has been assigned so far
+            total = counts[updated] + batch_counts[updated]
+            centroids[updated] = ((centroids[updated] * counts[updated, None] + sums[updated])
+                                  / total[:, None]).astype(np.float32)
+            counts[updated] = total
+            centroids = normalize_features(centroids)
+            report('build_similarity', step + 1, iterations)
+
+        for r0 in range(0, n, block_size):
+            labels[r0:r0 + block_size] = (features[r0:r0 + block_size] @ centroids.T).argmax(axis=1)
+
+    clusters = []
+    for members in np.split(np.argsort(labels, kind='stable'),
+                            np.flatnonzero(np.diff(np.sort(labels))) + 1):
+        if len(members) > 2 * cluster_size:
+            clusters.extend(_split_along_principal_axis(features, members, cluster_size))
+        else:
+            clusters.append(members)
+    for label, members in enumerate(clusters):
+        labels[members] = label
+    return labels
+
+def dense_similarity(features, output_path, dtype=np.float32, block_size=2048):
+    """
+    Full NxN cosine similarity matrix, written tile by tile to an .npy memmap.
+
+    Features are L2-normalised once, then each block_size x block_size tile
+    is a float32 matrix multiply. The matrix is symmetric, so only tiles on
+    or above the diagonal are computed and each one is mirrored into place.
+    Neither the N x N result nor a full row band is ever held in RAM.
+
+    Args:
+        features: NxD feature matrix
+        output_path: .npy file to create
+        dtype: Storage dtype of the matrix (np.float32 or np.float16)
+        block_size: Rows/columns per tile
+
+    Returns:
+        tuple: (min similarity, max similarity, distinct pairs computed per second)
+    """
+    features = normalize_features(features)
+    n = features.shape[0]
+    matrix = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=(n, n))
+
+    lo, hi = np.inf, -np.inf
+    start = time.perf_counter()
+
+    for r0 in range(0, n, block_size):
+        rows = features[r0:r0 + block_size]
+        for c0 in range(r0, n, block_size):
+            cols = features[c0:c0 + block_size]
+            tile = rows @ cols.T
+            matrix[r0:r0 + rows.shape[0], c0:c0 + cols.shape[0]] = tile
+            if c0 != r0:
+                matrix[c0:c0 + cols.shape[0], r0:r0 + rows.shape[0]] = tile.T
+            lo = min(lo, float(tile.min()))
+            hi = max(hi, float(tile.max()))
+        report('build_similarity', r0 + rows.shape[0], n)
+
+    matrix.flush()
+    del matrix
+    elapsed = time.perf_counter() - start
+    # Only the upper triangle (diagonal included) is computed; the rest is mirrored
+    return lo, hi, (n * (n + 1) // 2) / max(elapsed, 1e-9)
+
+def build_similarity(mode='dense', k=32, block_size=2048, dtype='float32', cluster_size=512,
+                     workspace=None):
+    """
+    Build the frame similarity graph from the extracted features.
+
+    Args:
+        mode: 'dense' saves the full NxN matrix to data/similarity_matrix.npy,
+              'knn' saves only the top-k neighbours per frame to data/similarity_knn.npz,
+              'clustered' saves scene cluster labels to data/scene_clusters.npz
+              (solved hierarchically, see tsp_solver.tsp_reorder_clustered).
+              Either way the frame IDs of the rows are saved alongside.
+        k: Neighbours kept per frame in 'knn' mode
+        cluster_size: Target frames per scene cluster in 'clustered' mode
+        block_size: Rows/columns per tile
+        dtype: Storage dtype of the dense matrix, 'float32' or 'float16'
+        workspace: Job workspace to read and write (see workspace.py).
+                   Defaults to the repository's data/ directory.
+    """
+    workspace = workspace or Workspace()
     
     # Define file paths - check both locations for compatibility
-    features_path_new = os.path.join(base_dir, 'data', 'features', 'frame_features.npy')
-    features_path_old = os.path.join(base_dir, 'data', 'frame_features.npy')
+    features_path_new = workspace.features_path
+    features_path_old = os.path.join(workspace.data_dir, 'frame_features.npy')
     
     # Use new location if it exists, otherwise fall back to old
     if os.path.exists(features_path_new):
@@ -16,7 +227,9 @@ def build_similarity():
     else:
         features_path = features_path_old
     
-    output_path = os.path.join(base_dir, 'data', 'similarity_matrix.npy')
+    output_path = workspace.similarity_path
+    knn_path = workspace.knn_path
+    clusters_path = workspace.clusters_path
     
     # Check if feature file exists
     if not os.path.exists(features_path):
@@ -24,18 +237,60 @@ def build_similarity():
         return
 
     print(f"Loading features from: {features_path}")
-    features = np.load(features_path)
+    features, ids = load_features(features_path)
     print(f"✅ Loaded features with shape: {features.shape}")
 
-    # Compute similarity matrix
-    print("🧠 Computing cosine similarity between frames...")
-    similarity_matrix = cosine_similarity(features)
+    if mode == 'knn':
+        print(f"🧠 Computing top-{k} cosine neighbours per frame (blocks of {block_size})...")
+        start = time.perf_counter()
+        indices, scores = knn_similarity(features, k, block_size=block_size)
+        elapsed = time.perf_counter() - start
+        np.savez(knn_path, indices=indices, scores=scores,
+                 features_path=np.array(features_path))
+        save_frame_ids(ids, knn_path)
+        print(f"✅ Saved sparse similarity graph to {knn_path}")
+        print(f"Graph shape: {indices.shape[0]} frames x {indices.shape[1]} neighbours")
+        print(f"Neighbour scores range: {np.min(scores):.2f} to {np.max(scores):.2f}")
+        print(f"Throughput: {len(features) ** 2 / max(elapsed, 1e-9):,.0f} pairs/sec")
+        return
+
+    if mode == 'clustered':
+        print(f"🧠 Clustering frames into scenes of about {cluster_size} frames (mini-batch k-means)...")
+        start = time.perf_counter()
+        labels = cluster_features(features, cluster_size=cluster_size)
+        elapsed = time.perf_counter() - start
+        np.savez(clusters_path, labels=labels, features_path=np.array(features_path))
+        save_frame_ids(ids, clusters_path)
+        sizes = np.bincount(labels)
+        print(f"✅ Saved scene clusters to {clusters_path}")
+        print(f"Clusters: {len(sizes)} (sizes {sizes.min()} to {sizes.max()}, median {int(np.median(sizes))})")
+        print(f"Clustered {len(features)} frames in {elapsed:.2f}s")
+        return
+
+    # Compute similarity matrix straight into the output file
+    print(f"🧠 Computing cosine similarity between frames ({dtype}, blocks of {block_size})...")
+    lo, hi, pairs_per_sec = dense_similarity(features, output_path, dtype=np.dtype(dtype),
+                                             block_size=block_size)
+    save_frame_ids(ids, output_path)
     
-    # Save the similarity matrix
-    np.save(output_path, similarity_matrix)
     print(f"✅ Saved similarity matrix to {output_path}")
-    print(f"Matrix shape: {similarity_matrix.shape}")
-    print(f"Similarity scores range: {np.min(similarity_matrix):.2f} to {np.max(similarity_matrix):.2f}")
+    print(f"Matrix shape: ({len(features)}, {len(features)})")
+    print(f"Similarity scores range: {lo:.2f} to {hi:.2f}")
+    print(f"Throughput: {pairs_per_sec:,.0f} pairs/sec")
 
 if __name__ == "__main__":
-    build_similarity()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the frame similarity graph.")
+    parser.add_argument("--mode", choices=["dense", "knn", "clustered"], default="dense",
+                        help="Full NxN matrix, sparse top-k neighbour graph or scene clusters (default: dense)")
+    parser.add_argument("--k", type=int, default=32, help="Neighbours per frame in knn mode")
+    parser.add_argument("--cluster_size", type=int, default=512,
+                        help="Target frames per scene cluster in clustered mode (default: 512)")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32",
+                        help="Storage dtype of the dense matrix (default: float32)")
+    parser.add_argument("--block_size", type=int, default=2048, help="Rows/columns per tile")
+    args = parser.parse_args()
+
+    build_similarity(mode=args.mode, k=args.k, block_size=args.block_size, dtype=args.dtype,
+                     cluster_size=args.cluster_size)
@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import numpy as np
+
+# Long-lived local embedding server.
+#
+# Every pipeline run otherwise pays for importing torch, building the backbone
+# and loading its weights before it embeds a single frame. The server does
+# that once and then embeds batches for any number of runs on this machine.
+# It listens on a Unix socket. Clients still decode and preprocess frames
+# themselves (in their decode workers), send the preprocessed float32 batch and
+# get the (B, D) features back.
+#
+# Requests from concurrent clients are batched dynamically: the batching
+# thread takes the first waiting request, then keeps collecting requests
+# until it has `max_batch` frames or `max_wait_ms` has passed, runs them
+# through the model in one forward pass and splits the features back up.
+#
+# extract_features() uses a running server automatically when it serves the
+# same model_id as the requested backend. Otherwise, or if the server goes
+# away mid-run, it embeds locally.
+#
+# Wire format, both directions: 4-byte big-endian header length, JSON header,
+# then header['payload'] bytes of raw array data.
+#
+#   {'op': 'info'}                          -> {'model_id', 'name', 'max_batch'}
+#   {'op': 'embed', 'shape': [B, ...]}      -> {'shape': [B, D]} + float32 features
+#   any error                               -> {'error': message}
+
+SOCKET_ENV = 'FRAME_EMBEDDING_SOCKET'
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(),
+                              f"jumbled-frames-embedding-{os.getuid() if hasattr(os, 'getuid') else 0}.sock")
+CLIENT_TIMEOUT = 600.0
+
+
+def server_socket_path():
+    """Socket of the local embedding server: $FRAME_EMBEDDING_SOCKET or a per-user temp file."""
+    return os.environ.get(SOCKET_ENV) or DEFAULT_SOCKET
+
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Embedding server connection closed")
+        received += n
+    return buf
+
+
+def send_message(sock, header, payload=b''):
+    """Send a JSON header and an optional binary payload."""
+    head = json.dumps(dict(header, payload=len(payload))).encode()
+    sock.sendall(struct.pack('!I', len(head)) + head)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """
+    Receive one message.
+
+    Returns:
+        tuple: (header dict, payload bytearray)
+    """
+    (size,) = struct.unpack('!I', _recv_exact(sock, 4))
+    header = json.loads(bytes(_recv_exact(sock, size)))
+    payload = _recv_exact(sock, header['payload']) if header['payload'] else bytearray()
+    return header, payload
+
+
+class DynamicBatcher:
+    """
+    Runs the embeddings of concurrent requests through the model together.
+
+    Args:
+        backend: Loaded feature backend
+        max_batch: Frames per forward pass
+        max_wait_ms: How long the first request of a batch waits for others to join it
+    """
+
+    def __init__(self, backend, max_batch=64, max_wait_ms=5.0):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.frames = 0
+        thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        thread.start()
+
+    def embed(self, frames):
+        """Embed an (N, ...) array of preprocessed frames, blocking until its features are ready."""
+        request = {'frames': frames, 'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise RuntimeError(request['error'])
+        return request['features']
+
+    def _collect(self):
+        pending = [self.requests.get()]
+        count = len(pending[0]['frames'])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            count += len(request['frames'])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            try:
+                frames = np.concatenate([request['frames'] for request in pending])
+                features = np.concatenate([self.backend.embed(frames[start:start + self.max_batch])
+                                           for start in range(0, len(frames), self.max_batch)])
+                offset = 0
+                for request in pending:
+                    request['features'] = features[offset:offset + len(request['frames'])]
+                    offset += len(request['frames'])
+                self.batches += 1
+                self.frames += len(frames)
+            except Exception as e:
+                for request in pending:
+                    request['error'] = f"{type(e).__name__}: {e}"
+            for request in pending:
+                request['done'].set()
+
+
+def serve(socket_path=None, backend=None, weights=None, threads=None, max_batch=64, max_wait_ms=5.0):
+    """
+    Load a feature backend and serve embeddings on a Unix socket until interrupted.
+
+    Args:
+        socket_path: Socket to listen on. Defaults to server_socket_path().
+        backend: Feature backend name (default: resnet18)
+        weights: Local weights file for CNN backends
+        threads: Intra-op threads for CPU inference
+        max_batch: Frames per forward pass
+        max_wait_ms: How long a request waits for others to batch with
+    """
+    import socketserver
+    from feature_backends import get_backend
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError("The embedding server needs Unix domain sockets, which this platform lacks")
+    socket_path = socket_path or server_socket_path()
+
+    model = get_backend(backend, weights=weights, threads=threads)
+    start = time.perf_counter()
+    model.load()
+    print(f"🧠 Loaded {model.name} in {time.perf_counter() - start:.2f}s")
+    batcher = DynamicBatcher(model, max_batch=max_batch, max_wait_ms=max_wait_ms)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    header, payload = recv_message(self.request)
+                except (ConnectionError, OSError):
+                    return
+                try:
+                    if header.get('op') == 'info':
+                        send_message(self.request, {'model_id': model.model_id, 'name': model.name,
+                                                    'max_batch': max_batch})
+                    elif header.get('op') == 'embed':
+                        frames = np.frombuffer(payload, dtype=np.float32).reshape(header['shape'])
+                        features = np.ascontiguousarray(batcher.embed(frames), dtype=np.float32)
+                        send_message(self.request, {'shape': list(features.shape)}, features.tobytes())
+                    else:
+                        send_message(self.request, {'error': f"Unknown op {header.get('op')!r}"})
+                except (ConnectionError, OSError):
+                    return
+                except Exception as e:
+                    send_message(self.request, {'error': f"{type(e).__name__}: {e}"})
+
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)  # left behind by a server that did not shut down cleanly
+        else:
+            raise RuntimeError(f"An embedding server is already listening on {socket_path}")
+        finally:
+            probe.close()
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    print(f"🚀 Serving {model.model_id} on {socket_path} (batches of up to {max_batch}, "
+          f"{max_wait_ms:g} ms wait)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        print(f"🛑 Embedding server stopped after {batcher.frames} frames in {batcher.batches} batches")
+
+
+class RemoteBackend:
+    """
+    Feature backend whose forward passes run in the embedding server.
+
+    Preprocessing, batch sizing and the model_id come from the local backend it
+    wraps. The local model is not touched (nor torch imported) unless the server
+    stops answering. Then it is loaded and used for the rest of the run.
+
+    Args:
+        local: The backend the server stands in for
+        sock: Connected socket
+        socket_path: Server socket, for messages
+    """
+
+    optimize = None
+    device = None
+    cacheable = True
+    calibration_id = None
+
+    def __init__(self, local, sock, socket_path):
+        self.local = local
+        self.sock = sock
+        self.socket_path = socket_path
+        self.name = local.name
+        self.preprocess = local.preprocess
+        self.model_id = local.model_id
+        self.bytes_per_frame = local.bytes_per_frame
+
+    def load(self):
+        if self.sock is None:
+            self.local.load()
+
+    def calibrate(self, sample):
+        pass
+
+    def embed(self, batch):
+        if self.sock is not None:
+            frames = np.ascontiguousarray(np.stack(batch), dtype=np.float32)
+            try:
+                send_message(self.sock, {'op': 'embed', 'shape': list(frames.shape)}, frames.tobytes())
+                header, payload = recv_message(self.sock)
+                if 'error' in header:
+                    raise RuntimeError(header['error'])
+                return np.frombuffer(payload, dtype=np.float32).reshape(header['shape'])
+            except (OSError, ConnectionError, RuntimeError, ValueError) as e:
+                print(f"\n⚠️ Embedding server at {self.socket_path} failed ({e}); embedding locally")
+                self.close()
+                self.local.load()
+        return self.local.embed(batch)
+
+    def release(self):
+        if self.sock is None:
+            self.local.release()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def connect_embedding_server(backend, socket_path=None):
+    """
+    Route a backend's forward passes through the local embedding server, if one
+    is running for the same model_id.
+
+    Args:
+        backend: The backend the caller would otherwise load
+        socket_path: Server socket. Defaults to server_socket_path().
+
+    Returns:
+        RemoteBackend, or `backend` itself when no matching server answers
+    """
+    socket_path = socket_path or server_socket_path()
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return backend
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(2.0)
+        sock.connect(socket_path)
+        send_message(sock, {'op': 'info'})
+        info, _ = recv_message(sock)
+    except (OSError, ConnectionError, ValueError):
+        sock.close()
+        return backend
+
+    if info.get('model_id') != backend.model_id:
+        print(f"Embedding server at {socket_path} serves {info.get('name')}, not {backend.name}; "
+              "embedding locally")
+        sock.close()
+        return backend
+
+    sock.settimeout(CLIENT_TIMEOUT)
+    print(f"Embedding with the server at {socket_path} ({info['name']})")
+    return RemoteBackend(backend, sock, socket_path)
+
+
+if __name__ == "__main__":
+    import argparse
+    from feature_backends import BACKENDS, DEFAULT_BACKEND
+
+    parser = argparse.ArgumentParser(description="Serve frame embeddings to pipeline runs on this machine.")
+    parser.add_argument("--socket", type=str, default=None, help=f"Unix socket to listen on (default: ${SOCKET_ENV} or {DEFAULT_SOCKET})")
+    parser.add_argument("--feature_backend", choices=list(BACKENDS), default=DEFAULT_BACKEND, help="Feature backend to serve (default: resnet18)")
+    parser.add_argument("--feature_weights", type=str, default=None, help="Local weights file instead of downloading them")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for CPU inference (default: torch default)")
+    parser.add_argument("--max_batch", type=int, default=64, help="Frames per forward pass (default: 64)")
+    parser.add_argument("--max_wait_ms", type=float, default=5.0, help="How long a request waits for others to batch with (default: 5)")
+    args = parser.parse_args()
+
+    serve(args.socket, backend=args.feature_backend, weights=args.feature_weights,
+          threads=args.threads, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
@@ -1,14 +1,55 @@
 import cv2
 import os
+import json
 from tqdm import tqdm
+from frame_store import FrameStoreWriter, is_frame_store
+from progress import report
+
+def probe_video(video_path):
+    """
+    Read basic stream properties without decoding any frames.
+
+    Returns:
+        tuple: (fps, width, height, total_frames)
+    """
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return fps, width, height, total_frames
+
+def save_video_metadata(metadata_path, fps, width, height, total_frames):
+    """Save video metadata so later stages can reuse the original FPS and size."""
+    metadata = {
+        'fps': fps,
+        'width': width,
+        'height': height,
+        'total_frames': total_frames
+    }
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+def extract_frames(video_path, output_dir, workspace=None):
+    """
+    Decode every frame of a video into `output_dir`.
+
+    `output_dir` is either a directory (one JPEG per frame) or a frame store
+    header path ending in .json (all frames in one memory-mapped file).
+    The video metadata goes to the workspace's video_metadata.json (see
+    workspace.py); without a workspace, to data/ two levels above output_dir.
+    """
+    use_store = is_frame_store(output_dir)
 
-def extract_frames(video_path, output_dir):
     # Clear the output directory if it exists
     import shutil
-    import json
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
-    os.makedirs(output_dir, exist_ok=True)
+    if use_store:
+        os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+    else:
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
     
     cap = cv2.VideoCapture(video_path)
 
@@ -23,28 +64,33 @@ def extract_frames(video_path, output_dir):
     print(f"  - Resolution: {width}x{height}")
 
     idx = 0
+    store = None
     while True:
         ret, frame = cap.read()
         if not ret:
             break
-        frame_path = os.path.join(output_dir, f"frame_{idx:04d}.jpg")
-        cv2.imwrite(frame_path, frame)
+        if use_store:
+            if store is None:
+                store = FrameStoreWriter(output_dir, frame.shape[0], frame.shape[1],
+                                         capacity=total_frames)
+            store.append(frame)
+        else:
+            frame_path = os.path.join(output_dir, f"frame_{idx:04d}.jpg")
+            cv2.imwrite(frame_path, frame)
         idx += 1
+        report('extract_frames', idx, total_frames)
 
     cap.release()
+    if store is not None:
+        store.close()
     
     # Save video metadata for later use
-    metadata = {
-        'fps': fps,
-        'width': width,
-        'height': height,
-        'total_frames': idx
-    }
-    
-    base_dir = os.path.dirname(os.path.dirname(output_dir))
-    metadata_path = os.path.join(base_dir, 'data', 'video_metadata.json')
-    with open(metadata_path, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    if workspace is not None:
+        metadata_path = workspace.metadata_path
+    else:
+        base_dir = os.path.dirname(os.path.dirname(output_dir))
+        metadata_path = os.path.join(base_dir, 'data', 'video_metadata.json')
+    save_video_metadata(metadata_path, fps, width, height, idx)
     
     print(f"✅ Extracted {idx} frames to {output_dir}")
     print(f"📝 Saved video metadata (FPS: {fps:.2f})")
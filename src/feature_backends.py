@@ -0,0 +1,366 @@
+import os
+import time
+import hashlib
+import numpy as np
+from functools import partial
+
+# Feature backends: everything that turns a decoded frame into a feature vector.
+#
+# A backend has a `preprocess` function that runs in the decode workers (it must
+# be a picklable module-level function, so worker processes can use it) and an
+# `embed` method that turns a batch of preprocessed frames into an (B, D) array.
+# Handcrafted descriptors do all their work in `preprocess`, so they need no
+# model, no torch and no downloaded weights. CNN backends do the forward pass
+# in `embed`.
+#
+# Each backend has a `model_id` that goes into feature cache keys and stage
+# manifests. It must change whenever the backbone, weights or preprocessing do.
+#
+# Creating a backend is cheap: cv2, torch and torchvision are only imported
+# once frames are preprocessed or the model is loaded, so callers that only
+# need a model_id (manifests, --help, skipped stages) never pay for them.
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+DEFAULT_BACKEND = 'resnet18'
+
+
+def preprocess_imagenet(img, size=224):
+    """
+    Turn a decoded BGR frame into a normalised model input without going through PIL.
+
+    Args:
+        img: HxWx3 uint8 BGR frame as returned by cv2.imread
+        size: Side of the square model input
+
+    Returns:
+        np.ndarray: 3 x size x size float32 array (CHW, RGB, ImageNet-normalised)
+    """
+    import cv2
+    # Resize first so colour conversion and normalisation touch size x size pixels only.
+    # INTER_AREA averages source pixels, matching the antialiased PIL downscale.
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    x = img.astype(np.float32) * (1.0 / 255.0)
+    x -= IMAGENET_MEAN
+    x /= IMAGENET_STD
+    return np.ascontiguousarray(x.transpose(2, 0, 1))
+
+
+def thumbnail_descriptor(img, size=32):
+    """
+    Downsampled grayscale thumbnail, zero-mean and unit-norm.
+
+    Removing the mean makes the cosine similarity of two thumbnails their
+    pixel correlation, so a global brightness change does not dominate it.
+    """
+    import cv2
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    x = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    x -= x.mean()
+    norm = np.linalg.norm(x)
+    return x / norm if norm > 0 else x
+
+
+def histogram_descriptor(img, bins=8, max_side=160):
+    """
+    HSV colour histogram with bins^3 cells.
+
+    The square root of the normalised histogram is returned, so the cosine
+    similarity of two descriptors is their Bhattacharyya coefficient.
+    """
+    import cv2
+    scale = max_side / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [bins] * 3, [0, 180, 0, 256, 0, 256]).ravel()
+    total = hist.sum()
+    return np.sqrt(hist / total) if total > 0 else hist
+
+
+def phash_descriptor(img, hash_size=8):
+    """
+    DCT perceptual hash as a +/-1 vector of hash_size^2 bits.
+
+    For +/-1 vectors, cosine similarity is 1 - 2 * hamming distance / bits.
+    """
+    import cv2
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    side = hash_size * 4
+    x = cv2.resize(gray, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(x)[:hash_size, :hash_size].ravel()
+    return np.where(low > np.median(low), 1.0, -1.0).astype(np.float32)
+
+
+class DescriptorBackend:
+    """
+    Handcrafted descriptor computed entirely in the decode workers.
+
+    Args:
+        name: Registry name
+        preprocess: Picklable function BGR frame -> 1-D float32 descriptor
+        model_id: Feature cache / manifest identifier
+    """
+
+    # Descriptors are tiny, so batch size only sets how many frames are stacked at once
+    bytes_per_frame = 64 * 1024
+    optimize = None
+    cacheable = True
+    calibration_id = None
+
+    def __init__(self, name, preprocess, model_id):
+        self.name = name
+        self.preprocess = preprocess
+        self.model_id = model_id
+        self.device = None
+
+    def load(self):
+        pass
+
+    def calibrate(self, sample):
+        pass
+
+    def embed(self, batch):
+        return np.stack(batch).astype(np.float32, copy=False)
+
+    def release(self):
+        pass
+
+
+class TorchvisionBackend:
+    """
+    Torchvision classification network with its classifier removed.
+
+    Args:
+        name: Registry name
+        arch: torchvision.models constructor name (e.g. 'resnet18')
+        input_size: Side of the square model input
+        bytes_per_frame: Rough per-frame memory cost of a forward pass, used to size batches
+        weights: Optional local state_dict file. Without it the ImageNet weights
+                 are fetched through torchvision (downloaded on first use).
+        optimize: Optimised CPU inference mode from inference_optim.OPTIMIZE_MODES
+                  ('int8', 'torchscript' or 'onnx'), applied in calibrate(). None
+                  runs the float32 model.
+        threads: Intra-op threads for CPU inference. None keeps torch's default.
+        cache_dir: Where exported graphs and the ready-to-run backbone are cached
+                   (default: data/cache/models)
+    """
+
+    def __init__(self, name, arch, input_size, bytes_per_frame, weights=None,
+                 optimize=None, threads=None, cache_dir=None):
+        self.name = name
+        self.arch = arch
+        self.input_size = input_size
+        self.bytes_per_frame = bytes_per_frame
+        self.weights = weights
+        self.optimize = optimize
+        self.threads = threads
+        self.cache_dir = cache_dir
+        self.preprocess = partial(preprocess_imagenet, size=input_size)
+        self.model = None
+        self.optimize_report = None
+        self.calibration_id = None
+        self._device = None
+
+        if optimize is not None:
+            from inference_optim import OPTIMIZE_MODES
+            if optimize not in OPTIMIZE_MODES:
+                raise ValueError(f"Unknown inference mode '{optimize}'. "
+                                 f"Choose from: {', '.join(OPTIMIZE_MODES)}")
+
+        # Same layout as the original ResNet-18 id, so existing caches stay valid
+        if weights is None:
+            weights_id = 'imagenet'
+        else:
+            from manifest import file_digest
+            weights_id = f"local-{file_digest(weights)[:16]}"
+        self.model_id = (f"{arch}-{weights_id}-avgpool|{input_size}x{input_size}"
+                         "|cv2-inter-area|rgb|imagenet-norm")
+        self.fp32_model_id = self.model_id
+        if optimize is not None:
+            # Optimised graphs give slightly different features, so never share cache entries
+            self.model_id += f"|{optimize}"
+        # int8 features also depend on the per-video calibration, which the
+        # model_id cannot capture: rows calibrated on different videos must
+        # never be mixed, so int8 runs bypass the feature cache and record the
+        # calibration in calibration_id (see features_id)
+        self.cacheable = optimize != 'int8'
+
+    @property
+    def device(self):
+        """torch.device the model runs on (importing torch the first time it is asked for)."""
+        if self._device is None:
+            import torch
+            if self.optimize is not None:
+                # Optimised graphs target the CPU fleet
+                self._device = torch.device("cpu")
+            else:
+                self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        return self._device
+
+    def backbone_cache_path(self):
+        """Traced TorchScript copy of the headless float32 network, keyed by model and torch version."""
+        import torch
+        from inference_optim import graph_cache_path
+        return graph_cache_path(self.cache_dir, f"{self.fp32_model_id}|torch-{torch.__version__}",
+                                'backbone', '.pt')
+
+    def load(self):
+        """
+        Load the network in eval mode, channels-last layout, on self.device.
+
+        The float32 backbone is loaded from a traced TorchScript copy in the
+        model cache when there is one, which skips importing torchvision,
+        building the network in Python and reading the checkpoint. Tracing
+        records the same operators without fusing anything, so the features
+        are identical and the model_id (and every feature cache entry) stays
+        valid. The first load builds the network from torchvision and writes
+        the copy. Optimised modes start from the torchvision network, which
+        int8 quantization needs.
+
+        A backend that is already loaded is left as it is, so a long-lived
+        process (see job_worker.py) can keep one warm across runs.
+        """
+        if self.model is not None:
+            return
+        import torch
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.device.type == 'cpu':
+            print(f"Intra-op threads: {torch.get_num_threads()}")
+
+        start = time.perf_counter()
+        model = None
+        cache_path = self.backbone_cache_path()
+        if self.optimize is None and os.path.exists(cache_path):
+            try:
+                model = torch.jit.load(cache_path, map_location='cpu')
+                source = 'cached TorchScript backbone'
+            except Exception as e:
+                print(f"⚠️ Could not load cached backbone {cache_path} ({e}); rebuilding it")
+
+        if model is None:
+            model = self._build()
+            source = 'torchvision'
+            if self.optimize is None:
+                self._save_backbone(model, cache_path)
+
+        model.to(self.device, memory_format=torch.channels_last)
+        model.eval()
+        self.model = model
+        print(f"Loaded {self.name} from {source} in {time.perf_counter() - start:.2f}s")
+
+    def _save_backbone(self, model, path):
+        import torch
+        try:
+            with torch.inference_mode():
+                example = torch.zeros(1, 3, self.input_size, self.input_size)
+                traced = torch.jit.trace(model.eval(), example)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so concurrent runs never load a half-written file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.jit.save(traced, tmp_path)
+            os.replace(tmp_path, path)
+            print(f"Saved ready-to-run backbone to {path}")
+        except Exception as e:
+            print(f"⚠️ Could not cache the backbone ({e}); the next run builds it again")
+
+    def _build(self):
+        """Build the headless float32 network from torchvision on the CPU."""
+        import torch
+        import torchvision.models as models
+
+        if self.weights is None:
+            model = getattr(models, self.arch)(pretrained=True)
+        else:
+            if not os.path.exists(self.weights):
+                raise FileNotFoundError(f"Model weights not found: {self.weights}")
+            model = getattr(models, self.arch)(pretrained=False)
+            state = torch.load(self.weights, map_location='cpu')
+            model.load_state_dict(state.get('state_dict', state) if isinstance(state, dict) else state)
+
+        if hasattr(model, 'fc'):
+            model = torch.nn.Sequential(*list(model.children())[:-1])  # remove classification layer
+        else:
+            # MobileNet-style: features + global pooling, classifier dropped
+            model = torch.nn.Sequential(model.features, model.avgpool)
+        return model.eval()
+
+    def calibrate(self, sample):
+        """
+        Swap the float32 model for its optimised version (see inference_optim.py).
+
+        Args:
+            sample: List of preprocessed frames from the video, used to calibrate
+                    int8 quantization and to measure speedup and feature drift
+        """
+        if self.optimize is None or not sample or self.optimize_report is not None:
+            return  # float32 run, or already optimised
+        import torch
+        from inference_optim import optimize_model
+        stacked = np.ascontiguousarray(np.stack(sample), dtype=np.float32)
+        if self.optimize == 'int8':
+            self.calibration_id = hashlib.blake2b(stacked.tobytes(), digest_size=8).hexdigest()
+        calibration = torch.from_numpy(stacked).contiguous(memory_format=torch.channels_last)
+        self.model, self.optimize_report = optimize_model(
+            self.model, self.optimize, calibration, self.fp32_model_id,
+            torch.get_num_threads(), cache_dir=self.cache_dir)
+
+    def embed(self, batch):
+        import torch
+        tensor = torch.from_numpy(np.stack(batch)).to(self.device, memory_format=torch.channels_last)
+        with torch.inference_mode():
+            return self.model(tensor).flatten(1).cpu().numpy()
+
+    def release(self):
+        if self._device is not None and self._device.type == 'cuda':
+            import torch
+            torch.cuda.empty_cache()
+
+
+BACKENDS = {
+    # ResNet-18 at 224x224, the original backbone
+    'resnet18': lambda **options: TorchvisionBackend(
+        'resnet18', 'resnet18', 224, 64 * 1024 * 1024, **options),
+    # Same network at a quarter of the pixels: roughly 4x faster on CPU
+    'resnet18_112': lambda **options: TorchvisionBackend(
+        'resnet18_112', 'resnet18', 112, 16 * 1024 * 1024, **options),
+    'mobilenet_v3_small': lambda **options: TorchvisionBackend(
+        'mobilenet_v3_small', 'mobilenet_v3_small', 224, 16 * 1024 * 1024, **options),
+    'thumbnail': lambda **options: DescriptorBackend(
+        'thumbnail', partial(thumbnail_descriptor, size=32), "thumbnail|gray|32x32|cv2-inter-area|zero-mean"),
+    'histogram': lambda **options: DescriptorBackend(
+        'histogram', partial(histogram_descriptor, bins=8), "histogram|hsv|8x8x8|sqrt"),
+    'phash': lambda **options: DescriptorBackend(
+        'phash', partial(phash_descriptor, hash_size=8), "phash|dct|8x8|median"),
+}
+
+
+def features_id(backend):
+    """
+    Identifier of the features a backend produces: its model_id, plus the
+    calibration fingerprint for backends whose features depend on it (int8).
+    Rows with different features_ids must never end up in one feature array.
+    """
+    if backend.calibration_id is None:
+        return backend.model_id
+    return f"{backend.model_id}|calibration-{backend.calibration_id}"
+
+
+def get_backend(name=None, weights=None, optimize=None, threads=None):
+    """
+    Create a feature backend by registry name.
+
+    Args:
+        name: Key of BACKENDS. Defaults to DEFAULT_BACKEND.
+        weights: Local weights file for CNN backends (ignored by descriptors)
+        optimize: Optimised CPU inference mode for CNN backends (ignored by descriptors)
+        threads: Intra-op threads for CNN backends (ignored by descriptors)
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown feature backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[name](weights=weights, optimize=optimize, threads=threads)
@@ -0,0 +1,112 @@
+import os
+import time
+import hashlib
+import sqlite3
+import numpy as np
+
+# Persistent feature cache: one SQLite file mapping
+#   key = hash(frame content hash, model/preprocessing id) -> feature vector
+# with a total size cap enforced by evicting the least recently used entries.
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+
+def cache_key(frame_hash, model_id):
+    """
+    Cache key for one frame under one backbone + preprocessing configuration.
+
+    Args:
+        frame_hash: Content hash of the frame (see frame_store.content_hash)
+        model_id: String identifying the backbone, weights and preprocessing
+    """
+    return hashlib.blake2b(f"{model_id}|{frame_hash}".encode(), digest_size=16).hexdigest()
+
+
+class FeatureCache:
+    """
+    On-disk feature vector cache with LRU eviction.
+
+    Args:
+        path: SQLite database file (created if missing)
+        max_bytes: Total size of cached vectors to keep
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            " key TEXT PRIMARY KEY,"
+            " dtype TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS features_lru ON features (last_used)")
+        self.db.commit()
+
+    def get_many(self, keys):
+        """
+        Look up feature vectors and mark them as recently used.
+
+        Returns:
+            dict: key -> np.ndarray for every key that was cached
+        """
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.db.execute(
+                f"SELECT key, dtype, vector FROM features WHERE key IN ({placeholders})", chunk)
+            for key, dtype, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=dtype).copy()
+
+        if found:
+            now = time.time()
+            self.db.executemany("UPDATE features SET last_used = ? WHERE key = ?",
+                                [(now, key) for key in found])
+            self.db.commit()
+        return found
+
+    def put_many(self, items):
+        """Store {key: vector} entries, then evict down to the size cap."""
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            vector = np.ascontiguousarray(vector)
+            rows.append((key, vector.dtype.str, vector.tobytes(), vector.nbytes, now))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO features (key, dtype, vector, size, last_used) "
+            "VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+        self.evict()
+
+    def total_bytes(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM features").fetchone()[0]
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        evicted = 0
+        freed = 0
+        rows = self.db.execute("SELECT key, size FROM features ORDER BY last_used ASC")
+        victims = []
+        for key, size in rows:
+            if freed >= excess:
+                break
+            victims.append((key,))
+            freed += size
+            evicted += 1
+        self.db.executemany("DELETE FROM features WHERE key = ?", victims)
+        self.db.commit()
+        return evicted
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+# Resumable feature output.
+#
+# Rows are written straight into a preallocated on-disk array
+# (<name>.partial.npy) as batches finish, so features never pile up in a
+# Python list. Every `checkpoint_seconds` the array is flushed and
+# <name>.checkpoint.json records how far along the frame list the run got
+# and which frames failed. A restarted run with the same frames (same names
+# and content, in the same order) and backend reopens the partial array and
+# continues after the last completed batch.
+# finalize() turns the partial array into the final .npy (a rename when no
+# frame failed) and removes the checkpoint.
+
+
+class FeatureWriter:
+    """
+    Preallocated, checkpointed on-disk feature array.
+
+    Args:
+        output_path: Final (N, D) .npy file
+        ids: Frame ID of every row, in output order
+        model_id: Backend model_id; a checkpoint is only resumed for the same one
+        hashes: Content hash of every row's frame, in output order. Frame names
+                alone do not identify the frames: jumbled frames are always
+                named 0000.jpg, 0001.jpg, ... whatever the shuffle or video.
+        checkpoint_seconds: Minimum time between checkpoints
+        resume: Continue from a matching checkpoint if there is one
+    """
+
+    def __init__(self, output_path, ids, model_id, hashes, checkpoint_seconds=30.0, resume=True):
+        stem = os.path.splitext(str(output_path))[0]
+        self.output_path = str(output_path)
+        self.partial_path = stem + '.partial.npy'
+        self.checkpoint_path = stem + '.checkpoint.json'
+        self.ids = list(ids)
+        self.position = {frame_id: pos for pos, frame_id in enumerate(self.ids)}
+        self.checkpoint_seconds = checkpoint_seconds
+        self.signature = hashlib.blake2b(
+            "\n".join([model_id] + self.ids + list(hashes)).encode(), digest_size=16).hexdigest()
+
+        self.rows = None
+        self.valid = np.zeros(len(self.ids), dtype=bool)
+        self.completed = 0
+        self.failed = []
+        self.last_checkpoint = time.monotonic()
+
+        if resume:
+            self._resume()
+
+    def _resume(self):
+        if not (os.path.exists(self.checkpoint_path) and os.path.exists(self.partial_path)):
+            return
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return
+        if checkpoint.get('signature') != self.signature:
+            print("Ignoring feature checkpoint from a run with different frames or backend")
+            return
+
+        self.rows = np.lib.format.open_memmap(self.partial_path, mode='r+')
+        self.completed = checkpoint['completed']
+        self.failed = checkpoint['failed']
+        self.valid[:self.completed] = True
+        for name in self.failed:
+            self.valid[self.position[name]] = False
+        print(f"Resuming feature extraction after frame {self.completed}/{len(self.ids)}")
+
+    def write(self, positions, features):
+        """Store feature rows at the given positions of the output."""
+        features = np.asarray(features, dtype=np.float32)
+        if self.rows is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.partial_path)), exist_ok=True)
+            self.rows = np.lib.format.open_memmap(self.partial_path, mode='w+', dtype=np.float32,
+                                                  shape=(len(self.ids), features.shape[1]))
+        self.rows[positions] = features
+        self.valid[positions] = True
+
+    def advance(self, completed, failed):
+        """
+        Record that every row before `completed` is written or failed, and
+        checkpoint if the last checkpoint is old enough.
+
+        Args:
+            completed: Output position up to which all frames are done
+            failed: Names of all frames that failed so far
+        """
+        self.completed = max(self.completed, completed)
+        self.failed = sorted(set(self.failed) | set(failed), key=self.position.get)
+        if time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.rows is None:
+            return
+        self.rows.flush()
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'signature': self.signature, 'completed': self.completed,
+                       'total': len(self.ids), 'failed': self.failed}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        """Checkpoint and release the partial array without finalizing it (e.g. on cancellation)."""
+        if self.rows is None:
+            return
+        self.checkpoint()
+        del self.rows
+        self.rows = None
+
+    def finalize(self, chunk_rows=8192):
+        """
+        Write the final .npy with the valid rows only and drop the checkpoint.
+
+        Returns:
+            list: Frame IDs of the rows of the final array
+        """
+        if self.rows is None or not self.valid.any():
+            raise RuntimeError("No features extracted! All frames failed to process.")
+
+        if self.valid.all():
+            self.rows.flush()
+            del self.rows
+            os.replace(self.partial_path, self.output_path)
+            ids = self.ids
+        else:
+            keep = np.flatnonzero(self.valid)
+            out = np.lib.format.open_memmap(self.output_path, mode='w+', dtype=self.rows.dtype,
+                                            shape=(len(keep), self.rows.shape[1]))
+            for start in range(0, len(keep), chunk_rows):
+                out[start:start + chunk_rows] = self.rows[keep[start:start + chunk_rows]]
+            out.flush()
+            del out
+            del self.rows
+            os.remove(self.partial_path)
+            ids = [self.ids[pos] for pos in keep]
+
+        self.rows = None
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return ids
@@ -1,71 +1,188 @@
 import os
 import cv2
 import numpy as np
+import time
+import queue
+import threading
 from tqdm import tqdm
-import torch
-import torchvision.models as models
-import torchvision.transforms as transforms
-import gc
-
-def extract_features(frames_dir, output_path):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
-
-    model = models.resnet18(pretrained=True)
-    model = torch.nn.Sequential(*list(model.children())[:-1])  # remove classification layer
-    model.to(device)
-    model.eval()
-
-    transform = transforms.Compose([
-        transforms.ToPILImage(),
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                             std=[0.229, 0.224, 0.225])
-    ])
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from frame_store import open_frame_source
+from feature_cache import FeatureCache, cache_key, DEFAULT_MAX_BYTES
+from feature_backends import BACKENDS, DEFAULT_BACKEND, get_backend, features_id, preprocess_imagenet
+from inference_optim import OPTIMIZE_MODES, CALIBRATION_FRAMES
+import feature_index
+from feature_checkpoint import FeatureWriter
+from progress import report
 
+MAX_AUTO_BATCH = 256
+
+
+def load_and_preprocess(source, i, preprocess=preprocess_imagenet):
+    """
+    Decode and preprocess one frame with a backend's preprocess function.
+    Runs inside the prefetch workers.
+
+    Returns:
+        np.ndarray or None: Model input, or None if the frame could not be read
+    """
+    img = source.read(i)
+    if img is None:
+        return None
+    return preprocess(img)
+
+
+def prefetch_frames(source, num_workers=4, prefetch=64, use_processes=False, indices=None,
+                    preprocess=preprocess_imagenet):
+    """
+    Decode and preprocess frames on a worker pool, yielding them in input order.
+
+    At most `prefetch` frames are in flight at once, so memory stays bounded
+    while the consumer (the model) is busy with the previous batch.
+
+    Args:
+        source: Frame source from frame_store.open_frame_source
+        num_workers: Size of the decode pool
+        prefetch: Maximum number of frames decoded ahead of the consumer
+        use_processes: Use worker processes instead of threads
+        indices: Frames of the source to load. Defaults to all of them.
+        preprocess: Backend preprocess function applied to each decoded frame
+
+    Yields:
+        tuple: (frame name, model input or None, exception or None)
+    """
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    prefetch = max(prefetch, num_workers)
+
+    with executor_cls(max_workers=num_workers) as pool:
+        pending = deque()
+        indices = iter(range(len(source)) if indices is None else indices)
+
+        for i in indices:
+            pending.append((i, pool.submit(load_and_preprocess, source, i, preprocess)))
+            if len(pending) >= prefetch:
+                break
+
+        while pending:
+            i, future = pending.popleft()
+            next_i = next(indices, None)
+            if next_i is not None:
+                pending.append((next_i, pool.submit(load_and_preprocess, source, next_i, preprocess)))
+            try:
+                yield source.name(i), future.result(), None
+            except Exception as e:
+                yield source.name(i), None, e
+
+
+def calibration_sample(source, indices, preprocess, n=CALIBRATION_FRAMES):
+    """Preprocessed frames spread evenly over `indices`, for calibrating optimised inference."""
+    picks = np.linspace(0, len(indices) - 1, min(n, len(indices))).astype(int)
+    sample = [load_and_preprocess(source, indices[p], preprocess) for p in picks]
+    return [x for x in sample if x is not None]
+
+
+def auto_batch_size(device, bytes_per_frame):
+    """
+    Pick a batch size from the memory currently available on the device.
+
+    Args:
+        device: torch.device the model runs on, or None for CPU-only backends
+        bytes_per_frame: Rough per-frame memory cost of the backend
+
+    Returns:
+        int: Number of frames to stack into one forward pass
+    """
+    available = None
+    if device is not None and device.type == 'cuda':
+        import torch
+        try:
+            available, _ = torch.cuda.mem_get_info(device)
+        except Exception:
+            available = None
+    else:
+        try:
+            import psutil
+            available = psutil.virtual_memory().available
+        except ImportError:
+            try:
+                available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+            except (ValueError, OSError, AttributeError):
+                available = None
+
+    if available is None:
+        return 32
+
+    # Only use a quarter of what is free so the rest of the system keeps breathing
+    return int(max(1, min(MAX_AUTO_BATCH, (available // 4) // bytes_per_frame)))
+
+
+def embed_frames(backend, frames, total, batch_size, on_batch=None):
+    """
+    Run preprocessed frames through a feature backend in mini-batches.
+
+    Args:
+        backend: Loaded feature backend (see feature_backends.py)
+        frames: Iterable of (name, model input or None, exception or None)
+        total: Number of frames, for the progress bar
+        batch_size: Frames per forward pass
+        on_batch: Optional callback(names, features, failed frame names so far)
+                  taking each batch's features instead of collecting them
+
+    Returns:
+        tuple: (list of feature vectors, list of failed frame names). The list of
+               features is empty when on_batch is given.
+    """
     features = []
-    frame_files = sorted(os.listdir(frames_dir))
-    
-    print(f"Processing {len(frame_files)} frames...")
-    
-    # Process frames in batches to manage memory
-    batch_size = 50
     failed_frames = []
+    batch = []
+    names = []
+    embedded = 0
+    start = time.perf_counter()
 
-    for i, f in enumerate(tqdm(frame_files, desc="Extracting features")):
-        try:
-            path = os.path.join(frames_dir, f)
-            
-            # Read image with error handling
-            img = cv2.imread(path, cv2.IMREAD_COLOR)
-            if img is None:
-                print(f"\n⚠️ Warning: Could not read frame {f}, skipping...")
-                failed_frames.append(f)
-                continue
-            
-            # Resize image before processing to reduce memory
-            if img.shape[0] > 1080 or img.shape[1] > 1920:
-                img = cv2.resize(img, (1920, 1080))
-            
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            tensor = transform(img).unsqueeze(0).to(device)
-            
-            with torch.no_grad():
-                feat = model(tensor).cpu().numpy().flatten()
-            features.append(feat)
-            
-            # Clean up memory every batch_size frames
-            if (i + 1) % batch_size == 0:
-                gc.collect()
-                if device.type == 'cuda':
-                    torch.cuda.empty_cache()
-                    
-        except Exception as e:
-            print(f"\n❌ Error processing frame {f}: {str(e)}")
-            failed_frames.append(f)
+    def run_batch():
+        nonlocal embedded
+        feats = backend.embed(batch)
+        if on_batch is None:
+            features.extend(feats)
+        else:
+            on_batch(list(names), feats, failed_frames)
+        embedded += len(batch)
+        batch.clear()
+        names.clear()
+
+    for done, (name, x, error) in enumerate(tqdm(frames, total=total, desc="Extracting features"), 1):
+        report('extract_features', done, total)
+        if error is not None:
+            print(f"\n❌ Error processing frame {name}: {str(error)}")
+            failed_frames.append(name)
             continue
+        if x is None:
+            print(f"\n⚠️ Warning: Could not read frame {name}, skipping...")
+            failed_frames.append(name)
+            continue
+
+        batch.append(x)
+        names.append(name)
+        if len(batch) == batch_size:
+            run_batch()
+
+    if batch:
+        run_batch()
+
+    backend.release()
+
+    elapsed = time.perf_counter() - start
+    if embedded:
+        print(f"Embedded {embedded} frames in {elapsed:.2f}s ({embedded / max(elapsed, 1e-9):.1f} frames/sec)")
 
+    return features, failed_frames
+
+
+def save_features(features, failed_frames, output_path, ids):
+    """
+    Stack the extracted feature vectors and save them as one .npy array, with
+    the frame ID of every row alongside (see feature_index.py).
+    """
     if failed_frames:
         print(f"\n⚠️ Failed to process {len(failed_frames)} frames")
     
@@ -73,11 +190,318 @@ def extract_features(frames_dir, output_path):
         raise RuntimeError("No features extracted! All frames failed to process.")
     
     features = np.array(features)
-    np.save(output_path, features)
+    feature_index.save_features(features, ids, output_path)
     print(f"✅ Saved {len(features)} feature vectors to {output_path}")
+    return features
+
+
+def extract_features(frames_dir, output_path, batch_size=None, num_workers=None,
+                     prefetch=None, use_processes=False, cache_path=None,
+                     cache_max_bytes=None, backend=None, weights=None, optimize=None,
+                     threads=None, indices=None, checkpoint_seconds=30.0, resume=True,
+                     embedding_server=None):
+    """
+    Extract features for every frame in a directory or frame store.
+
+    Features are written into a preallocated on-disk array as batches finish,
+    with a progress checkpoint every `checkpoint_seconds`, so a run that is
+    interrupted continues from its last completed batch (see feature_checkpoint.py).
+
+    Args:
+        frames_dir: Directory containing the frame images, or a frame store header
+        output_path: Where to save the (N, D) feature array
+        batch_size: Frames per forward pass. If None, picked from available memory.
+        num_workers: Decode/preprocess workers. If None, uses the CPU count (max 8).
+        prefetch: Frames decoded ahead of the model. If None, two batches' worth.
+        use_processes: Decode in worker processes instead of threads
+        cache_path: Feature cache database. Frames whose content was embedded
+                    before (with the same backend model_id) are taken from the cache.
+                    If None, caching is off.
+        cache_max_bytes: Size cap of the feature cache (LRU eviction)
+        backend: Name of a feature backend in feature_backends.BACKENDS, or a
+                 backend instance. Defaults to ResNet-18.
+        weights: Local weights file for CNN backends
+        optimize: Optimised CPU inference for CNN backends: 'int8', 'torchscript'
+                  or 'onnx' (see inference_optim.py). None runs in float32.
+        threads: Intra-op threads for CNN inference
+        indices: Frames of the source to embed, in output order (e.g. one shard,
+                 see sharded_features.py). Defaults to all of them.
+        checkpoint_seconds: Minimum time between progress checkpoints
+        resume: Continue from the checkpoint of an interrupted run with the same
+                frames and backend
+        embedding_server: Socket of a local embedding server to run the model in
+                          (see embedding_server.py). None uses the default socket
+                          if a server for the same model is listening there;
+                          False always embeds in this process.
+
+    Returns:
+        list: Names of the frames that could not be processed
+    """
+    if backend is None or isinstance(backend, str):
+        backend = get_backend(backend, weights=weights, optimize=optimize, threads=threads)
+    print(f"Feature backend: {backend.name}")
+
+    source = open_frame_source(frames_dir)
+    frame_ids = list(range(len(source))) if indices is None else list(indices)
+    
+    print(f"Processing {len(frame_ids)} frames...")
+    
+    if num_workers is None:
+        num_workers = min(8, os.cpu_count() or 1)
+
+    # Content hashes key the feature cache and identify the frames of a resumable run
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        hashes = list(pool.map(source.content_hash, frame_ids))
+
+    cache = None
+    cached = {}
+    keys = None
+    if cache_path is not None and not backend.cacheable:
+        print(f"Feature cache: off ({backend.model_id} features depend on per-video calibration)")
+    elif cache_path is not None:
+        cache = FeatureCache(cache_path, max_bytes=cache_max_bytes or DEFAULT_MAX_BYTES)
+        keys = {i: cache_key(h, backend.model_id) for i, h in zip(frame_ids, hashes)}
+        cached = cache.get_many(keys.values())
+        print(f"Feature cache: {len(cached)}/{len(frame_ids)} frames already embedded")
+
+    ids = [source.name(i) for i in frame_ids]
+    writer = None
+    # A cancelled job (see progress.py) unwinds from inside embed_frames: the
+    # cache connection, server socket and partial memmap must still be released
+    try:
+        # Optimised models are calibrated on frames spread over the whole source,
+        # never just the frames left to do, so a resumed run or another shard of
+        # the same frames gets the same calibration. int8 features depend on it,
+        # so it is done before the checkpoint is matched and is part of its key.
+        calibration_indices = range(len(source))
+        if backend.optimize and not backend.cacheable:
+            backend.load()
+            backend.calibrate(calibration_sample(source, calibration_indices, backend.preprocess))
+        writer = FeatureWriter(output_path, ids, features_id(backend), hashes,
+                               checkpoint_seconds=checkpoint_seconds, resume=resume)
+
+        from_cache = [pos for pos, i in enumerate(frame_ids)
+                      if keys is not None and keys[i] in cached]
+        for start in range(0, len(from_cache), 4096):
+            chunk = from_cache[start:start + 4096]
+            writer.write(chunk, np.stack([cached[keys[frame_ids[pos]]] for pos in chunk]))
+        cached.clear()
+
+        todo = [i for pos, i in enumerate(frame_ids) if pos >= writer.completed and not writer.valid[pos]]
+        failed_frames = list(writer.failed)
+
+        def on_batch(names, feats, failed):
+            positions = [writer.position[name] for name in names]
+            writer.write(positions, feats)
+            if cache is not None:
+                cache.put_many({keys[frame_ids[pos]]: feat for pos, feat in zip(positions, feats)})
+            writer.advance(positions[-1] + 1, failed)
+
+        if todo:
+            # Only now is the model (and torch) needed: fully cached runs never load it
+            if embedding_server is not False:
+                from embedding_server import connect_embedding_server
+                backend = connect_embedding_server(backend, embedding_server)
+            if batch_size is None:
+                batch_size = auto_batch_size(backend.device, backend.bytes_per_frame)
+            if prefetch is None:
+                prefetch = 2 * batch_size
+            print(f"Batch size: {batch_size}, decode workers: {num_workers}")
+            backend.load()
+            if backend.device is not None:
+                print(f"Device: {backend.device}")
+            if backend.optimize:
+                backend.calibrate(calibration_sample(source, calibration_indices, backend.preprocess))
+            frames = prefetch_frames(source, num_workers=num_workers, prefetch=prefetch,
+                                     use_processes=use_processes, indices=todo,
+                                     preprocess=backend.preprocess)
+            _, new_failures = embed_frames(backend, frames, len(todo), batch_size, on_batch=on_batch)
+            failed_frames += new_failures
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        raise
+    finally:
+        if hasattr(backend, 'close'):
+            backend.close()
+        if cache is not None:
+            cache.close()
+
+    if failed_frames:
+        print(f"\n⚠️ Failed to process {len(failed_frames)} frames")
+    valid_ids = writer.finalize()
+    feature_index.save_frame_ids(valid_ids, output_path)
+    print(f"✅ Saved {len(valid_ids)} feature vectors to {output_path}")
+    return failed_frames
+
+
+def decode_video(video_path, prefetch=64, preprocess=preprocess_imagenet):
+    """
+    Decode a video once on a background thread, yielding model inputs in frame order.
+
+    Frames are downscaled to the model input size straight after decoding, so
+    full-resolution frames never pile up in memory.
+
+    Yields:
+        tuple: (frame index, model input, None)
+    """
+    frames = queue.Queue(maxsize=prefetch)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer has stopped, rather than block on a full queue
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        cap = cv2.VideoCapture(video_path)
+        idx = 0
+        try:
+            while not stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if not put((idx, preprocess(frame), None)):
+                    break
+                idx += 1
+        except Exception as e:
+            put((idx, None, e))
+        finally:
+            cap.release()
+            put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def sample_video_frames(video_path, total, preprocess, n=CALIBRATION_FRAMES):
+    """Preprocessed frames spread evenly over a video, for calibrating optimised inference."""
+    cap = cv2.VideoCapture(video_path)
+    sample = []
+    try:
+        for idx in np.linspace(0, max(total - 1, 0), min(n, max(total, 1))).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+            ret, frame = cap.read()
+            if ret:
+                sample.append(preprocess(frame))
+    finally:
+        cap.release()
+    return sample
+
+
+def extract_features_from_video(video_path, output_path, jumble=False, permutation_path=None, batch_size=None,
+                                backend=None, weights=None, optimize=None, threads=None,
+                                embedding_server=None):
+    """
+    Extract features directly from a video file without writing frames to disk.
+
+    Args:
+        video_path: Path to the input video
+        output_path: Where to save the (N, D) feature array
+        jumble: Shuffle the decoded frames. Row i of the saved features is then
+                source frame permutation[i], as if frames had been jumbled on disk.
+                The shuffle is drawn once decoding is done, from the number of
+                frames actually decoded (container frame counts are estimates).
+        permutation_path: Where to save the shuffle (see jumble_frames.save_permutation)
+        batch_size: Frames per forward pass. If None, picked from available memory.
+        backend: Feature backend name or instance (see extract_features)
+        weights: Local weights file for CNN backends
+        optimize: Optimised CPU inference mode (see extract_features)
+        threads: Intra-op threads for CNN inference
+        embedding_server: Local embedding server socket (see extract_features)
+
+    Returns:
+        tuple: (number of frames decoded, permutation or None)
+    """
+    if backend is None or isinstance(backend, str):
+        backend = get_backend(backend, weights=weights, optimize=optimize, threads=threads)
+    print(f"Feature backend: {backend.name}")
+
+    if embedding_server is not False:
+        from embedding_server import connect_embedding_server
+        backend = connect_embedding_server(backend, embedding_server)
+    backend.load()
+    if backend.device is not None:
+        print(f"Device: {backend.device}")
+
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if backend.optimize:
+        backend.calibrate(sample_video_frames(video_path, total, backend.preprocess))
+
+    if batch_size is None:
+        batch_size = auto_batch_size(backend.device, backend.bytes_per_frame)
+    print(f"Streaming {total} frames from {video_path} (batch size: {batch_size})")
+
+    frames = decode_video(video_path, prefetch=2 * batch_size, preprocess=backend.preprocess)
+    try:
+        features, failed_frames = embed_frames(backend, frames, total, batch_size)
+    finally:
+        if hasattr(backend, 'close'):
+            backend.close()
+
+    if failed_frames or len(features) == 0:
+        raise RuntimeError(f"Decoding stopped after {len(features)} frames: {failed_frames}")
+
+    permutation = None
+    if jumble:
+        permutation = np.random.permutation(len(features))
+        if permutation_path is not None:
+            from jumble_frames import save_permutation
+            save_permutation(permutation, permutation_path)
+        features = [features[i] for i in permutation]
+        ids = [f"frame_{int(i):04d}" for i in permutation]
+    else:
+        ids = [f"frame_{i:04d}" for i in range(len(features))]
+
+    save_features(features, [], output_path, ids)
+    return len(features), permutation
 
 if __name__ == "__main__":
-    import os
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract feature vectors from frames.")
+    parser.add_argument("--feature_backend", choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help="Feature backend (default: resnet18)")
+    parser.add_argument("--feature_weights", type=str, default=None,
+                        help="Local weights file for CNN backends instead of downloading them")
+    parser.add_argument("--inference", choices=OPTIMIZE_MODES, default=None,
+                        help="Optimised CPU inference for CNN backends (default: float32)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Intra-op threads for CNN inference (default: torch default)")
+    parser.add_argument("--batch_size", type=int, default=None,
+                        help="Frames per forward pass (default: pick from available memory)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Decode/preprocess workers (default: CPU count, max 8)")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="Frames decoded ahead of the model (default: two batches)")
+    parser.add_argument("--worker_processes", action="store_true",
+                        help="Decode in worker processes instead of threads")
+    parser.add_argument("--no_resume", action="store_true",
+                        help="Start over instead of continuing an interrupted run")
+    parser.add_argument("--feature_cache", type=str, default=None,
+                        help="Feature cache database to reuse embeddings of previously seen frames")
+    parser.add_argument("--no_embedding_server", action="store_true",
+                        help="Embed in this process even if a local embedding server is running")
+    args = parser.parse_args()
+
     # Use relative paths
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     frames_dir = os.path.join(base_dir, 'data', 'frames_jumbled')
@@ -86,4 +510,9 @@ if __name__ == "__main__":
     print(f"Extracting features from: {frames_dir}")
     print(f"Saving features to: {output_path}")
     
-    extract_features(frames_dir, output_path)
+    extract_features(frames_dir, output_path, batch_size=args.batch_size,
+                     num_workers=args.workers, prefetch=args.prefetch,
+                     use_processes=args.worker_processes, cache_path=args.feature_cache,
+                     backend=args.feature_backend, weights=args.feature_weights,
+                     optimize=args.inference, threads=args.threads, resume=not args.no_resume,
+                     embedding_server=False if args.no_embedding_server else None)
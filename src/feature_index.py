@@ -0,0 +1,102 @@
+import os
+import re
+import json
+import numpy as np
+
+# Frame IDs for row-indexed artifacts.
+#
+# Feature arrays stay plain .npy files so they can be memory-mapped. Next to
+# each one, <name>.ids.json lists the frame ID (the frame source's name, e.g.
+# "0042.jpg") of every row. Frames that fail to decode are dropped from the
+# features, so row i is not necessarily frame i: the similarity graph and the
+# solved order carry the same sidecar, and rebuild_video looks frames up by ID.
+#
+# Artifacts from before frame IDs have no sidecar; they are read positionally.
+
+IDS_SUFFIX = '.ids.json'
+FRAME_INDEX_ID = re.compile(r'^frame_(\d+)(\.\w+)?$')
+
+
+def ids_path_for(path):
+    """Sidecar holding the frame IDs of a row-indexed artifact."""
+    return os.path.splitext(str(path))[0] + IDS_SUFFIX
+
+
+def save_frame_ids(ids, path):
+    """
+    Write the frame IDs of the artifact at `path`.
+
+    With ids=None any existing sidecar is removed, so a stale one from an
+    earlier run can never be paired with new rows.
+    """
+    ids_path = ids_path_for(path)
+    if ids is None:
+        if os.path.exists(ids_path):
+            os.remove(ids_path)
+        return
+    with open(ids_path, 'w') as f:
+        json.dump({'count': len(ids), 'ids': [str(i) for i in ids]}, f)
+
+
+def load_frame_ids(path, expected=None):
+    """
+    Read the frame IDs of the artifact at `path`.
+
+    Args:
+        path: The artifact (not the sidecar)
+        expected: Row count of the artifact, checked against the sidecar
+
+    Returns:
+        list or None: One ID per row, or None if the artifact has no sidecar
+    """
+    ids_path = ids_path_for(path)
+    if not os.path.exists(ids_path):
+        return None
+    with open(ids_path, 'r') as f:
+        ids = json.load(f)['ids']
+    if expected is not None and len(ids) != expected:
+        raise RuntimeError(f"{ids_path} lists {len(ids)} frames but {path} has {expected} rows")
+    return ids
+
+
+def source_frame_indices(order, order_ids, permutation):
+    """
+    Map a solved order to frame indices of the source video.
+
+    IDs of the form frame_NNNN (extracted frames, frame store rows, streaming)
+    are source frame indices already. Other IDs (e.g. 0007.jpg in
+    frames_jumbled) and orders without IDs are jumbled positions, mapped
+    through the saved permutation.
+
+    Raises:
+        ValueError: The IDs are jumbled positions but there is no permutation
+                    to map them back to source frames
+    """
+    if order_ids is not None:
+        matches = [FRAME_INDEX_ID.match(frame_id) for frame_id in order_ids]
+        if all(matches):
+            return np.array([int(m.group(1)) for m in matches], dtype=np.int64)
+        if permutation is None:
+            raise ValueError("The frame order refers to jumbled frames, but no jumble permutation "
+                             "was found to map them to source video frames")
+        positions = np.array([int(os.path.splitext(frame_id)[0]) for frame_id in order_ids], dtype=np.int64)
+    else:
+        positions = np.asarray(order, dtype=np.int64)
+    return permutation[positions] if permutation is not None else positions
+
+
+def save_features(features, ids, path):
+    """Save an (N, D) feature array and its N frame IDs."""
+    np.save(path, features)
+    save_frame_ids(ids, path)
+
+
+def load_features(path, mmap_mode=None):
+    """
+    Load a feature array with its frame IDs.
+
+    Returns:
+        tuple: (features, list of frame IDs or None)
+    """
+    features = np.load(path, mmap_mode=mmap_mode)
+    return features, load_frame_ids(path, expected=len(features))
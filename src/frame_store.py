@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# A frame store is a pair of files:
+#   frames.bin  - raw uint8 frames of one fixed shape, back to back
+#   frames.json - header: {"store": "frames.bin", "shape": [h, w, 3], "count": n}
+# A view (e.g. frames_jumbled.json) is a header with an extra "index" list that
+# maps view position -> store row, so jumbling never copies any pixels.
+
+STORE_SUFFIX = '.json'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def is_frame_store(path):
+    return str(path).endswith(STORE_SUFFIX)
+
+
+def content_hash(data):
+    """Hash raw frame bytes (an encoded image file or a decoded pixel buffer)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class FrameStoreWriter:
+    """
+    Append fixed-shape frames to a memory-mapped store file.
+
+    The file grows as frames are appended, so the frame count does not need
+    to be known up front (CAP_PROP_FRAME_COUNT is only an estimate).
+    """
+
+    def __init__(self, header_path, height, width, capacity=256):
+        self.header_path = str(header_path)
+        self.data_path = os.path.splitext(self.header_path)[0] + '.bin'
+        self.shape = (height, width, 3)
+        self.frame_bytes = height * width * 3
+        self.count = 0
+        self.capacity = 0
+
+        with open(self.data_path, 'wb'):
+            pass
+        self._grow(max(1, capacity))
+
+    def _grow(self, capacity):
+        with open(self.data_path, 'r+b') as f:
+            f.truncate(capacity * self.frame_bytes)
+        self.capacity = capacity
+        self.frames = np.memmap(self.data_path, dtype=np.uint8, mode='r+',
+                                shape=(capacity,) + self.shape)
+
+    def append(self, frame):
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match store shape {self.shape}")
+        if self.count == self.capacity:
+            self.frames.flush()
+            del self.frames
+            self._grow(int(self.capacity * 1.5) + 1)
+        self.frames[self.count] = frame
+        self.count += 1
+
+    def close(self):
+        self.frames.flush()
+        del self.frames
+        with open(self.data_path, 'r+b') as f:
+            f.truncate(self.count * self.frame_bytes)
+        write_header(self.header_path, os.path.basename(self.data_path), self.shape, self.count)
+
+
+def write_header(header_path, store_file, shape, count, index=None):
+    """Write a store header, or a view of a store if `index` is given."""
+    header = {
+        'store': store_file,
+        'shape': list(shape),
+        'count': int(count)
+    }
+    if index is not None:
+        header['index'] = [int(i) for i in index]
+    with open(header_path, 'w') as f:
+        json.dump(header, f)
+
+
+class FrameStore:
+    """
+    Read-only access to a frame store or a view of one.
+
+    Frames are returned as zero-copy slices of the memory-mapped file.
+    """
+
+    def __init__(self, header_path):
+        self.header_path = str(header_path)
+        with open(self.header_path, 'r') as f:
+            header = json.load(f)
+        self.data_path = os.path.join(os.path.dirname(self.header_path), header['store'])
+        self.shape = tuple(header['shape'])
+        self.count = header['count']
+        index = header.get('index')
+        self.index = np.arange(self.count) if index is None else np.asarray(index, dtype=np.int64)
+        self._frames = None
+
+    @property
+    def frames(self):
+        # Opened lazily so the store can be pickled to worker processes cheaply
+        if self._frames is None:
+            self._frames = np.memmap(self.data_path, dtype=np.uint8, mode='r',
+                                     shape=(self.count,) + self.shape)
+        return self._frames
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frames'] = None
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def name(self, i):
+        return f"frame_{int(self.index[i]):04d}"
+
+    def read(self, i):
+        return self.frames[self.index[i]]
+
+    def content_hash(self, i):
+        return content_hash(memoryview(self.read(i)))
+
+    def view(self, header_path, index):
+        """Write a view of this store whose position i is frame index[i] of this one."""
+        write_header(header_path, os.path.relpath(self.data_path, os.path.dirname(str(header_path))),
+                     self.shape, self.count, index=self.index[np.asarray(index)])
+
+
+class DirectoryFrames:
+    """The original backend: one image file per frame, ordered by file name."""
+
+    def __init__(self, frames_dir):
+        self.frames_dir = str(frames_dir)
+        self.files = sorted(f for f in os.listdir(self.frames_dir)
+                            if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    def __len__(self):
+        return len(self.files)
+
+    def name(self, i):
+        return self.files[i]
+
+    def path(self, i):
+        return os.path.join(self.frames_dir, self.files[i])
+
+    def read(self, i):
+        import cv2
+        return cv2.imread(self.path(i), cv2.IMREAD_COLOR)
+
+    def content_hash(self, i):
+        with open(self.path(i), 'rb') as f:
+            return content_hash(f.read())
+
+
+def open_frame_source(path):
+    """
+    Open a set of frames from either a frames directory or a frame store header.
+
+    Returns:
+        DirectoryFrames or FrameStore: object with len(), name(i) and read(i)
+    """
+    if is_frame_store(path):
+        return FrameStore(path)
+    return DirectoryFrames(path)
@@ -0,0 +1,198 @@
+import os
+import copy
+import time
+import hashlib
+import numpy as np
+
+# Optimised CPU inference for the CNN feature backends.
+#
+#   int8        post-training static quantization (FX graph mode), calibrated on
+#               a sample of the video's own frames
+#   torchscript traced and frozen TorchScript graph
+#   onnx        ONNX graph run with onnxruntime (optional dependency)
+#
+# Exported graphs are cached in data/cache/models keyed by the backend's
+# model_id and the torch version, so only the first run pays for tracing or
+# export. They are written to a temporary file and renamed into place, so a
+# concurrent run never loads a half-written graph. A cached graph that fails
+# to load is rebuilt. Every mode is
+# checked against the fp32 model on the calibration frames, and the speedup
+# and feature drift (cosine similarity to the fp32 embeddings) are reported.
+
+OPTIMIZE_MODES = ('int8', 'torchscript', 'onnx')
+CALIBRATION_FRAMES = 32
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 'data', 'cache', 'models')
+
+
+def graph_cache_path(cache_dir, model_id, mode, suffix):
+    """File an exported graph of one backend configuration is cached in."""
+    digest = hashlib.blake2b(model_id.encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, f"{digest}-{mode}{suffix}")
+
+
+def quantize_int8(model, calibration):
+    """
+    Static int8 quantization of a float32 model.
+
+    Args:
+        model: float32 model in eval mode (left untouched)
+        calibration: Nx3xHxW float32 tensor of representative inputs
+
+    Returns:
+        torch.nn.Module: quantized model (CPU only)
+    """
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engines = torch.backends.quantized.supported_engines
+    engine = next((e for e in ('x86', 'fbgemm', 'qnnpack') if e in engines), engines[0])
+    torch.backends.quantized.engine = engine
+
+    model = copy.deepcopy(model).cpu()
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(calibration[:1],))
+    with torch.inference_mode():
+        for start in range(0, len(calibration), 8):
+            prepared(calibration[start:start + 8])
+    return convert_fx(prepared)
+
+
+def _temporary_path(path):
+    """Sibling of `path` to write to before renaming it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    root, suffix = os.path.splitext(path)
+    return f"{root}.{os.getpid()}.tmp{suffix}"
+
+
+def torchscript_model(model, example, path):
+    """Load a cached TorchScript graph, or trace, freeze and cache one."""
+    import torch
+
+    if os.path.exists(path):
+        try:
+            graph = torch.jit.load(path, map_location='cpu')
+            print(f"Loaded cached TorchScript graph from {path}")
+            return graph
+        except Exception as e:
+            print(f"⚠️ Could not load cached TorchScript graph {path} ({e}); rebuilding it")
+
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+    tmp_path = _temporary_path(path)
+    torch.jit.save(frozen, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"Saved TorchScript graph to {path}")
+    return frozen
+
+
+class OnnxModel:
+    """
+    onnxruntime session with the call signature of a torch model.
+
+    Args:
+        path: ONNX file
+        threads: Intra-op threads of the session
+    """
+
+    def __init__(self, path, threads):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The 'onnx' inference mode needs onnxruntime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, tensor):
+        import torch
+        x = np.ascontiguousarray(tensor.cpu().numpy())
+        return torch.from_numpy(self.session.run(None, {'input': x})[0])
+
+
+def onnx_model(model, example, path, threads):
+    """Load a cached ONNX graph, or export and cache one, and open it with onnxruntime."""
+    import torch
+
+    if os.path.exists(path):
+        try:
+            session = OnnxModel(path, threads)
+            print(f"Loaded cached ONNX graph from {path}")
+            return session
+        except ImportError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Could not load cached ONNX graph {path} ({e}); exporting it again")
+
+    tmp_path = _temporary_path(path)
+    torch.onnx.export(model, example.contiguous(), tmp_path, input_names=['input'],
+                      output_names=['features'], opset_version=17,
+                      dynamic_axes={'input': {0: 'batch'}, 'features': {0: 'batch'}})
+    os.replace(tmp_path, path)
+    print(f"Saved ONNX graph to {path}")
+    return OnnxModel(path, threads)
+
+
+def run_timed(model, inputs):
+    """Embed inputs with a model, returning (N x D features, frames/sec)."""
+    import torch
+    with torch.inference_mode():
+        model(inputs[:1])  # warm-up, so one-off graph optimisation is not timed
+        start = time.perf_counter()
+        features = model(inputs).flatten(1).cpu().numpy()
+    return features, len(inputs) / max(time.perf_counter() - start, 1e-9)
+
+
+def feature_drift(reference, features):
+    """Cosine similarity between matching rows of two feature matrices."""
+    a = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    b = features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+    cosine = np.sum(a * b, axis=1)
+    return {'mean_cosine': round(float(cosine.mean()), 6), 'min_cosine': round(float(cosine.min()), 6)}
+
+
+def optimize_model(model, mode, calibration, model_id, threads, cache_dir=None):
+    """
+    Build the optimised version of a float32 model and measure it against the original.
+
+    Args:
+        model: float32 model in eval mode on the CPU
+        mode: One of OPTIMIZE_MODES
+        calibration: Nx3xHxW float32 tensor of frames from the video
+        model_id: Backend model_id (without the mode), keys the graph cache
+        threads: Intra-op threads used for inference
+        cache_dir: Where exported graphs are cached. Defaults to data/cache/models.
+
+    Returns:
+        tuple: (optimised model, report dict with fp32/optimised frames/sec and feature drift)
+    """
+    if mode not in OPTIMIZE_MODES:
+        raise ValueError(f"Unknown inference mode '{mode}'. Choose from: {', '.join(OPTIMIZE_MODES)}")
+
+    import torch
+
+    # Graphs exported by one torch version are not guaranteed to load in another
+    graph_id = f"{model_id}|torch-{torch.__version__}"
+    if mode == 'int8':
+        optimized = quantize_int8(model, calibration)
+    elif mode == 'torchscript':
+        optimized = torchscript_model(model, calibration[:1],
+                                      graph_cache_path(cache_dir, graph_id, mode, '.pt'))
+    else:
+        optimized = onnx_model(model, calibration[:1],
+                               graph_cache_path(cache_dir, graph_id, mode, '.onnx'), threads)
+
+    reference, fp32_fps = run_timed(model, calibration)
+    features, optimized_fps = run_timed(optimized, calibration)
+    report = {'mode': mode, 'threads': threads, 'calibration_frames': len(calibration),
+              'fp32_fps': round(fp32_fps, 1), 'optimized_fps': round(optimized_fps, 1)}
+    report.update(feature_drift(reference, features))
+
+    print(f"⚡ {mode} inference on {len(calibration)} calibration frames ({threads} threads):")
+    print(f"  - Throughput: {report['fp32_fps']:.1f} -> {report['optimized_fps']:.1f} frames/sec"
+          f" ({optimized_fps / max(fp32_fps, 1e-9):.2f}x)")
+    print(f"  - Feature drift vs. fp32: mean cosine {report['mean_cosine']:.4f},"
+          f" min {report['min_cosine']:.4f}")
+    return optimized, report
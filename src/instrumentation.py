@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import platform
+from contextlib import contextmanager
+
+# Per-stage instrumentation: wall time, CPU time, peak RSS, bytes read/written
+# and frames/sec, with optional cProfile or torch.profiler capture. Results are
+# written as one JSON report.
+#
+# Memory and I/O counters come from /proc on Linux, psutil elsewhere when it is
+# installed, and are left out otherwise.
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _read_proc(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS counter so each stage gets its own peak (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_bytes():
+    status = _read_proc('/proc/self/status')
+    if status:
+        for line in status.splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in KB on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return None
+
+
+def _io_bytes():
+    io = _read_proc('/proc/self/io')
+    if io:
+        counters = dict(line.split(': ') for line in io.strip().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    try:
+        import psutil
+        counters = psutil.Process().io_counters()
+        return counters.read_bytes, counters.write_bytes
+    except (ImportError, AttributeError):
+        return None
+
+
+def _cpu_seconds():
+    """CPU time of this process plus finished child processes (e.g. pool workers)."""
+    total = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        total += children.ru_utime + children.ru_stime
+    return total
+
+
+class PipelineProfiler:
+    """
+    Collects stage metrics for one pipeline run.
+
+    Args:
+        profile: None, 'cprofile' or 'torch' to capture a profile of every stage
+        profile_dir: Directory for the <stage>.prof / <stage>.trace.json files
+    """
+
+    def __init__(self, profile=None, profile_dir=None):
+        if profile not in (None, 'cprofile', 'torch'):
+            raise ValueError(f"Unknown profiler '{profile}'. Use 'cprofile' or 'torch'.")
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.started_at = time.time()
+
+    @contextmanager
+    def stage(self, name, frames=None):
+        """
+        Measure one stage. Yields the stage record; set record['frames'] inside
+        the block if the frame count is only known once the stage has run.
+        """
+        record = {'stage': name, 'frames': frames, 'status': 'ok'}
+        io_before = _io_bytes()
+        peak_reset = _reset_peak_rss()
+        cpu_before = _cpu_seconds()
+        wall_before = time.perf_counter()
+
+        with self._capture(name):
+            try:
+                yield record
+            except BaseException:
+                record['status'] = 'failed'
+                raise
+            finally:
+                wall = time.perf_counter() - wall_before
+                record['wall_seconds'] = round(wall, 4)
+                record['cpu_seconds'] = round(_cpu_seconds() - cpu_before, 4)
+                peak = _peak_rss_bytes()
+                if peak is not None:
+                    record['peak_rss_bytes'] = peak
+                    record['peak_rss_is_stage_local'] = peak_reset
+                io_after = _io_bytes()
+                if io_before is not None and io_after is not None:
+                    record['bytes_read'] = io_after[0] - io_before[0]
+                    record['bytes_written'] = io_after[1] - io_before[1]
+                if record.get('frames'):
+                    record['frames_per_second'] = round(record['frames'] / max(wall, 1e-9), 2)
+                self.stages.append(record)
+
+    @contextmanager
+    def _capture(self, name):
+        if self.profile is None or self.profile_dir is None:
+            yield
+            return
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self.profile == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+        else:
+            import torch.profiler
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                        record_shapes=True) as profiler:
+                yield
+            profiler.export_chrome_trace(os.path.join(self.profile_dir, f"{name}.trace.json"))
+
+    def report(self):
+        return {
+            'started_at': self.started_at,
+            'host': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count()
+            },
+            'total_wall_seconds': round(sum(s['wall_seconds'] for s in self.stages), 4),
+            'stages': self.stages
+        }
+
+    def write_report(self, path):
+        """Write the JSON report and print a one-line summary per stage."""
+        path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+        print("\n⏱️ Stage timings:")
+        for s in self.stages:
+            fps = f", {s['frames_per_second']:.1f} frames/s" if 'frames_per_second' in s else ""
+            print(f"  - {s['stage']}: {s['wall_seconds']:.2f}s wall, {s['cpu_seconds']:.2f}s CPU{fps}")
+        print(f"📝 Saved performance report to {path}")
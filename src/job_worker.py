@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import atexit
+import threading
+import traceback
+import multiprocessing
+from feature_backends import DEFAULT_BACKEND
+
+# Background execution of pipeline jobs.
+#
+# JobWorker starts one worker process. The worker takes jobs from a queue and
+# runs the six pipeline stages for each of them. Feature backends stay loaded
+# in the worker between jobs, so only the first job with a given CNN backend
+# pays for building the model (the default backend is loaded at startup).
+# While a job runs, the stages' progress reports (see progress.py) are sent
+# back as events, at most a few per second. A cancelled job is dropped if it
+# is still queued. If it is already running, it stops at its next progress
+# report.
+#
+# Events are dicts with the job ID under 'job' and a 'type':
+#
+#   ready       worker is up ('backends': names of the preloaded backends)
+#   started     the worker picked the job up
+#   stage       a stage started ('stage', 'index')
+#   progress    'stage', 'done', 'total'
+#   done        'output' video, 'report' path and 'stages' timings
+#   failed      'error', 'traceback'
+#   cancelled
+#
+# Every job gets its own workspace (see workspace.py): the input video is
+# copied into data/jobs/<job ID> when the job is submitted, intermediate files
+# go there too, and all of it is removed when the job ends. The video and
+# report go to output/jobs/<job ID>. Jobs run one at a time so that a single
+# job gets every core. app.py keeps one JobWorker per Streamlit server.
+
+STAGES = ('extract_frames', 'jumble_frames', 'extract_features',
+          'build_similarity', 'solve_tsp', 'rebuild_video')
+PROGRESS_INTERVAL = 0.25
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOBS_DIR = os.path.join(BASE_DIR, 'data', 'jobs')
+OUTPUT_DIR = os.path.join(BASE_DIR, 'output', 'jobs')
+
+
+def run_job(job, backends, emit, is_cancelled):
+    """
+    Run every pipeline stage for one job in this process, in its own workspace.
+
+    Args:
+        job: Job dict ('id', 'video_path', 'jumble', 'feature_backend')
+        backends: Loaded feature backends by name, reused and extended across jobs
+        emit: callback(event dict) sending an event for this job
+        is_cancelled: callback() -> True once the job has been cancelled
+
+    Returns:
+        dict: Output video path, report path and per-stage timings
+    """
+    from workspace import job_workspace
+
+    workspace = job_workspace(JOBS_DIR, job['id'], output_dir=OUTPUT_DIR).create()
+    try:
+        return _run_stages(job, workspace, backends, emit, is_cancelled)
+    finally:
+        workspace.remove_data()
+
+
+def _run_stages(job, workspace, backends, emit, is_cancelled):
+    from extract_frames import extract_frames
+    from jumble_frames import jumble_frames
+    from feature_extraction import extract_features
+    from feature_backends import get_backend
+    from build_similarity import build_similarity
+    from tsp_solver import solve_tsp
+    from rebuild_video import rebuild_video
+    from instrumentation import PipelineProfiler
+    from progress import Cancelled
+
+    profiler = PipelineProfiler()
+    n_frames = None
+
+    def stage(name):
+        if is_cancelled():
+            raise Cancelled()
+        emit({'type': 'stage', 'stage': name, 'index': STAGES.index(name)})
+        return profiler.stage(name, frames=n_frames)
+
+    with stage('extract_frames') as record:
+        extract_frames(job['video_path'], workspace.frames_dir, workspace=workspace)
+        with open(workspace.metadata_path, 'r') as f:
+            n_frames = record['frames'] = json.load(f)['total_frames']
+
+    if job['jumble']:
+        with stage('jumble_frames'):
+            jumble_frames(workspace=workspace)
+        source_dir = workspace.frames_jumbled_dir
+    else:
+        source_dir = workspace.frames_dir
+
+    name = job.get('feature_backend') or DEFAULT_BACKEND
+    if name not in backends:
+        backends[name] = get_backend(name)
+    with stage('extract_features'):
+        extract_features(source_dir, workspace.features_path,
+                         cache_path=workspace.feature_cache_path, backend=backends[name])
+
+    with stage('build_similarity'):
+        build_similarity(workspace=workspace)
+
+    with stage('solve_tsp'):
+        solve_tsp(workspace=workspace)
+
+    with stage('rebuild_video'):
+        rebuild_video(frames_dir=source_dir, workspace=workspace)
+
+    profiler.write_report(workspace.report_path)
+    return {'output': workspace.output_video, 'report': workspace.report_path,
+            'stages': profiler.stages}
+
+
+def worker_main(jobs, events, cancels, preload=()):
+    """
+    Worker process loop: run jobs from `jobs` until it yields None.
+
+    Args:
+        jobs: Queue of job dicts
+        events: Queue the events are put on
+        cancels: Queue of IDs of cancelled jobs
+        preload: Feature backends to load before the first job
+    """
+    from feature_backends import get_backend
+    from progress import Cancelled, set_listener
+    from workspace import job_workspace
+
+    backends = {}
+    for name in preload:
+        try:
+            backends[name] = get_backend(name)
+            backends[name].load()
+        except Exception as e:
+            backends.pop(name, None)
+            print(f"⚠️ Could not preload feature backend '{name}': {str(e)}")
+    events.put({'job': None, 'type': 'ready', 'backends': list(backends)})
+
+    cancelled = set()
+
+    def drain_cancels():
+        while True:
+            try:
+                cancelled.add(cancels.get_nowait())
+            except queue.Empty:
+                return
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id = job['id']
+        drain_cancels()
+        if job_id in cancelled:
+            cancelled.discard(job_id)
+            job_workspace(JOBS_DIR, job_id, output_dir=OUTPUT_DIR).remove_data()
+            events.put({'job': job_id, 'type': 'cancelled'})
+            continue
+
+        def emit(event):
+            event['job'] = job_id
+            events.put(event)
+
+        def is_cancelled():
+            drain_cancels()
+            return job_id in cancelled
+
+        last_event = [0.0]
+
+        def listener(stage, done, total):
+            now = time.monotonic()
+            if done != total and now - last_event[0] < PROGRESS_INTERVAL:
+                return
+            last_event[0] = now
+            if is_cancelled():
+                raise Cancelled()
+            emit({'type': 'progress', 'stage': stage, 'done': done, 'total': total})
+
+        emit({'type': 'started'})
+        set_listener(listener)
+        try:
+            result = run_job(job, backends, emit, is_cancelled)
+        except Cancelled:
+            print(f"🛑 Job {job_id} cancelled")
+            emit({'type': 'cancelled'})
+        except Exception as e:
+            traceback.print_exc()
+            emit({'type': 'failed', 'error': str(e), 'traceback': traceback.format_exc()})
+        else:
+            emit(dict(result, type='done'))
+        finally:
+            set_listener(None)
+            cancelled.discard(job_id)
+
+
+def overall_progress(job):
+    """Fraction of a job's stages done, counting the running stage's progress."""
+    if job['state'] == 'done':
+        return 1.0
+    if job.get('stage') is None:
+        return 0.0
+    fraction = min(job['done'] / job['total'], 1.0) if job['total'] else 0.0
+    return (job['index'] + fraction) / len(STAGES)
+
+
+class JobWorker:
+    """
+    Runs pipeline jobs in a background process and tracks their state.
+
+    The worker is started with the spawn method (torch and OpenMP thread pools
+    do not survive a fork) and shut down when this process exits.
+
+    Args:
+        preload: Feature backends the worker loads as soon as it starts
+    """
+
+    def __init__(self, preload=(DEFAULT_BACKEND,)):
+        context = multiprocessing.get_context('spawn')
+        self.jobs = context.Queue()
+        self.events = context.Queue()
+        self.cancels = context.Queue()
+        self.process = context.Process(target=worker_main, name='pipeline-worker',
+                                       args=(self.jobs, self.events, self.cancels, tuple(preload)))
+        self.process.start()
+
+        self.ready = False
+        self.status = {}
+        self.lock = threading.Lock()
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        atexit.register(self.shutdown)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def submit(self, video, jumble=True, feature_backend=None):
+        """
+        Queue a job for a video.
+
+        The video is copied into the job's workspace, and the job owns that
+        copy: overwriting or deleting the original (e.g. on a Streamlit rerun,
+        or another session uploading a file of the same name) does not touch it.
+
+        Args:
+            video: Input video, as a path or a readable binary file object
+                   (such as a Streamlit upload)
+            jumble: Shuffle the frames before reconstructing them
+            feature_backend: Name of a feature backend. Defaults to ResNet-18.
+
+        Returns:
+            str: Job ID
+        """
+        if not self.is_alive():
+            raise RuntimeError(f"Worker process exited with code {self.process.exitcode}")
+        from workspace import job_workspace
+
+        job_id = uuid.uuid4().hex[:12]
+        workspace = job_workspace(JOBS_DIR, job_id, output_dir=OUTPUT_DIR).create()
+        is_path = isinstance(video, (str, os.PathLike))
+        name = str(video) if is_path else getattr(video, 'name', '')
+        video_path = os.path.join(workspace.data_dir, 'input' + (os.path.splitext(name)[1] or '.mp4'))
+        if is_path:
+            shutil.copyfile(video, video_path)
+        else:
+            video.seek(0)
+            with open(video_path, 'wb') as f:
+                shutil.copyfileobj(video, f)
+
+        with self.lock:
+            self.status[job_id] = {'id': job_id, 'state': 'queued', 'submitted': time.time(),
+                                   'stage': None, 'index': 0, 'done': 0, 'total': 0}
+        self.jobs.put({'id': job_id, 'video_path': video_path,
+                       'jumble': bool(jumble), 'feature_backend': feature_backend})
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Its state turns 'cancelled' once the worker stops it."""
+        with self.lock:
+            if self.status.get(job_id, {}).get('state') not in ('queued', 'running'):
+                return
+        self.cancels.put(job_id)
+
+    def job(self, job_id):
+        """
+        Snapshot of a job's state, or None for an unknown ID.
+
+        'state' is one of queued, running, done, failed and cancelled. Queued
+        jobs also have 'ahead': the number of jobs that will run before them.
+        """
+        with self.lock:
+            if job_id not in self.status:
+                return None
+            job = dict(self.status[job_id])
+            if job['state'] == 'queued':
+                job['ahead'] = sum(1 for other in self.status.values()
+                                   if other['state'] == 'running'
+                                   or (other['state'] == 'queued' and other['submitted'] < job['submitted']))
+        return job
+
+    def _collect(self):
+        """Apply worker events to the job states (runs on a background thread)."""
+        while True:
+            try:
+                event = self.events.get(timeout=1.0)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    self._fail_unfinished(f"Worker process exited with code {self.process.exitcode}")
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+
+            kind = event.pop('type')
+            job_id = event.pop('job')
+            with self.lock:
+                if kind == 'ready':
+                    self.ready = True
+                    continue
+                job = self.status.get(job_id)
+                if job is None:
+                    continue
+                if kind == 'started':
+                    job['state'] = 'running'
+                elif kind == 'stage':
+                    job.update(event, done=0, total=0)
+                elif kind == 'progress':
+                    if event['stage'] == job['stage']:
+                        job.update(event)
+                else:
+                    job.update(event, state=kind)
+
+    def _fail_unfinished(self, error):
+        with self.lock:
+            for job in self.status.values():
+                if job['state'] in ('queued', 'running'):
+                    job.update(state='failed', error=error)
+
+    def shutdown(self, timeout=5.0):
+        """Stop the worker once its queued jobs are done, terminating it after `timeout` seconds."""
+        if not self.process.is_alive():
+            return
+        self.jobs.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
@@ -1,39 +1,96 @@
 import os
 import random
 import shutil
+import numpy as np
+from frame_store import FrameStore, is_frame_store
+from progress import report
+from workspace import Workspace
+
+PERMUTATION_FILE = 'frame_permutation.npy'
+
+def permutation_path_for(output_dir):
+    """Where the ground-truth permutation of a jumble is saved: next to its output."""
+    return os.path.join(os.path.dirname(os.path.abspath(str(output_dir))), PERMUTATION_FILE)
+
+def save_permutation(permutation, path):
+    """Save the shuffle so that jumbled frame i is original frame permutation[i]."""
+    np.save(path, np.asarray(permutation, dtype=np.int64))
+    print(f"Ground-truth permutation saved to: {path}")
+
+def jumble_frames(input_dir=None, output_dir=None, seed=None, workspace=None):
+    """
+    Shuffle the extracted frames.
+
+    The shuffle is saved to frame_permutation.npy next to `output_dir`
+    (data/frame_permutation.npy by default) so solved orders can be scored
+    against it with scoring.py.
+
+    Args:
+        input_dir: Frames directory or frame store header. Defaults to data/frames.
+        output_dir: Where to put the jumbled frames. Defaults to data/frames_jumbled.
+                    For a frame store this is a view header (.json) that only holds
+                    the shuffled index, so no frames are copied.
+        seed: Random seed for a reproducible shuffle. None shuffles differently every run.
+        workspace: Job workspace the default directories come from (see workspace.py).
+                   Defaults to the repository's data/ directory.
+    """
+    workspace = workspace or Workspace()
 
-def jumble_frames():
-    # Get the base directory (one level up from src)
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
     # Define input and output directories
-    input_dir = os.path.join(base_dir, 'data', 'frames')
-    output_dir = os.path.join(base_dir, 'data', 'frames_jumbled')
-    
+    if input_dir is None:
+        input_dir = workspace.frames_dir
+    if output_dir is None:
+        output_dir = workspace.frames_jumbled_dir
+
+    rng = random.Random(seed)
+    if is_frame_store(input_dir):
+        jumble_frame_store(input_dir, output_dir, rng)
+        return
+
     # Create output directory if it doesn't exist, clear it if it does
     if os.path.exists(output_dir):
         shutil.rmtree(output_dir)
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Get all image files from input directory
-    frames = [f for f in os.listdir(input_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
+
+    # Get all image files from input directory, in original order
+    frames = sorted(f for f in os.listdir(input_dir) if f.endswith(('.jpg', '.jpeg', '.png')))
     print(f"Found {len(frames)} frames in {input_dir}")
-    
+
     if not frames:
         print("❌ No frames found in the input directory!")
         return
-    
+
     # Shuffle the frames
-    random.shuffle(frames)
-    
+    permutation = list(range(len(frames)))
+    rng.shuffle(permutation)
+
     # Copy frames to output directory with new names
-    for i, frame in enumerate(frames):
-        src = os.path.join(input_dir, frame)
+    for i, original in enumerate(permutation):
+        src = os.path.join(input_dir, frames[original])
         dst = os.path.join(output_dir, f"{i:04d}.jpg")
         shutil.copy2(src, dst)
-    
+        report('jumble_frames', i + 1, len(frames))
+
     print(f"✅ Successfully jumbled {len(frames)} frames")
     print(f"Jumbled frames saved to: {output_dir}")
+    save_permutation(permutation, permutation_path_for(output_dir))
+
+def jumble_frame_store(store_path, view_path, rng=random):
+    """Jumble a frame store by writing a shuffled view of its index."""
+    store = FrameStore(store_path)
+    print(f"Found {len(store)} frames in {store_path}")
+
+    if len(store) == 0:
+        print("❌ No frames found in the frame store!")
+        return
+
+    index = list(range(len(store)))
+    rng.shuffle(index)
+    store.view(view_path, index)
+
+    print(f"✅ Successfully jumbled {len(store)} frames")
+    print(f"Jumbled frame index saved to: {view_path}")
+    save_permutation(index, permutation_path_for(view_path))
 
 if __name__ == "__main__":
     jumble_frames()
@@ -0,0 +1,206 @@
+import time
+from collections import deque
+import numpy as np
+
+# Local search over an open path of frames: 2-opt (reverse a segment) and
+# Or-opt (move a run of up to OR_OPT_MAX frames elsewhere, optionally reversed).
+# The objective is the sum of similarities between consecutive frames.
+# Only moves that create an edge to one of a frame's k nearest neighbours are
+# tried, and frames whose neighbourhood produced no improvement are switched
+# off ("don't-look bits") until an adjacent edge changes.
+
+OR_OPT_MAX = 3
+MIN_GAIN = 1e-9
+
+
+def top_k_neighbours(similarity, k, block_size=1024):
+    """
+    Indices of the k most similar frames for every frame of a dense matrix, best first.
+
+    Args:
+        similarity: NxN similarity matrix (array or memmap)
+        k: Neighbours to keep per frame (the frame itself is excluded)
+        block_size: Rows processed at once
+
+    Returns:
+        np.ndarray: N x k array of frame indices
+    """
+    n = similarity.shape[0]
+    k = max(1, min(k, n - 1))
+    neighbours = np.empty((n, k), dtype=np.int64)
+
+    for start in range(0, n, block_size):
+        block = np.array(similarity[start:start + block_size], dtype=np.float32)
+        rows = np.arange(block.shape[0])
+        block[rows, rows + start] = -np.inf
+        idx = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        sims = np.take_along_axis(block, idx, axis=1)
+        rank = np.argsort(-sims, axis=1, kind='stable')
+        neighbours[start:start + block_size] = np.take_along_axis(idx, rank, axis=1)
+
+    return neighbours
+
+
+def path_score(order, pair_similarity):
+    """Sum of similarities between consecutive frames of an order."""
+    return sum(pair_similarity(a, b) for a, b in zip(order[:-1], order[1:]))
+
+
+def improve_order(order, pair_similarity, neighbours, time_budget=10.0):
+    """
+    Improve a frame order with 2-opt and Or-opt moves until no move helps
+    or the time budget runs out.
+
+    Args:
+        order: Initial order (list of frame indices), e.g. from the greedy solver
+        pair_similarity: Function (a, b) -> float similarity of two frames
+        neighbours: N x k candidate neighbours per frame, best first
+        time_budget: Seconds to spend at most
+
+    Returns:
+        tuple: (improved order as a list, dict of search statistics)
+    """
+    n = len(order)
+    start_time = time.perf_counter()
+    stats = {'two_opt_moves': 0, 'or_opt_moves': 0, 'gain': 0.0, 'timed_out': False}
+    if n < 4:
+        stats['elapsed'] = 0.0
+        return list(order), stats
+
+    neighbour_lists = np.asarray(neighbours).tolist()
+
+    # path[0] and path[n + 1] are sentinels (-1) with similarity 0 to everything,
+    # so the two ends of the open path can move like any other edge.
+    path = np.empty(n + 2, dtype=np.int64)
+    path[0] = path[n + 1] = -1
+    path[1:n + 1] = order
+    pos = np.empty(n, dtype=np.int64)
+    pos[path[1:n + 1]] = np.arange(1, n + 1)
+
+    def sim(a, b):
+        if a < 0 or b < 0:
+            return 0.0
+        return pair_similarity(a, b)
+
+    def reverse(i, j):
+        # Reverse path[i..j] in place (1 <= i <= j <= n)
+        segment = path[i:j + 1][::-1].copy()
+        path[i:j + 1] = segment
+        pos[segment] = np.arange(i, j + 1)
+
+    def try_two_opt(a):
+        i = pos[a]
+        a_next, a_prev = path[i + 1], path[i - 1]
+        d_next, d_prev = sim(a, a_next), sim(a_prev, a)
+
+        for c in neighbour_lists[a]:
+            s_ac = sim(a, c)
+            if s_ac <= d_next and s_ac <= d_prev:
+                break  # neighbours are sorted, nothing further can help
+            j = pos[c]
+
+            # Replace (a, a_next) and (c, c_next) with (a, c) and (a_next, c_next)
+            c_next = path[j + 1]
+            if s_ac > d_next and c != a_next and c_next != a:
+                gain = s_ac + sim(a_next, c_next) - d_next - sim(c, c_next)
+                if gain > MIN_GAIN:
+                    if i < j:
+                        reverse(i + 1, j)
+                    else:
+                        reverse(j + 1, i)
+                    return gain, (a, a_next, c, c_next)
+
+            # Replace (a_prev, a) and (c_prev, c) with (a, c) and (a_prev, c_prev)
+            c_prev = path[j - 1]
+            if s_ac > d_prev and c != a_prev and c_prev != a:
+                gain = s_ac + sim(a_prev, c_prev) - d_prev - sim(c_prev, c)
+                if gain > MIN_GAIN:
+                    if i < j:
+                        reverse(i, j - 1)
+                    else:
+                        reverse(j, i - 1)
+                    return gain, (a, a_prev, c, c_prev)
+
+        return 0.0, ()
+
+    def try_or_opt(a):
+        nonlocal path
+        i = pos[a]
+        best = None
+
+        for length in range(1, OR_OPT_MAX + 1):
+            # Segments of this length that have `a` at one end
+            starts = (i,) if length == 1 else (i, i - length + 1)
+            for first in starts:
+                last = first + length - 1
+                if first < 1 or last > n:
+                    continue
+                p, q = path[first - 1], path[last + 1]
+                seg_first, seg_last = path[first], path[last]
+                removal = sim(p, seg_first) + sim(seg_last, q) - sim(p, q)
+
+                for c in neighbour_lists[a]:
+                    j = pos[c]
+                    if first <= j <= last:
+                        continue
+                    # Insert between path[k] and path[k + 1], with `a` next to c
+                    for k in (j - 1, j):
+                        if first - 1 <= k <= last:
+                            continue
+                        x, y = path[k], path[k + 1]
+                        base = sim(x, y)
+                        # Forward: x, seg_first..seg_last, y
+                        gain = sim(x, seg_first) + sim(seg_last, y) - base - removal
+                        if gain > MIN_GAIN and (best is None or gain > best[0]):
+                            best = (gain, first, last, k, False)
+                        # Reversed: x, seg_last..seg_first, y
+                        gain = sim(x, seg_last) + sim(seg_first, y) - base - removal
+                        if gain > MIN_GAIN and (best is None or gain > best[0]):
+                            best = (gain, first, last, k, True)
+            if best is not None:
+                break
+
+        if best is None:
+            return 0.0, ()
+
+        gain, first, last, k, flip = best
+        segment = path[first:last + 1]
+        touched = (path[first - 1], path[last + 1], path[k], path[k + 1], segment[0], segment[-1])
+        if flip:
+            segment = segment[::-1]
+        if k < first:
+            path = np.concatenate([path[:k + 1], segment, path[k + 1:first], path[last + 1:]])
+        else:
+            path = np.concatenate([path[:first], path[last + 1:k + 1], segment, path[k + 1:]])
+        pos[path[1:n + 1]] = np.arange(1, n + 1)
+        return gain, touched
+
+    active = deque(path[1:n + 1].tolist())
+    in_queue = bytearray([1]) * n
+
+    while active:
+        if time.perf_counter() - start_time > time_budget:
+            stats['timed_out'] = True
+            break
+
+        a = active.popleft()
+        in_queue[a] = 0
+
+        gain, touched = try_two_opt(a)
+        if gain > 0:
+            stats['two_opt_moves'] += 1
+        else:
+            gain, touched = try_or_opt(a)
+            if gain > 0:
+                stats['or_opt_moves'] += 1
+
+        if gain > 0:
+            stats['gain'] += gain
+            # Frames whose edges changed get their don't-look bit cleared
+            for node in (a,) + tuple(touched):
+                if node >= 0 and not in_queue[node]:
+                    in_queue[node] = 1
+                    active.append(node)
+
+    stats['elapsed'] = time.perf_counter() - start_time
+    return path[1:n + 1].tolist(), stats
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+
+# Stage manifests for incremental pipeline runs.
+#
+# Every stage gets a key: a hash of its name, its parameters and the keys of
+# the stages it reads from (or, for the first stage, the input video's content
+# hash). After a stage succeeds, data/manifests/<stage>.json records that key
+# together with the size and mtime of each output. A rerun can skip the stage
+# when the key is unchanged and the outputs are still exactly as written.
+# Downstream stages are keyed on output_key(), which also covers the output
+# state, so a stage that reran (e.g. a fresh random jumble) invalidates them.
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Content hash of a file, read in chunks."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stage_key(stage, params, inputs):
+    """
+    Key identifying one run of a stage.
+
+    Args:
+        stage: Stage name
+        params: JSON-serialisable parameters that affect the stage output
+        inputs: Keys of upstream stages or content hashes of input files
+    """
+    payload = json.dumps({'stage': stage, 'params': params, 'inputs': inputs}, sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def _output_state(path):
+    path = str(path)
+    if os.path.isdir(path):
+        st = os.stat(path)
+        return {'type': 'dir', 'entries': len(os.listdir(path)), 'mtime_ns': st.st_mtime_ns}
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return {'type': 'file', 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    return None
+
+
+def output_key(key, outputs):
+    """Key handed to downstream stages: the stage key plus the state of its outputs."""
+    states = [_output_state(output) for output in outputs]
+    payload = json.dumps({'key': key, 'outputs': states}, sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def manifest_path(manifests_dir, stage):
+    return os.path.join(str(manifests_dir), f"{stage}.json")
+
+
+def is_up_to_date(manifests_dir, stage, key, outputs):
+    """True if the stage last ran with this key and its outputs are untouched."""
+    path = manifest_path(manifests_dir, stage)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if manifest.get('key') != key:
+        return False
+    recorded = manifest.get('outputs', {})
+    for output in outputs:
+        state = _output_state(output)
+        if state is None or recorded.get(str(output)) != state:
+            return False
+    return True
+
+
+def invalidate(manifests_dir, stage):
+    """Forget a stage's manifest, e.g. before rerunning it."""
+    path = manifest_path(manifests_dir, stage)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def write_manifest(manifests_dir, stage, key, params, inputs, outputs):
+    """Record a successful stage run."""
+    os.makedirs(str(manifests_dir), exist_ok=True)
+    manifest = {
+        'stage': stage,
+        'key': key,
+        'params': params,
+        'inputs': inputs,
+        'outputs': {str(output): _output_state(output) for output in outputs},
+        'completed_at': time.time()
+    }
+    with open(manifest_path(manifests_dir, stage), 'w') as f:
+        json.dump(manifest, f, indent=2)
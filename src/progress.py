@@ -0,0 +1,36 @@
+# Progress reporting from inside pipeline stages.
+#
+# Stages call report(stage, done, total) from their main loops (per frame, per
+# row block or per solver step). Nothing listens by default, so a report costs
+# one global lookup. A driver such as job_worker.py installs a listener to
+# stream progress events somewhere else. A listener may also raise Cancelled,
+# which unwinds the running stage from inside its loop.
+
+
+class Cancelled(Exception):
+    """Raised inside a running stage when its job has been cancelled."""
+
+
+_listener = None
+
+
+def set_listener(listener):
+    """
+    Install the progress listener, replacing the current one.
+
+    Args:
+        listener: callback(stage, done, total), or None to stop listening
+
+    Returns:
+        The previous listener, so callers can restore it
+    """
+    global _listener
+    previous = _listener
+    _listener = listener
+    return previous
+
+
+def report(stage, done, total):
+    """Report that `done` of `total` units of a stage are finished."""
+    if _listener is not None:
+        _listener(stage, done, total)
@@ -1,23 +1,270 @@
 import cv2
 import numpy as np
 import os
-import gc
 import json
+import queue
+import bisect
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from frame_store import open_frame_source
+from feature_index import load_frame_ids, source_frame_indices
+from progress import report
+from workspace import Workspace
 
-def rebuild_video(fps=None):
+def probe_keyframes(video_path, fps):
+    """
+    Frame indices of the keyframes of a video, read from packet flags with ffprobe.
+
+    Returns:
+        list or None: Sorted keyframe indices, or None if ffprobe is unavailable or fails
+    """
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path],
+            capture_output=True, text=True, timeout=120)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0 or not fps:
+        return None
+
+    times = []
+    for line in result.stdout.splitlines():
+        parts = line.split(',')
+        if len(parts) >= 2 and 'K' in parts[1] and parts[0] not in ('', 'N/A'):
+            times.append(float(parts[0]))
+    if not times:
+        return None
+    first = min(times)
+    return sorted({int(round((t - first) * fps)) for t in times})
+
+class SourceFrameReader:
+    """
+    Random access to the frames of a video file, backed by an LRU cache of decoded frames.
+
+    Sequential reads just keep decoding. On a cache miss the reader seeks and
+    decodes forward, caching what it passes, so short backward runs (e.g. a
+    reversed segment) are served from memory. When the keyframes are known
+    (see probe_keyframes), a seek always lands on the last keyframe at or
+    before the target, where the decoder can start without decoding frames it
+    throws away, and a forward jump only seeks when a keyframe lies in between.
+    Without them, the reader seeks a little before the requested frame.
+    """
+
+    def __init__(self, video_path, cache_frames=64, keyframes=None):
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+        self.cache_frames = max(1, cache_frames)
+        self.cache = OrderedDict()
+        self.keyframes = keyframes or None
+        self.position = 0  # index of the frame the next cap.read() returns
+
+    def _decode_next(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        idx = self.position
+        self.position += 1
+        self.cache[idx] = frame
+        self.cache.move_to_end(idx)
+        while len(self.cache) > self.cache_frames:
+            self.cache.popitem(last=False)
+        return frame
+
+    def read(self, idx):
+        idx = int(idx)
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            return self.cache[idx]
+
+        if self.keyframes is not None:
+            # Last keyframe at or before idx: decoding can restart there
+            keyframe = self.keyframes[max(0, bisect.bisect_right(self.keyframes, idx) - 1)]
+            if idx < self.position or keyframe > self.position:
+                self._seek(keyframe)
+        elif idx < self.position or idx - self.position > self.cache_frames:
+            self._seek(max(0, idx - self.cache_frames // 2))
+
+        frame = None
+        while self.position <= idx:
+            frame = self._decode_next()
+            if frame is None:
+                return None
+        return frame
+
+    def _seek(self, start):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        self.position = start
+
+    def release(self):
+        self.cap.release()
+        self.cache.clear()
+
+def prefetch_ordered(read, order, num_workers=4, prefetch=32):
+    """
+    Read frames in output order on a thread pool while the caller encodes.
+
+    At most `prefetch` frames are decoded ahead, so memory stays bounded.
+
+    Yields:
+        tuple: (frame index, frame or None, exception or None)
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        order = iter(order)
+        for idx in order:
+            pending.append((idx, pool.submit(read, idx)))
+            if len(pending) >= max(prefetch, num_workers):
+                break
+
+        while pending:
+            idx, future = pending.popleft()
+            next_idx = next(order, None)
+            if next_idx is not None:
+                pending.append((next_idx, pool.submit(read, next_idx)))
+            try:
+                yield idx, future.result(), None
+            except Exception as e:
+                yield idx, None, e
+
+def prefetch_sequential(reader, order, prefetch=32):
+    """
+    Read frames in output order on one background thread while the caller encodes.
+
+    A SourceFrameReader holds a single decoder, so its reads cannot run in
+    parallel; this still overlaps decoding with encoding.
+
+    Yields:
+        tuple: (frame index, frame or None, exception or None)
+    """
+    frames = queue.Queue(maxsize=max(1, prefetch))
+    done = object()
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for idx in order:
+                if stop.is_set():
+                    break
+                try:
+                    frames.put((idx, reader.read(idx), None))
+                except Exception as e:
+                    frames.put((idx, None, e))
+        finally:
+            frames.put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                frames.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.1)
+
+def rebuild_video_from_source(video_path, source_order, output_path, fps, cache_frames=64,
+                              keyframes=True, prefetch=32):
+    """
+    Write frames straight from the source video in the given order.
+
+    Used by the streaming pipeline, where frames are never written to disk,
+    and by rebuild_video(source_video=...) when the jumbled frames are gone.
+
+    Args:
+        video_path: Path to the original video
+        source_order: Source frame indices, in output order
+        output_path: Path of the video to write
+        fps: Frames per second for the output video
+        cache_frames: Decoded frames kept in memory to avoid re-seeking
+        keyframes: Probe the keyframes with ffprobe for keyframe-aware seeking
+                   (falls back to plain seeking if ffprobe is not installed)
+        prefetch: Frames decoded ahead of the encoder on a background thread
+    """
+    reader = SourceFrameReader(video_path, cache_frames=cache_frames)
+    if keyframes:
+        reader.keyframes = probe_keyframes(video_path, reader.cap.get(cv2.CAP_PROP_FPS))
+    width = int(reader.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(reader.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+    print(f"\n🛠️ Reconstructing video from {video_path}...")
+    if reader.keyframes is not None:
+        print(f"  - {len(reader.keyframes)} keyframes, seeking keyframe to keyframe")
+    written = 0
+    frames = prefetch_sequential(reader, source_order, prefetch=prefetch)
+    try:
+        for i, (frame_idx, frame, error) in enumerate(frames):
+            report('rebuild_video', i + 1, len(source_order))
+            if error is not None:
+                print(f"⚠️ Error decoding source frame {frame_idx}: {str(error)}")
+                continue
+            if frame is None:
+                print(f"⚠️ Could not decode source frame {frame_idx}. Skipping...")
+                continue
+            out.write(frame)
+            written += 1
+
+            if (i + 1) % 50 == 0 or (i + 1) == len(source_order):
+                print(f"  - Processed {i + 1}/{len(source_order)} frames...")
+    finally:
+        # Stop the decode thread before releasing the reader it reads from
+        frames.close()
+        out.release()
+        reader.release()
+
+    print(f"\n✅ Success! Video saved to: {output_path}")
+    print(f"   - Resolution: {width}x{height}")
+    print(f"   - Frames: {written}")
+    print(f"   - Duration: {written/fps:.2f} seconds")
+
+def rebuild_video(fps=None, frames_dir=None, output_path=None, order_path=None,
+                  num_workers=None, prefetch=32, source_video=None, permutation_path=None,
+                  workspace=None):
     """
     Rebuild video from frames in the determined order.
+
+    Upcoming frames are decoded on a thread pool in output order while the
+    encoder writes the current one.
     
     Args:
         fps: Frames per second for output video. If None, uses original video FPS from metadata.
+        frames_dir: Frames directory or frame store header the order refers to.
+                    Defaults to data/frames_jumbled.
+        output_path: Video file to write. Defaults to output/reconstructed_video.mp4.
+        order_path: Saved frame order. Defaults to data/frame_order_final.npy.
+        num_workers: Frame decode threads. If None, uses the CPU count (max 8).
+        prefetch: Frames decoded ahead of the encoder
+        source_video: Read frames from this original video instead of frames_dir
+                      (decoded-frame cache plus keyframe-aware seeking), for when
+                      the jumbled frames were never written or have been deleted
+        permutation_path: Ground-truth shuffle mapping jumbled positions to source
+                          frames, used with source_video. Defaults to data/frame_permutation.npy.
+        workspace: Job workspace the default paths and the video metadata come from
+                   (see workspace.py). Defaults to the repository's data/ and output/.
     """
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workspace = workspace or Workspace()
     
-    frames_dir = os.path.join(base_dir, 'data', 'frames_jumbled')
-    order_path = os.path.join(base_dir, 'data', 'frame_order_final.npy')
-    output_dir = os.path.join(base_dir, 'output')
-    output_path = os.path.join(output_dir, 'reconstructed_video.mp4')
-    metadata_path = os.path.join(base_dir, 'data', 'video_metadata.json')
+    if frames_dir is None:
+        frames_dir = workspace.frames_jumbled_dir
+    if order_path is None:
+        order_path = workspace.order_path
+    if output_path is None:
+        output_path = workspace.output_video
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    metadata_path = workspace.metadata_path
     
     # Load video metadata if available
     if fps is None and os.path.exists(metadata_path):
@@ -42,23 +289,38 @@ def rebuild_video(fps=None):
         return
         
     order = np.load(order_path)
+    order_ids = load_frame_ids(order_path, expected=len(order))
     print(f"  - Total frames in order: {len(order)}")
 
-    frame_files = [f for f in os.listdir(frames_dir) 
-                  if f.endswith(('.jpg', '.jpeg', '.png'))]
-    frame_files.sort() 
+    if source_video is not None:
+        if permutation_path is None:
+            permutation_path = workspace.permutation_path
+        permutation = np.load(permutation_path) if os.path.exists(permutation_path) else None
+        source_order = source_frame_indices(order, order_ids, permutation)
+        rebuild_video_from_source(source_video, source_order, output_path, fps, prefetch=prefetch)
+        return
+
+    frames = open_frame_source(frames_dir)
     
-    if not frame_files:
+    if len(frames) == 0:
         print(f"❌ No frame files found in {frames_dir}")
         return
         
-    print(f"  - Found {len(frame_files)} frame files")
+    print(f"  - Found {len(frames)} frames")
+
+    if order_ids is not None:
+        # Look frames up by ID: feature rows skip frames that failed to decode,
+        # so an order position is not necessarily an index into the frame list
+        positions = {frames.name(i): i for i in range(len(frames))}
+        missing = [frame_id for frame_id in order_ids if frame_id not in positions]
+        if missing:
+            print(f"⚠️ {len(missing)} frames of the order are not in {frames_dir}, e.g. {missing[0]}")
+        order = [positions.get(frame_id, len(frames)) for frame_id in order_ids]
 
-    first_frame_path = os.path.join(frames_dir, frame_files[0])
     try:
-        first_frame = cv2.imread(first_frame_path, cv2.IMREAD_COLOR)
+        first_frame = frames.read(0)
         if first_frame is None:
-            print(f"❌ Could not read frame: {first_frame_path}")
+            print(f"❌ Could not read frame: {frames.name(0)}")
             return
     except Exception as e:
         print(f"❌ Error reading first frame: {str(e)}")
@@ -67,9 +329,7 @@ def rebuild_video(fps=None):
         
     height, width, _ = first_frame.shape
     
-    # Free up memory from first_frame
     del first_frame
-    gc.collect()
     
     print(f"\n🎥 Video Properties:")
     print(f"  - Resolution: {width}x{height}")
@@ -81,38 +341,32 @@ def rebuild_video(fps=None):
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
     
-    # Write frames in the determined order
-    for i, frame_idx in enumerate(order):
-        if frame_idx >= len(frame_files):
-            print(f"⚠️ Frame index {frame_idx} out of range. Skipping...")
-            continue
-        
-        try:
-            frame_path = os.path.join(frames_dir, frame_files[frame_idx])
-            frame = cv2.imread(frame_path, cv2.IMREAD_COLOR)
-            
+    # Write frames in the determined order, decoding ahead on the pool
+    if num_workers is None:
+        num_workers = min(8, os.cpu_count() or 1)
+    in_range = [frame_idx for frame_idx in order if frame_idx < len(frames)]
+    if len(in_range) < len(order):
+        print(f"⚠️ {len(order) - len(in_range)} frame indices out of range. Skipping...")
+    written = 0
+    try:
+        for i, (frame_idx, frame, error) in enumerate(
+                prefetch_ordered(frames.read, in_range, num_workers=num_workers, prefetch=prefetch)):
+            report('rebuild_video', i + 1, len(in_range))
+            if error is not None:
+                print(f"⚠️ Error processing frame {frame_idx}: {str(error)}")
+                continue
             if frame is None:
-                print(f"⚠️ Could not read frame {frame_path}. Skipping...")
+                print(f"⚠️ Could not read frame {frames.name(frame_idx)}. Skipping...")
                 continue
-                
+
             out.write(frame)
-            
-            # Free memory for the frame
-            del frame
-            
-            # Periodic garbage collection
-            if (i + 1) % 50 == 0:
-                gc.collect()
-            
-        except Exception as e:
-            print(f"⚠️ Error processing frame {frame_idx}: {str(e)}")
-            continue
-        
-        # Show progress
-        if (i + 1) % 50 == 0 or (i + 1) == len(order):
-            print(f"  - Processed {i + 1}/{len(order)} frames...")
+            written += 1
 
-    out.release()
+            # Show progress
+            if (i + 1) % 50 == 0 or (i + 1) == len(in_range):
+                print(f"  - Processed {i + 1}/{len(in_range)} frames...")
+    finally:
+        out.release()
     
 
     if os.path.exists(output_path):
@@ -120,10 +374,21 @@ def rebuild_video(fps=None):
         print(f"\n✅ Success! Video saved to: {output_path}")
         print(f"   - File size: {file_size:.2f} MB")
         print(f"   - Resolution: {width}x{height}")
-        print(f"   - Frames: {len(order)}")
-        print(f"   - Duration: {len(order)/fps:.2f} seconds")
+        print(f"   - Frames: {written}")
+        print(f"   - Duration: {written/fps:.2f} seconds")
     else:
         print("❌ Failed to create output video file.")
 
 if __name__ == "__main__":
-    rebuild_video()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write the reconstructed video in the solved frame order.")
+    parser.add_argument("--fps", type=float, default=None, help="Output FPS (default: original video FPS)")
+    parser.add_argument("--workers", type=int, default=None, help="Frame decode threads (default: CPU count, max 8)")
+    parser.add_argument("--prefetch", type=int, default=32, help="Frames decoded ahead of the encoder (default: 32)")
+    parser.add_argument("--source_video", type=str, default=None,
+                        help="Read frames from the original video instead of data/frames_jumbled")
+    args = parser.parse_args()
+
+    rebuild_video(fps=args.fps, num_workers=args.workers, prefetch=args.prefetch,
+                  source_video=args.source_video)
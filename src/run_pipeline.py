@@ -1,9 +1,15 @@
 import os
-import sys
+import json
 import argparse
 from pathlib import Path
 
-def run_pipeline(video_path, output_dir="output", jumble_frames=True, fps=None):
+def run_pipeline(video_path, output_dir="output", jumble_frames=True, fps=None, batch_size=None,
+                 num_workers=None, streaming=False, frame_store=False,
+                 solver="greedy_fast", similarity="dense", knn_k=32,
+                 similarity_dtype="float32", local_search=0.0, starts=8,
+                 feature_cache=True, feature_cache_mb=1024, incremental=False, profile=None,
+                 feature_backend="resnet18", feature_weights=None, inference=None, threads=None,
+                 shards=0, workspace=None, embedding_server=None, cluster_size=512):
     """
     Run the complete video reconstruction pipeline.
     
@@ -12,42 +18,140 @@ def run_pipeline(video_path, output_dir="output", jumble_frames=True, fps=None):
         output_dir (str): Directory to save the output video.
         jumble_frames (bool): Whether to jumble frames before processing.
         fps (float): Frames per second for the output video. If None, uses original video FPS.
+        batch_size (int): Frames per feature-extraction forward pass. If None, picked from available memory.
+        num_workers (int): Threads decoding and preprocessing frames ahead of the model.
+        streaming (bool): Decode the video once in memory instead of writing frame JPEGs.
+        frame_store (bool): Keep frames in one memory-mapped file instead of per-frame JPEGs.
+        solver (str): Frame ordering engine, a key of tsp_solver.SOLVERS.
+        similarity (str): 'dense' NxN matrix, 'knn' sparse top-k neighbour graph or
+            'clustered' scene clusters ordered hierarchically (for very long videos).
+        knn_k (int): Neighbours kept per frame when similarity is 'knn'.
+        similarity_dtype (str): Storage dtype of the dense matrix, 'float32' or 'float16'.
+        local_search (float): Seconds of 2-opt/Or-opt improvement after the greedy order.
+        starts (int): Start frames tried by the 'multistart' solver.
+        feature_cache (bool): Reuse embeddings of previously seen frames from data/cache.
+        feature_cache_mb (int): Size cap of the feature cache in MB (LRU eviction).
+        incremental (bool): Skip stages whose inputs and parameters are unchanged since
+            the last run, according to the manifests in data/manifests.
+        profile (str): Also capture a 'cprofile' or 'torch' profile of every stage
+            into <output_dir>/profiles.
+        feature_backend (str): Feature extractor, a key of feature_backends.BACKENDS.
+        feature_weights (str): Local weights file for CNN feature backends.
+        inference (str): Optimised CPU inference for CNN backends: 'int8', 'torchscript'
+            or 'onnx'. None runs the float32 model.
+        threads (int): Intra-op threads for CNN inference.
+        shards (int): Split feature extraction over this many worker processes, each
+            pinned to its own slice of cores. 0 or 1 runs in this process.
+        workspace (Workspace): Where the job's intermediate files and outputs go
+            (see workspace.py). Its output directory takes the place of output_dir.
+            Defaults to the repository's data/ directory and output_dir.
+        embedding_server (str or bool): Socket of a local embedding server to embed frames
+            with (see embedding_server.py). None uses one at the default socket if it
+            serves the same model; False never does.
+        cluster_size (int): Target frames per scene cluster when similarity is 'clustered'.
+
+    Per-stage wall time, CPU time, peak RSS, bytes read/written and frames/sec
+    are written to <output_dir>/reconstructed_video.report.json.
+
+    Returns:
+        Path: The reconstructed video
     """
+    from workspace import Workspace
+
+    if workspace is None:
+        # Make output_dir absolute if it's relative
+        base_dir = Path(__file__).parent.parent  # Go up to project root (not src/)
+        output_dir = Path(output_dir)
+        if not output_dir.is_absolute():
+            output_dir = base_dir / output_dir
+        workspace = Workspace(output_dir=output_dir)
+
     # Ensure all required directories exist
-    base_dir = Path(__file__).parent.parent  # Go up to project root (not src/)
-    data_dir = base_dir / "data"
-    frames_dir = data_dir / "frames"
-    frames_jumbled_dir = data_dir / "frames_jumbled"
-    features_dir = data_dir / "features"
-    
-    # Make output_dir absolute if it's relative
-    output_dir = Path(output_dir)
-    if not output_dir.is_absolute():
-        output_dir = base_dir / output_dir
+    output_dir = Path(workspace.output_dir)
+    data_dir = Path(workspace.data_dir)
+    frames_dir = Path(workspace.frames_dir)
+    frames_jumbled_dir = Path(workspace.frames_jumbled_dir)
+    features_dir = Path(workspace.features_dir)
+    if frame_store:
+        frames_dir = data_dir / "frames.json"
+        frames_jumbled_dir = data_dir / "frames_jumbled.json"
     
-    for dir_path in [frames_dir, frames_jumbled_dir, features_dir, output_dir]:
+    if streaming or frame_store:
+        # Streaming mode never materialises frames on disk; a frame store is a single file
+        work_dirs = [features_dir, output_dir]
+    else:
+        work_dirs = [frames_dir, frames_jumbled_dir, features_dir, output_dir]
+    for dir_path in work_dirs:
         os.makedirs(dir_path, exist_ok=True)
     
     print("🚀 Starting video reconstruction pipeline...")
+
+    from instrumentation import PipelineProfiler
+    profiler = PipelineProfiler(profile=profile, profile_dir=str(output_dir / "profiles"))
     
     try:
-        # Clear old intermediate files only
-        import shutil
-        print("\n🧹 Cleaning old processing files...")
-        old_files = [
-            data_dir / "frame_features.npy",
-            data_dir / "similarity_matrix.npy",
-            data_dir / "frame_order_final.npy"
-        ]
-        for old_file in old_files:
-            if old_file.exists():
-                old_file.unlink()
-                print(f"   Deleted: {old_file.name}")
+        # Clear old intermediate files only (incremental runs keep them for reuse).
+        # An interrupted feature extraction's partial array and checkpoint are
+        # kept: they are only resumed for the same frames (by content) and backend.
+        if not incremental:
+            print("\n🧹 Cleaning old processing files...")
+            old_files = [
+                data_dir / "frame_features.npy",
+                data_dir / "similarity_matrix.npy",
+                data_dir / "similarity_knn.npz",
+                data_dir / "scene_clusters.npz",
+                data_dir / "frame_order_final.npy",
+                data_dir / "frame_permutation.npy"
+            ]
+            for old_file in old_files:
+                if old_file.exists():
+                    old_file.unlink()
+                    print(f"   Deleted: {old_file.name}")
+
+        if streaming:
+            return run_streaming(video_path, workspace, jumble_frames, fps, batch_size,
+                                 solver, similarity, knn_k, similarity_dtype, local_search, starts,
+                                 profiler, feature_backend, feature_weights, inference, threads,
+                                 embedding_server, cluster_size)
+
+        from manifest import (file_digest, stage_key, output_key, is_up_to_date,
+                              invalidate, write_manifest)
+        manifests_dir = Path(workspace.manifests_dir)
+        metadata_path = Path(workspace.metadata_path)
+        n_frames = None
+
+        def run_stage(stage, params, inputs, outputs, run):
+            """Run one stage unless --incremental and its manifest says it is up to date."""
+            nonlocal n_frames
+            key = stage_key(stage, params, inputs)
+            with profiler.stage(stage, frames=n_frames) as record:
+                if incremental and is_up_to_date(manifests_dir, stage, key, outputs):
+                    record['status'] = 'skipped'
+                    print("   ⏭️ Skipped: inputs and parameters unchanged since the last run")
+                else:
+                    invalidate(manifests_dir, stage)
+                    run()
+                    write_manifest(manifests_dir, stage, key, params, inputs, outputs)
+                if n_frames is None:
+                    with open(metadata_path, 'r') as f:
+                        n_frames = record['frames'] = json.load(f)['total_frames']
+            return output_key(key, outputs)
         
         # Step 1: Extract frames (it will clear frames directory)
         print("\n1️⃣ Extracting frames...")
         from extract_frames import extract_frames
-        original_fps, video_width, video_height = extract_frames(str(video_path), str(frames_dir))
+        # Hashing the whole video only pays off when stages may be skipped; the
+        # manifests of a full run never match an incremental run's key, so the
+        # next incremental run still re-checks everything.
+        video_key = (file_digest(str(video_path)) if incremental
+                     else f"unhashed:{os.path.abspath(str(video_path))}")
+        frames_key = run_stage(
+            "extract_frames", {'frame_store': frame_store}, [video_key],
+            [frames_dir, metadata_path],
+            lambda: extract_frames(str(video_path), str(frames_dir), workspace=workspace))
+
+        with open(metadata_path, 'r') as f:
+            original_fps = json.load(f)['fps']
         
         # Use original FPS if user didn't specify a custom one
         if fps is None:
@@ -56,56 +160,230 @@ def run_pipeline(video_path, output_dir="output", jumble_frames=True, fps=None):
         else:
             print(f"   Using custom FPS: {fps} (original was {original_fps:.2f})")
         
+        permutation_path = Path(workspace.permutation_path)
         if jumble_frames:
             # Step 2: Jumble frames
             print("\n2️⃣ Jumbling frames...")
             from jumble_frames import jumble_frames
-            jumble_frames()
             frames_to_process = frames_jumbled_dir
+            frames_key = run_stage(
+                "jumble_frames", {}, [frames_key], [frames_jumbled_dir, permutation_path],
+                lambda: jumble_frames(str(frames_dir), str(frames_jumbled_dir), workspace=workspace))
         else:
             frames_to_process = frames_dir
+            # Frames stay in order, so a permutation from an earlier run would be stale
+            if permutation_path.exists():
+                permutation_path.unlink()
         
         # Step 3: Extract features
         print("\n3️⃣ Extracting features...")
         from feature_extraction import extract_features
-        features_path = features_dir / "frame_features.npy"
-        extract_features(str(frames_to_process), str(features_path))
+        from feature_backends import get_backend
+        from feature_index import ids_path_for
+        backend = get_backend(feature_backend, weights=feature_weights, optimize=inference,
+                              threads=threads)
+        features_path = Path(workspace.features_path)
+        cache_path = workspace.feature_cache_path if feature_cache else None
+        if shards > 1:
+            from sharded_features import run_sharded
+            extract = lambda: run_sharded(
+                str(frames_to_process), str(features_path), shards, batch_size=batch_size,
+                num_workers=num_workers, cache_path=cache_path,
+                cache_max_bytes=feature_cache_mb * 1024 * 1024, backend=feature_backend,
+                weights=feature_weights, optimize=inference, threads=threads,
+                embedding_server=embedding_server)
+        else:
+            extract = lambda: extract_features(
+                str(frames_to_process), str(features_path), batch_size=batch_size,
+                num_workers=num_workers, cache_path=cache_path,
+                cache_max_bytes=feature_cache_mb * 1024 * 1024, backend=backend,
+                embedding_server=embedding_server)
+        features_key = run_stage(
+            "extract_features", {'model': backend.model_id}, [frames_key],
+            [features_path, ids_path_for(features_path)], extract)
         
         # Step 4: Build similarity matrix
         print("\n4️⃣ Building similarity matrix...")
         from build_similarity import build_similarity
-        build_similarity()
+        if similarity == 'knn':
+            similarity_params = {'mode': similarity, 'k': knn_k}
+            similarity_path = Path(workspace.knn_path)
+        elif similarity == 'clustered':
+            similarity_params = {'mode': similarity, 'cluster_size': cluster_size}
+            similarity_path = Path(workspace.clusters_path)
+        else:
+            similarity_params = {'mode': similarity, 'dtype': similarity_dtype}
+            similarity_path = Path(workspace.similarity_path)
+        similarity_key = run_stage(
+            "build_similarity", similarity_params, [features_key],
+            [similarity_path, ids_path_for(similarity_path)],
+            lambda: build_similarity(mode=similarity, k=knn_k, dtype=similarity_dtype,
+                                     cluster_size=cluster_size, workspace=workspace))
         
         # Step 5: Solve TSP
         print("\n5️⃣ Solving optimal frame order...")
         from tsp_solver import solve_tsp
-        solve_tsp()
+        solver_options = {'starts': starts} if solver == 'multistart' else None
+        order_path = Path(workspace.order_path)
+        order_key = run_stage(
+            "solve_tsp",
+            {'solver': solver, 'mode': similarity, 'local_search': local_search, 'options': solver_options},
+            [similarity_key], [order_path, ids_path_for(order_path)],
+            lambda: solve_tsp(solver=solver, mode=similarity, local_search=local_search,
+                              solver_options=solver_options, workspace=workspace))
         
         # Step 6: Rebuild video
         print("\n6️⃣ Reconstructing video...")
         from rebuild_video import rebuild_video
-        rebuild_video(fps=fps)
+        output_path = Path(workspace.output_video)
+        run_stage(
+            "rebuild_video", {'fps': fps, 'output': str(output_path)}, [order_key, frames_key],
+            [output_path],
+            lambda: rebuild_video(fps=fps, frames_dir=str(frames_to_process),
+                                  output_path=str(output_path), workspace=workspace))
         
         print(f"\n✅ Pipeline completed successfully!")
-        print(f"   Output video saved to: {output_dir / 'reconstructed_video.mp4'}")
+        print(f"   Output video saved to: {output_path}")
         print(f"   Video FPS: {fps:.2f}")
+        return output_path
         
     except Exception as e:
         print(f"\n❌ Error in pipeline: {str(e)}")
         raise
+    finally:
+        if profiler.stages:
+            profiler.write_report(workspace.report_path)
+
+def run_streaming(video_path, workspace, jumble_frames, fps, batch_size,
+                  solver, similarity, knn_k, similarity_dtype, local_search, starts,
+                  profiler, feature_backend=None, feature_weights=None, inference=None,
+                  threads=None, embedding_server=None, cluster_size=512):
+    """
+    Streaming variant of the pipeline: the video is decoded once, frames are
+    downscaled straight to the model input, and the output is written by
+    reading frames back from the source video in the solved order.
+    """
+    import numpy as np
+    from extract_frames import probe_video, save_video_metadata
+
+    original_fps, width, height, total_frames = probe_video(str(video_path))
+    print(f"📹 Video Info: {total_frames} frames, {original_fps:.2f} FPS, {width}x{height}")
+
+    if fps is None:
+        fps = original_fps
+        print(f"   Using original video FPS: {fps:.2f}")
+    else:
+        print(f"   Using custom FPS: {fps} (original was {original_fps:.2f})")
+
+    # Step 1+2+3: Decode once, jumble in memory and extract features
+    print("\n1️⃣ Streaming frames into the feature extractor...")
+    from feature_extraction import extract_features_from_video
+    features_path = Path(workspace.features_path)
+    permutation_path = Path(workspace.permutation_path)
+    if permutation_path.exists():
+        permutation_path.unlink()
+    with profiler.stage("extract_features") as record:
+        n_frames, permutation = extract_features_from_video(
+            str(video_path), str(features_path), jumble=jumble_frames,
+            permutation_path=str(permutation_path), batch_size=batch_size,
+            backend=feature_backend, weights=feature_weights, optimize=inference, threads=threads,
+            embedding_server=embedding_server)
+        record['frames'] = n_frames
+    save_video_metadata(workspace.metadata_path, original_fps, width, height, n_frames)
+
+    # Step 4: Build similarity matrix
+    print("\n2️⃣ Building similarity matrix...")
+    from build_similarity import build_similarity
+    with profiler.stage("build_similarity", frames=n_frames):
+        build_similarity(mode=similarity, k=knn_k, dtype=similarity_dtype, cluster_size=cluster_size,
+                         workspace=workspace)
+
+    # Step 5: Solve TSP
+    print("\n3️⃣ Solving optimal frame order...")
+    from tsp_solver import solve_tsp
+    with profiler.stage("solve_tsp", frames=n_frames):
+        solve_tsp(solver=solver, mode=similarity, local_search=local_search,
+                  solver_options={'starts': starts} if solver == 'multistart' else None,
+                  workspace=workspace)
+
+    # Step 6: Rebuild video by reading the source frames in solved order
+    print("\n4️⃣ Reconstructing video...")
+    from rebuild_video import rebuild_video_from_source
+    order = np.load(workspace.order_path)
+    source_order = permutation[order] if permutation is not None else order
+    output_path = Path(workspace.output_video)
+    with profiler.stage("rebuild_video", frames=n_frames):
+        rebuild_video_from_source(str(video_path), source_order, str(output_path), fps)
+
+    print(f"\n✅ Pipeline completed successfully!")
+    print(f"   Output video saved to: {output_path}")
+    print(f"   Video FPS: {fps:.2f}")
+    return output_path
 
 if __name__ == "__main__":
+    from feature_backends import BACKENDS, DEFAULT_BACKEND
+    from tsp_solver import SOLVERS
+
     parser = argparse.ArgumentParser(description="Run the complete video reconstruction pipeline.")
     parser.add_argument("--video", type=str, required=True, help="Path to the input video file")
-    parser.add_argument("--output_dir", type=str, default="output", help="Directory to save the output video")
+    parser.add_argument("--output_dir", type=str, default=None, help="Directory to save the output video (default: output, or <workspace>/output with --workspace)")
+    parser.add_argument("--workspace", type=str, default=None, help="Directory for this run's intermediate files, so several runs can go at once (default: the repository's data/)")
     parser.add_argument("--no_jumble", action="store_true", help="Skip frame jumbling")
     parser.add_argument("--fps", type=float, default=None, help="Frames per second for the output video (default: use original video FPS)")
+    parser.add_argument("--batch_size", type=int, default=None, help="Frames per feature-extraction forward pass (default: pick from available memory)")
+    parser.add_argument("--streaming", action="store_true", help="Decode the video once in memory without writing frame images to disk")
+    parser.add_argument("--frame_store", action="store_true", help="Store frames in one memory-mapped file instead of per-frame JPEGs")
+    parser.add_argument("--solver", choices=sorted(SOLVERS), default="greedy_fast", help="Frame ordering engine (default: greedy_fast)")
+    parser.add_argument("--similarity", choices=["dense", "knn", "clustered"], default="dense", help="Dense NxN similarity matrix, sparse top-k neighbour graph or hierarchical scene clusters (default: dense)")
+    parser.add_argument("--knn_k", type=int, default=32, help="Neighbours kept per frame with --similarity knn (default: 32)")
+    parser.add_argument("--cluster_size", type=int, default=512, help="Target frames per scene cluster with --similarity clustered (default: 512)")
+    parser.add_argument("--similarity_dtype", choices=["float32", "float16"], default="float32", help="Storage dtype of the dense similarity matrix (default: float32)")
+    parser.add_argument("--local_search", type=float, default=0.0, help="Seconds of 2-opt/Or-opt improvement after the greedy order (default: off)")
+    parser.add_argument("--starts", type=int, default=8, help="Start frames tried by the multistart solver (default: 8)")
+    parser.add_argument("--no_feature_cache", action="store_true", help="Recompute every embedding instead of reusing cached ones")
+    parser.add_argument("--feature_cache_mb", type=int, default=1024, help="Size cap of the feature cache in MB (default: 1024)")
+    parser.add_argument("--incremental", action="store_true", help="Skip stages whose inputs and parameters are unchanged since the last run")
+    parser.add_argument("--feature_backend", choices=list(BACKENDS), default=DEFAULT_BACKEND, help="Feature extractor (default: resnet18)")
+    parser.add_argument("--feature_weights", type=str, default=None, help="Local weights file for CNN feature backends instead of downloading them")
+    parser.add_argument("--inference", choices=["int8", "torchscript", "onnx"], default=None, help="Optimised CPU inference for CNN feature backends (default: float32)")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for CNN feature inference (default: torch default)")
+    parser.add_argument("--shards", type=int, default=0, help="Feature extraction worker processes, each pinned to a slice of cores (default: off)")
+    parser.add_argument("--no_embedding_server", action="store_true", help="Embed frames in this process even if a local embedding server is running")
+    parser.add_argument("--workers", type=int, default=None, help="Frame decode/preprocess workers for feature extraction (default: CPU count, max 8)")
+    parser.add_argument("--profile", choices=["cprofile", "torch"], default=None, help="Capture a per-stage cProfile or torch.profiler trace into <output_dir>/profiles")
     
     args = parser.parse_args()
+
+    workspace = None
+    if args.workspace is not None:
+        from workspace import Workspace
+        workspace = Workspace(args.workspace, output_dir=args.output_dir)
     
     run_pipeline(
         video_path=args.video,
-        output_dir=args.output_dir,
+        output_dir=args.output_dir or "output",
         jumble_frames=not args.no_jumble,
-        fps=args.fps
+        fps=args.fps,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        streaming=args.streaming,
+        frame_store=args.frame_store,
+        solver=args.solver,
+        similarity=args.similarity,
+        knn_k=args.knn_k,
+        similarity_dtype=args.similarity_dtype,
+        local_search=args.local_search,
+        starts=args.starts,
+        feature_cache=not args.no_feature_cache,
+        feature_cache_mb=args.feature_cache_mb,
+        incremental=args.incremental,
+        profile=args.profile,
+        feature_backend=args.feature_backend,
+        feature_weights=args.feature_weights,
+        inference=args.inference,
+        threads=args.threads,
+        shards=args.shards,
+        workspace=workspace,
+        embedding_server=False if args.no_embedding_server else None,
+        cluster_size=args.cluster_size
     )
\ No newline at end of file
@@ -0,0 +1,196 @@
+import os
+import numpy as np
+from feature_index import load_frame_ids, source_frame_indices
+from workspace import Workspace
+
+# Reconstruction quality of a solved frame order against the ground truth saved
+# by jumble_frames (data/frame_permutation.npy, jumbled frame i = original
+# frame permutation[i]).
+#
+# A similarity-based solver cannot tell forwards from backwards, so every
+# metric is computed for the better of the two playback directions.
+#
+# Frames that failed to decode are missing from the solved order. Saved orders
+# are mapped to source frames through their frame IDs and scored over the
+# frames that were kept.
+
+
+def recover_original_indices(order, permutation):
+    """Original frame index at each position of a solved order."""
+    return np.asarray(permutation, dtype=np.int64)[np.asarray(order, dtype=np.int64)]
+
+
+def count_inversions(values):
+    """Number of pairs i < j with values[i] > values[j] (merge sort, O(n log n))."""
+    values = list(values)
+    inversions = 0
+    width = 1
+    n = len(values)
+    while width < n:
+        merged = []
+        for lo in range(0, n, 2 * width):
+            left = values[lo:lo + width]
+            right = values[lo + width:lo + 2 * width]
+            i = j = 0
+            while i < len(left) and j < len(right):
+                if left[i] <= right[j]:
+                    merged.append(left[i])
+                    i += 1
+                else:
+                    merged.append(right[j])
+                    inversions += len(left) - i
+                    j += 1
+            merged.extend(left[i:])
+            merged.extend(right[j:])
+        values = merged
+        width *= 2
+    return inversions
+
+
+def kendall_tau(recovered):
+    """
+    Kendall rank correlation between a recovered order and 0..n-1.
+
+    1.0 is the original order, -1.0 the exact reverse, around 0 unrelated.
+    """
+    n = len(recovered)
+    if n < 2:
+        return 1.0
+    pairs = n * (n - 1) / 2
+    return 1.0 - 2.0 * count_inversions(recovered) / pairs
+
+
+def adjacency_accuracy(recovered):
+    """Share of consecutive pairs that were also neighbours in the original video."""
+    if len(recovered) < 2:
+        return 1.0
+    return float(np.mean(np.abs(np.diff(recovered)) == 1))
+
+
+def longest_correct_run(recovered):
+    """
+    Length in frames of the longest stretch played in original order, in either
+    direction (e.g. 7, 8, 9, 10 or 10, 9, 8, 7).
+    """
+    if len(recovered) == 0:
+        return 0
+    steps = np.diff(recovered)
+    best = run = 1
+    direction = 0
+    for step in steps:
+        if step in (1, -1) and (run == 1 or step == direction):
+            run += 1
+        elif step in (1, -1):
+            run = 2
+        else:
+            run = 1
+        direction = step
+        best = max(best, run)
+    return int(best)
+
+
+def score_order(order, permutation):
+    """
+    Score a solved order against the ground-truth permutation.
+
+    Args:
+        order: Solved order (indices into the jumbled frames)
+        permutation: Ground truth, jumbled frame i is original frame permutation[i]
+
+    Returns:
+        dict: kendall_tau, adjacency_accuracy, longest_correct_run (frames and
+              fraction of the video) and whether the order plays reversed
+    """
+    if len(order) != len(permutation):
+        raise ValueError(f"Order has {len(order)} frames but the permutation has {len(permutation)}")
+
+    return score_recovered(recover_original_indices(order, permutation))
+
+
+def score_recovered(recovered):
+    """
+    Score the original frame index at each position of a solved order.
+
+    Indices may skip frames that were dropped; they are ranked first, so a
+    kept frame's neighbours are the nearest kept frames around it.
+
+    Returns:
+        dict: as score_order
+    """
+    recovered = np.argsort(np.argsort(np.asarray(recovered, dtype=np.int64), kind='stable'))
+    tau = kendall_tau(recovered)
+    reversed_order = tau < 0
+    run = longest_correct_run(recovered)
+    return {
+        'kendall_tau': round(abs(tau), 4),
+        'adjacency_accuracy': round(adjacency_accuracy(recovered), 4),
+        'longest_correct_run': run,
+        'longest_correct_run_fraction': round(run / max(len(recovered), 1), 4),
+        'reversed': bool(reversed_order)
+    }
+
+
+def print_scores(scores):
+    print("\n🎯 Reconstruction Quality (vs. ground truth):")
+    print(f"  - Kendall tau: {scores['kendall_tau']:.4f}{' (plays reversed)' if scores['reversed'] else ''}")
+    print(f"  - Adjacency accuracy: {scores['adjacency_accuracy']:.2%}")
+    print(f"  - Longest correct run: {scores['longest_correct_run']} frames"
+          f" ({scores['longest_correct_run_fraction']:.1%})")
+
+
+def score_saved_order(order_path=None, permutation_path=None, verbose=True):
+    """
+    Score a saved frame_order_final.npy against a saved permutation.
+
+    The order is mapped to source frames through its frame IDs, so it can be
+    scored even when frames were dropped.
+
+    Returns:
+        dict or None: the scores, or None if there is no matching ground truth
+    """
+    if order_path is None:
+        order_path = Workspace().order_path
+    if permutation_path is None:
+        permutation_path = Workspace().permutation_path
+
+    if not os.path.exists(permutation_path):
+        if verbose:
+            print(f"⚠️ No ground-truth permutation at {permutation_path}; skipping quality metrics")
+        return None
+
+    order = np.load(order_path)
+    permutation = np.load(permutation_path)
+    order_ids = load_frame_ids(order_path, expected=len(order))
+    if order_ids is None and len(order) != len(permutation):
+        if verbose:
+            print(f"⚠️ Ground truth has {len(permutation)} frames but the order has {len(order)}"
+                  " and no frame IDs to match them up; skipping quality metrics")
+        return None
+
+    try:
+        recovered = source_frame_indices(order, order_ids, permutation)
+    except (IndexError, ValueError):
+        recovered = None
+    if recovered is None or len(recovered) == 0 or recovered.max() >= len(permutation):
+        if verbose:
+            print(f"⚠️ The order's frames do not match the {len(permutation)}-frame ground truth"
+                  f" at {permutation_path}; skipping quality metrics")
+        return None
+
+    scores = score_recovered(recovered)
+    if verbose:
+        if len(recovered) < len(permutation):
+            print(f"\nℹ️ Scoring the {len(recovered)} of {len(permutation)} frames that were kept")
+        print_scores(scores)
+    return scores
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Score a solved frame order against the ground-truth shuffle.")
+    parser.add_argument("--order", type=str, default=None, help="Frame order file (default: data/frame_order_final.npy)")
+    parser.add_argument("--permutation", type=str, default=None, help="Ground-truth permutation (default: data/frame_permutation.npy)")
+    args = parser.parse_args()
+
+    score_saved_order(args.order, args.permutation)
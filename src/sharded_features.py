@@ -0,0 +1,245 @@
+import os
+import json
+import numpy as np
+from feature_index import load_features, save_features
+
+# Sharded feature extraction.
+#
+# The frame list is split into `num_shards` contiguous shards. Each shard is
+# embedded by its own process, which writes a partial feature array plus a small
+# JSON sidecar to a shard directory:
+#
+#   shard-00002-of-00008.npy    features of the shard's frames, in frame order
+#                               (with a .ids.json of frame IDs, see feature_index.py)
+#   shard-00002-of-00008.json   range, frame count, failures and backend model_id
+#
+# merge_shards() then concatenates the partials in shard order, which is the
+# original frame order. run_sharded() runs every shard on this machine, each
+# process pinned to its own slice of cores. For several hosts sharing a
+# filesystem, start `python src/sharded_features.py --shard i/N` on each host
+# and run `--merge N` once all of them are done.
+
+
+def shard_range(total, shard, num_shards):
+    """Contiguous [start, stop) frame range of one shard (sizes differ by at most one)."""
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Shard {shard} is out of range for {num_shards} shards")
+    return shard * total // num_shards, (shard + 1) * total // num_shards
+
+
+def parse_shard_spec(spec):
+    """Parse 'i/N' (0-based shard i of N) into (i, N)."""
+    try:
+        shard, num_shards = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard spec '{spec}', expected i/N (e.g. 0/4)")
+    shard_range(0, shard, num_shards)
+    return shard, num_shards
+
+
+def shard_paths(shard_dir, shard, num_shards):
+    """Partial feature file and sidecar of one shard."""
+    stem = os.path.join(str(shard_dir), f"shard-{shard:05d}-of-{num_shards:05d}")
+    return stem + '.npy', stem + '.json'
+
+
+def split_cores(num_shards):
+    """
+    Split the cores this process may use into one contiguous slice per shard.
+
+    With more shards than cores, shards share cores round-robin.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    if num_shards > len(cores):
+        return [[cores[i % len(cores)]] for i in range(num_shards)]
+    slices = []
+    for i in range(num_shards):
+        start, stop = shard_range(len(cores), i, num_shards)
+        slices.append(cores[start:stop])
+    return slices
+
+
+def extract_shard(frames_dir, shard_dir, shard, num_shards, cores=None, threads=None, **options):
+    """
+    Embed one shard of the frames and write its partial features and sidecar.
+
+    Args:
+        frames_dir: Directory containing the frame images, or a frame store header
+        shard_dir: Directory for the partial outputs (shared between hosts)
+        shard: 0-based shard index
+        num_shards: Total number of shards
+        cores: CPU cores to pin this process to (Linux only). None leaves affinity alone.
+        threads: Intra-op threads for CNN inference. Defaults to the number of cores.
+        **options: Passed through to feature_extraction.extract_features
+                   (backend, weights, optimize, batch_size, cache_path, ...)
+
+    Returns:
+        dict: The shard's sidecar
+    """
+    from frame_store import open_frame_source
+    from feature_extraction import extract_features
+    from feature_backends import get_backend
+
+    if cores is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    if threads is None and cores is not None:
+        threads = len(cores)
+
+    total = len(open_frame_source(str(frames_dir)))
+    start, stop = shard_range(total, shard, num_shards)
+    print(f"Shard {shard}/{num_shards}: frames {start}-{stop - 1} of {total}"
+          + (f", cores {cores[0]}-{cores[-1]}" if cores else ""))
+
+    backend = options.pop('backend', None)
+    if backend is None or isinstance(backend, str):
+        backend = get_backend(backend, weights=options.pop('weights', None),
+                              optimize=options.pop('optimize', None), threads=threads)
+    if options.get('num_workers') is None and cores is not None:
+        options['num_workers'] = len(cores)
+
+    os.makedirs(str(shard_dir), exist_ok=True)
+    features_path, sidecar_path = shard_paths(shard_dir, shard, num_shards)
+    if stop > start:
+        failed_frames = extract_features(str(frames_dir), features_path, backend=backend,
+                                         indices=range(start, stop), **options)
+    else:
+        # More shards than frames: nothing to embed, but the shard still completes
+        np.save(features_path, np.empty((0, 0), dtype=np.float32))
+        failed_frames = []
+
+    # Every shard calibrates optimised models on the same sample of the whole
+    # frame set (see extract_features), so int8 shards share one calibration;
+    # its fingerprint is recorded so merge_shards can verify that
+    sidecar = {'shard': shard, 'num_shards': num_shards, 'start': start, 'stop': stop,
+               'total_frames': total, 'frames': stop - start - len(failed_frames),
+               'failed_frames': failed_frames, 'model_id': backend.model_id,
+               'calibration_id': backend.calibration_id}
+    # Written last: its presence marks the shard as complete
+    with open(sidecar_path, 'w') as f:
+        json.dump(sidecar, f, indent=2)
+    return sidecar
+
+
+def merge_shards(shard_dir, num_shards, output_path):
+    """
+    Concatenate the partial feature arrays of all shards in frame order.
+
+    Raises:
+        RuntimeError: if a shard is missing or the shards disagree on the input,
+                      the backend or (for int8) the calibration
+    """
+    parts = []
+    ids = []
+    sidecars = []
+    for shard in range(num_shards):
+        features_path, sidecar_path = shard_paths(shard_dir, shard, num_shards)
+        if not os.path.exists(sidecar_path):
+            raise RuntimeError(f"Shard {shard}/{num_shards} is not finished: {sidecar_path} not found")
+        with open(sidecar_path, 'r') as f:
+            sidecar = json.load(f)
+        part, part_ids = load_features(features_path)
+        if len(part) != sidecar['frames']:
+            raise RuntimeError(f"Shard {shard} has {len(part)} feature rows, "
+                               f"its sidecar says {sidecar['frames']}")
+        if len(part):
+            parts.append(part)
+            ids.extend(part_ids)
+        sidecars.append(sidecar)
+
+    for field in ('total_frames', 'model_id', 'calibration_id'):
+        # Shards without frames never load (or calibrate) the model
+        values = {sidecar.get(field) for sidecar in sidecars
+                  if field != 'calibration_id' or sidecar['frames'] > 0}
+        if len(values) > 1:
+            raise RuntimeError(f"Shards disagree on {field}: {sorted(map(str, values))}")
+
+    failed = [name for sidecar in sidecars for name in sidecar['failed_frames']]
+    if failed:
+        print(f"⚠️ {len(failed)} frames failed across shards")
+
+    features = np.concatenate(parts)
+    save_features(features, ids, output_path)
+    print(f"✅ Merged {num_shards} shards into {len(features)} feature vectors at {output_path}")
+    return features
+
+
+def run_sharded(frames_dir, output_path, num_shards, shard_dir=None, **options):
+    """
+    Extract features with `num_shards` local worker processes and merge the result.
+
+    Each worker is pinned to its own slice of cores with a matching torch thread
+    count. Shard outputs go to `shard_dir` (default: a 'shards' directory next to
+    output_path) and are removed after a successful merge.
+
+    Args:
+        frames_dir: Directory containing the frame images, or a frame store header
+        output_path: Where to save the merged (N, D) feature array
+        num_shards: Number of worker processes
+        shard_dir: Directory for the partial outputs
+        **options: Passed through to extract_shard / extract_features
+    """
+    import shutil
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if shard_dir is None:
+        shard_dir = os.path.join(os.path.dirname(os.path.abspath(str(output_path))), 'shards')
+    # Drop completion markers from earlier runs, but keep the shards' feature
+    # checkpoints so an interrupted run resumes where each shard stopped
+    for shard in range(num_shards):
+        sidecar_path = shard_paths(shard_dir, shard, num_shards)[1]
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+
+    core_slices = split_cores(num_shards)
+    print(f"Running {num_shards} feature extraction shards on {sum(map(len, core_slices))} core slots")
+
+    jobs = [dict(options, frames_dir=str(frames_dir), shard_dir=str(shard_dir), shard=shard,
+                 num_shards=num_shards, cores=core_slices[shard])
+            for shard in range(num_shards)]
+    # spawn, not fork: torch and OpenMP thread pools do not survive a fork
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=num_shards, mp_context=context) as pool:
+        for future in [pool.submit(extract_shard, **job) for job in jobs]:
+            future.result()
+
+    features = merge_shards(shard_dir, num_shards, output_path)
+    shutil.rmtree(str(shard_dir), ignore_errors=True)
+    return features
+
+
+if __name__ == "__main__":
+    import argparse
+    from feature_backends import BACKENDS, DEFAULT_BACKEND
+
+    parser = argparse.ArgumentParser(description="Sharded feature extraction across processes or hosts.")
+    parser.add_argument("--frames", type=str, default=None, help="Frames directory or frame store header (default: data/frames_jumbled)")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Shared directory for partial outputs (default: data/features/shards)")
+    parser.add_argument("--output", type=str, default=None, help="Merged feature file (default: data/features/frame_features.npy)")
+    parser.add_argument("--shard", type=str, default=None, help="Run a single shard i/N (0-based), e.g. on one host")
+    parser.add_argument("--merge", type=int, default=None, help="Merge N finished shards into the output file")
+    parser.add_argument("--shards", type=int, default=None, help="Run N shards as local processes, then merge")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads per shard (default: cores per shard)")
+    parser.add_argument("--feature_backend", choices=list(BACKENDS), default=DEFAULT_BACKEND, help="Feature backend (default: resnet18)")
+    parser.add_argument("--batch_size", type=int, default=None, help="Frames per forward pass (default: pick from available memory)")
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    frames_dir = args.frames or os.path.join(base_dir, 'data', 'frames_jumbled')
+    shard_dir = args.shard_dir or os.path.join(base_dir, 'data', 'features', 'shards')
+    output_path = args.output or os.path.join(base_dir, 'data', 'features', 'frame_features.npy')
+
+    if args.shard is not None:
+        shard, num_shards = parse_shard_spec(args.shard)
+        extract_shard(frames_dir, shard_dir, shard, num_shards, threads=args.threads,
+                      backend=args.feature_backend, batch_size=args.batch_size)
+    elif args.merge is not None:
+        merge_shards(shard_dir, args.merge, output_path)
+    elif args.shards is not None:
+        run_sharded(frames_dir, output_path, args.shards, shard_dir=shard_dir, threads=args.threads,
+                    backend=args.feature_backend, batch_size=args.batch_size)
+    else:
+        parser.error("Give one of --shard i/N, --merge N or --shards N")
@@ -1,5 +1,9 @@
 import numpy as np
 import os
+import time
+from feature_index import load_frame_ids, save_frame_ids
+from progress import report
+from workspace import Workspace
 
 def tsp_reorder(similarity):
     """
@@ -32,40 +36,550 @@ def tsp_reorder(similarity):
 
     return order
 
-def solve_tsp():
-    # Get the base directory (one level up from src)
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
-    # Define file paths
-    sim_path = os.path.join(base_dir, 'data', 'similarity_matrix.npy')
-    order_out = os.path.join(base_dir, 'data', 'frame_order_final.npy')
-    
-    # Check if similarity matrix exists
-    if not os.path.exists(sim_path):
-        print("❌ Similarity matrix not found. Run build_similarity.py first.")
-        return
-
-    print(f"🧩 Loading similarity matrix from: {sim_path}")
-    similarity = np.load(sim_path)
-    print(f"  - Matrix shape: {similarity.shape}")
-    print(f"  - Similarity range: {np.min(similarity):.2f} to {np.max(similarity):.2f}")
-
-    print("\n🚀 Solving frame order using greedy TSP approach...")
-    order = tsp_reorder(similarity)
-    
-    # Calculate statistics
-    forward_similarities = [similarity[order[i], order[i+1]] 
-                          for i in range(len(order)-1)]
-    
+def tsp_reorder_fast(similarity, start=0, verbose=True, report_progress=True):
+    """
+    Greedy nearest-neighbour ordering without per-step allocations.
+
+    Produces exactly the same order as tsp_reorder (ties still go to the lowest
+    frame index). Instead of copying and masking a full row at every step, it
+    keeps a sorted array of the frames not yet visited and gathers only those
+    similarities into one reused buffer, so the work per step shrinks as the
+    path grows and no temporary arrays are created.
+
+    Args:
+        similarity: NxN similarity matrix where higher values indicate more similar frames
+        start: Frame the path starts from
+        verbose: Print progress
+        report_progress: Send progress reports (see progress.py). Off when
+                         the path is one part of a larger solve.
+
+    Returns:
+        list: Ordered list of frame indices
+    """
+    n = similarity.shape[0]
+    if verbose:
+        print(f"🔍 Finding optimal path through {n} frames...")
+
+    remaining = np.delete(np.arange(n), start)  # unvisited frames, kept sorted
+    buf = np.empty(n, dtype=similarity.dtype)
+    m = n - 1
+    order = [int(start)]
+    report_every = max(50, n // 20)
+    progress_every = max(1, n // 500)
+
+    while m > 0:
+        sims = buf[:m]
+        np.take(similarity[order[-1]], remaining[:m], out=sims)
+        j = int(sims.argmax())
+        order.append(int(remaining[j]))
+
+        # Drop the chosen frame while keeping the array sorted (in-place memmove)
+        remaining[j:m - 1] = remaining[j + 1:m]
+        m -= 1
+
+        if verbose and (len(order) % report_every) == 0:
+            print(f"  - Processed {len(order)}/{n} frames...")
+        if report_progress and (len(order) % progress_every) == 0:
+            report('solve_tsp', len(order), n)
+
+    return order
+
+def weakest_match_frames(similarity, count, block_size=1024):
+    """
+    Frames whose best match (excluding themselves) is weakest.
+
+    Such frames have no close neighbour on at least one side and are likely
+    endpoints of the original sequence, which makes them good path starts.
+    """
+    n = similarity.shape[0]
+    best = np.empty(n, dtype=np.float64)
+    for r0 in range(0, n, block_size):
+        block = np.array(similarity[r0:r0 + block_size], dtype=np.float64)
+        rows = np.arange(block.shape[0])
+        block[rows, rows + r0] = -np.inf
+        best[r0:r0 + block.shape[0]] = block.max(axis=1)
+    return np.argsort(best, kind='stable')[:count].tolist()
+
+def path_similarity(similarity, order):
+    """Total similarity between consecutive frames of an order."""
+    order = np.asarray(order)
+    return float(np.sum(similarity[order[:-1], order[1:]], dtype=np.float64))
+
+# Each pool worker opens the similarity matrix once as a read-only memmap,
+# so the matrix is shared through the page cache instead of being pickled.
+_worker_similarity = None
+
+def _init_multistart_worker(sim_path):
+    global _worker_similarity
+    _worker_similarity = np.load(sim_path, mmap_mode='r')
+
+def _greedy_from_start(start):
+    order = tsp_reorder_fast(_worker_similarity, start=start, verbose=False)
+    return path_similarity(_worker_similarity, order), order
+
+def tsp_reorder_multistart(similarity, starts=8, workers=None):
+    """
+    Run the greedy construction from several start frames and keep the best path.
+
+    Starts are frame 0 plus the frames with the weakest best match (likely
+    sequence endpoints). When the matrix is a memmap (as loaded by solve_tsp)
+    the starts run in parallel in a process pool; each worker maps the same
+    file rather than receiving a pickled copy.
+
+    Args:
+        similarity: NxN similarity matrix where higher values indicate more similar frames
+        starts: Number of start frames to try
+        workers: Pool size. If None, one per CPU (at most `starts`).
+
+    Returns:
+        list: Ordered list of frame indices with the highest total path similarity
+    """
+    n = similarity.shape[0]
+    seeds = [0] + [s for s in weakest_match_frames(similarity, starts) if s != 0]
+    seeds = seeds[:max(1, min(starts, n))]
+    print(f"🔍 Greedy search through {n} frames from {len(seeds)} start frames: {seeds}")
+
+    sim_path = getattr(similarity, 'filename', None)
+    if workers is None:
+        workers = min(len(seeds), os.cpu_count() or 1)
+
+    if sim_path is not None and workers > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn, not fork: torch and OpenMP thread pools do not survive a fork
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_multistart_worker,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initargs=(str(sim_path),)) as pool:
+            results = list(pool.map(_greedy_from_start, seeds))
+    else:
+        results = [(path_similarity(similarity, order), order)
+                   for order in (tsp_reorder_fast(similarity, start=s, verbose=False) for s in seeds)]
+
+    for seed, (score, _) in zip(seeds, results):
+        print(f"  - Start {seed}: path similarity {score:.4f}")
+    best = max(range(len(results)), key=lambda i: results[i][0])
+    print(f"  - Best start: {seeds[best]}")
+    return results[best][1]
+
+def tsp_reorder_knn(indices, features):
+    """
+    Greedy nearest-neighbour ordering over a sparse top-k similarity graph.
+
+    Each step takes the first unvisited frame in the current frame's neighbour
+    list. Only when all k neighbours are already visited is the similarity to
+    the remaining frames computed from the features, so the dense NxN matrix
+    is never needed.
+
+    Args:
+        indices: N x k neighbour indices from build_similarity.knn_similarity
+        features: N x D L2-normalised features, used for the fallback scan
+
+    Returns:
+        list: Ordered list of frame indices
+    """
+    n = indices.shape[0]
+    print(f"🔍 Finding optimal path through {n} frames ({indices.shape[1]} neighbours each)...")
+
+    # Plain Python lists/bytearray: per-step work is a handful of scalar lookups,
+    # where numpy call overhead would dominate.
+    neighbour_lists = indices.tolist()
+    visited = bytearray(n)
+    order = [0]  # start from first frame
+    visited[0] = 1
+    fallbacks = 0
+    report_every = max(50, n // 20)
+    progress_every = max(1, n // 500)
+
+    for _ in range(n - 1):
+        last = order[-1]
+        next_idx = -1
+        for candidate in neighbour_lists[last]:
+            if not visited[candidate]:
+                next_idx = candidate
+                break
+
+        if next_idx < 0:
+            # Every listed neighbour is taken: score the remaining frames directly
+            remaining = np.flatnonzero(np.frombuffer(visited, dtype=np.uint8) == 0)
+            sims = features[remaining] @ features[last]
+            next_idx = int(remaining[sims.argmax()])
+            fallbacks += 1
+
+        order.append(next_idx)
+        visited[next_idx] = 1
+
+        if (len(order) % report_every) == 0:
+            print(f"  - Processed {len(order)}/{n} frames...")
+        if (len(order) % progress_every) == 0:
+            report('solve_tsp', len(order), n)
+
+    print(f"  - Fallback scans: {fallbacks}/{max(n - 1, 0)} steps")
+    return order
+
+# Hierarchical ordering for long videos. Frames are grouped into scene
+# clusters (build_similarity.cluster_features), each cluster is ordered on its
+# own dense similarity matrix, and the resulting segments are chained by the
+# similarity of their boundary frames. No cluster is compared with another
+# frame by frame, so the cost grows with N * cluster size instead of N^2.
+_worker_features = None
+
+def _init_cluster_worker(features_path):
+    global _worker_features
+    _worker_features = np.load(features_path, mmap_mode='r')
+
+def order_cluster(features, members):
+    """
+    Greedy path through the frames of one cluster.
+
+    The path starts from the frame whose best match in the cluster is
+    weakest, the likeliest end of the segment.
+
+    Args:
+        features: NxD features of the whole video
+        members: Frame indices of the cluster
+
+    Returns:
+        np.ndarray: The members in path order
+    """
+    from build_similarity import normalize_features
+
+    members = np.asarray(members)
+    sub = normalize_features(features[members])
+    similarity = sub @ sub.T
+    start = weakest_match_frames(similarity, 1)[0]
+    return members[tsp_reorder_fast(similarity, start=start, verbose=False, report_progress=False)]
+
+def _order_cluster_in_worker(members):
+    return order_cluster(_worker_features, members)
+
+def link_segments(segments, features, boundary=3):
+    """
+    Chain path segments into one path by the similarity of their ends.
+
+    Each segment has a head and a tail, described by the mean feature of its
+    first and last `boundary` frames. End pairs are taken from most to least
+    similar, and a pair becomes a link unless one of its ends is already
+    linked or it would close a loop (greedy edge matching). The k - 1 links
+    form one path through all segments, which also fixes the direction each
+    segment is walked in.
+
+    Args:
+        segments: List of frame index arrays, each in path order
+        features: NxD L2-normalised features
+        boundary: Frames averaged at each end of a segment
+
+    Returns:
+        list: (segment index, reversed) pairs in path order
+    """
+    from build_similarity import normalize_features
+
+    k = len(segments)
+    if k == 1:
+        return [(0, False)]
+
+    # End 2i is the head of segment i, end 2i + 1 its tail
+    ends = np.empty((2 * k, features.shape[1]), dtype=np.float32)
+    for i, segment in enumerate(segments):
+        ends[2 * i] = features[segment[:boundary]].mean(axis=0)
+        ends[2 * i + 1] = features[segment[-boundary:]].mean(axis=0)
+    ends = normalize_features(ends)
+
+    rows, cols = np.triu_indices(2 * k, 1)
+    same_segment = (rows // 2) == (cols // 2)
+    rows, cols = rows[~same_segment], cols[~same_segment]
+    sims = (ends @ ends.T)[rows, cols]
+    ranked = np.argsort(-sims, kind='stable')
+
+    link = np.full(2 * k, -1, dtype=np.int64)
+    parent = list(range(k))
+
+    def find(s):
+        while parent[s] != s:
+            parent[s] = parent[parent[s]]
+            s = parent[s]
+        return s
+
+    links = 0
+    for p in ranked:
+        a, b = int(rows[p]), int(cols[p])
+        if link[a] >= 0 or link[b] >= 0:
+            continue
+        root_a, root_b = find(a // 2), find(b // 2)
+        if root_a == root_b:
+            continue
+        parent[root_a] = root_b
+        link[a], link[b] = b, a
+        links += 1
+        if links == k - 1:
+            break
+
+    # Walk from one of the two unlinked ends: enter a segment, leave by its other end
+    chain = []
+    end = int(np.flatnonzero(link < 0)[0])
+    while end >= 0:
+        chain.append((end // 2, end % 2 == 1))
+        end = int(link[end ^ 1])
+    return chain
+
+def tsp_reorder_clustered(labels, features, features_path=None, workers=None):
+    """
+    Hierarchical ordering: order the frames of every scene cluster, then the clusters.
+
+    Clusters are ordered independently (see order_cluster), in parallel when
+    the features are on disk: each pool worker maps the feature file once
+    instead of receiving a pickled copy. The segments are then chained and
+    oriented by their boundary frames (see link_segments).
+
+    Args:
+        labels: Scene cluster of every frame, from build_similarity.cluster_features
+        features: NxD L2-normalised features
+        features_path: .npy file of the features, for the pool workers
+        workers: Pool size. If None, one per CPU (at most one per cluster).
+
+    Returns:
+        list: Ordered list of frame indices
+    """
+    labels = np.asarray(labels)
+    n = len(labels)
+    clusters = np.split(np.argsort(labels, kind='stable'),
+                        np.flatnonzero(np.diff(np.sort(labels))) + 1)
+    sizes = [len(members) for members in clusters]
+    print(f"🔍 Ordering {n} frames in {len(clusters)} scene clusters "
+          f"({min(sizes)} to {max(sizes)} frames each)...")
+
+    if workers is None:
+        workers = min(len(clusters), os.cpu_count() or 1)
+
+    done = 0
+    segments = []
+    if features_path is not None and workers > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn, not fork: torch and OpenMP thread pools do not survive a fork
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_cluster_worker,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initargs=(str(features_path),)) as pool:
+            for segment in pool.map(_order_cluster_in_worker, clusters,
+                                    chunksize=max(1, len(clusters) // (8 * workers))):
+                segments.append(segment)
+                done += len(segment)
+                report('solve_tsp', done, n)
+    else:
+        for members in clusters:
+            segments.append(order_cluster(features, members))
+            done += len(members)
+            report('solve_tsp', done, n)
+
+    chain = link_segments(segments, features)
+    reversed_count = sum(1 for _, backwards in chain if backwards)
+    print(f"  - Chained {len(chain)} segments ({reversed_count} walked backwards)")
+    return np.concatenate([segments[i][::-1] if backwards else segments[i]
+                           for i, backwards in chain]).tolist()
+
+def cluster_neighbours(labels, features, order, k):
+    """
+    Local search candidates for a clustered solve: each frame's top-k
+    neighbours within its own cluster.
+
+    Rows of frames in clusters of k frames or fewer are padded with the
+    frame's successor (or, for the last frame, predecessor) in `order`.
+
+    Returns:
+        np.ndarray: N x k neighbour indices
+    """
+    from build_similarity import knn_similarity
+
+    labels = np.asarray(labels)
+    order = np.asarray(order)
+    n = len(labels)
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    neighbours = np.empty((n, k), dtype=np.int64)
+
+    for members in np.split(np.argsort(labels, kind='stable'),
+                            np.flatnonzero(np.diff(np.sort(labels))) + 1):
+        if len(members) > 1:
+            indices, _ = knn_similarity(features[members], min(k, len(members) - 1))
+            rows = members[indices]
+        else:
+            rows = np.empty((1, 0), dtype=np.int64)
+        if rows.shape[1] < k:
+            at = position[members]
+            adjacent = order[np.where(at + 1 < n, at + 1, at - 1)]
+            rows = np.concatenate([rows, np.repeat(adjacent[:, None], k - rows.shape[1], axis=1)], axis=1)
+        neighbours[members] = rows
+    return neighbours
+
+SOLVERS = {
+    'greedy': tsp_reorder,
+    'greedy_fast': tsp_reorder_fast,
+    'multistart': tsp_reorder_multistart,
+}
+
+def print_statistics(forward_similarities, n):
     print("\n📊 Reconstruction Statistics:")
-    print(f"  - Number of frames: {len(order)}")
+    print(f"  - Number of frames: {n}")
     print(f"  - Mean frame similarity: {np.mean(forward_similarities):.4f}")
     print(f"  - Min frame similarity: {np.min(forward_similarities):.4f}")
     print(f"  - Max frame similarity: {np.max(forward_similarities):.4f}")
+
+def solve_tsp(solver='greedy_fast', mode='dense', local_search=0.0, neighbours_k=10,
+              solver_options=None, workspace=None):
+    """
+    Solve the frame order from the saved similarity matrix.
+
+    Args:
+        solver: Name of the ordering engine in SOLVERS
+        mode: 'dense' reads data/similarity_matrix.npy, 'knn' reads the sparse
+              graph in data/similarity_knn.npz (solved with tsp_reorder_knn),
+              'clustered' reads the scene clusters in data/scene_clusters.npz
+              (solved with tsp_reorder_clustered)
+        local_search: Seconds of 2-opt/Or-opt improvement to run after the
+                      initial order. 0 disables it.
+        neighbours_k: Candidate neighbours per frame for the local search
+        solver_options: Extra keyword arguments for the solver (e.g. {'starts': 16},
+                        or {'workers': 4} in 'clustered' mode)
+        workspace: Job workspace to read and write (see workspace.py).
+                   Defaults to the repository's data/ directory.
+
+    If jumble_frames saved the ground-truth shuffle (data/frame_permutation.npy),
+    the solved order is also scored against it (see scoring.py).
+    """
+    workspace = workspace or Workspace()
     
-    # Save the order
-    np.save(order_out, np.array(order))
+    # Define file paths
+    sim_path = workspace.similarity_path
+    knn_path = workspace.knn_path
+    clusters_path = workspace.clusters_path
+    order_out = workspace.order_path
+    permutation_path = workspace.permutation_path
+
+    if mode == 'knn':
+        if not os.path.exists(knn_path):
+            print("❌ Sparse similarity graph not found. Run build_similarity.py --mode knn first.")
+            return
+
+        from build_similarity import normalize_features
+
+        print(f"🧩 Loading sparse similarity graph from: {knn_path}")
+        graph = np.load(knn_path)
+        neighbours = graph['indices']
+        ids = load_frame_ids(knn_path, expected=len(neighbours))
+        features = normalize_features(np.load(str(graph['features_path'])))
+        print(f"  - Graph shape: {neighbours.shape[0]} frames x {neighbours.shape[1]} neighbours")
+
+        print("\n🚀 Solving frame order using greedy search over the neighbour graph...")
+        solve_start = time.perf_counter()
+        order = tsp_reorder_knn(neighbours, features)
+
+        def edge_similarities(a, b):
+            return np.einsum('ij,ij->i', features[a], features[b])
+
+        def pair_similarity(a, b):
+            return float(features[a] @ features[b])
+    elif mode == 'clustered':
+        if not os.path.exists(clusters_path):
+            print("❌ Scene clusters not found. Run build_similarity.py --mode clustered first.")
+            return
+
+        from build_similarity import normalize_features
+
+        print(f"🧩 Loading scene clusters from: {clusters_path}")
+        graph = np.load(clusters_path)
+        labels = graph['labels']
+        ids = load_frame_ids(clusters_path, expected=len(labels))
+        features_path = str(graph['features_path'])
+        features = normalize_features(np.load(features_path))
+        print(f"  - {len(labels)} frames in {int(labels.max()) + 1} clusters")
+
+        print("\n🚀 Solving frame order cluster by cluster...")
+        solve_start = time.perf_counter()
+        order = tsp_reorder_clustered(labels, features, features_path=features_path,
+                                      workers=(solver_options or {}).get('workers'))
+        neighbours = None
+
+        def edge_similarities(a, b):
+            return np.einsum('ij,ij->i', features[a], features[b])
+
+        def pair_similarity(a, b):
+            return float(features[a] @ features[b])
+    else:
+        # Check if similarity matrix exists
+        if not os.path.exists(sim_path):
+            print("❌ Similarity matrix not found. Run build_similarity.py first.")
+            return
+
+        print(f"🧩 Loading similarity matrix from: {sim_path}")
+        similarity = np.load(sim_path, mmap_mode='r')
+        ids = load_frame_ids(sim_path, expected=len(similarity))
+        print(f"  - Matrix shape: {similarity.shape}")
+        print(f"  - Similarity range: {np.min(similarity):.2f} to {np.max(similarity):.2f}")
+
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver '{solver}'. Choose from: {', '.join(SOLVERS)}")
+
+        print(f"\n🚀 Solving frame order using the '{solver}' solver...")
+        solve_start = time.perf_counter()
+        order = SOLVERS[solver](similarity, **(solver_options or {}))
+        neighbours = None
+
+        def edge_similarities(a, b):
+            return similarity[a, b]
+
+        def pair_similarity(a, b):
+            return float(similarity[a, b])
+    
+    # Calculate statistics
+    order_arr = np.asarray(order)
+    forward_similarities = edge_similarities(order_arr[:-1], order_arr[1:])
+    print_statistics(forward_similarities, len(order))
+
+    if local_search > 0 and len(order) > 3:
+        from local_search import improve_order, top_k_neighbours
+
+        print(f"\n🔧 Improving order with 2-opt/Or-opt local search ({local_search:.0f}s budget)...")
+        if mode == 'clustered':
+            neighbours = cluster_neighbours(labels, features, order, neighbours_k)
+        elif neighbours is None:
+            neighbours = top_k_neighbours(similarity, neighbours_k)
+        else:
+            neighbours = neighbours[:, :neighbours_k]
+        before = np.mean(forward_similarities)
+        order, stats = improve_order(order, pair_similarity, neighbours, time_budget=local_search)
+
+        order_arr = np.asarray(order)
+        forward_similarities = edge_similarities(order_arr[:-1], order_arr[1:])
+        after = np.mean(forward_similarities)
+        print(f"  - 2-opt moves: {stats['two_opt_moves']}, Or-opt moves: {stats['or_opt_moves']}"
+              f" in {stats['elapsed']:.1f}s{' (time budget reached)' if stats['timed_out'] else ''}")
+        print(f"  - Mean frame similarity: {before:.4f} -> {after:.4f} ({after - before:+.4f})")
+        print_statistics(forward_similarities, len(order))
+    
+    solve_seconds = time.perf_counter() - solve_start
+    print(f"\n⏱️ Solved {len(order)} frames in {solve_seconds:.2f}s")
+
+    # Save the order, with the frame ID at each position for rebuild_video
+    np.save(order_out, order_arr)
+    save_frame_ids(None if ids is None else [ids[i] for i in order_arr], order_out)
     print(f"\n✅ Frame order saved to: {order_out}")
 
+    from scoring import score_saved_order
+    score_saved_order(order_out, permutation_path)
+
 if __name__ == "__main__":
-    solve_tsp()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Solve the frame order from the similarity matrix.")
+    parser.add_argument("--solver", choices=sorted(SOLVERS), default="greedy_fast",
+                        help="Ordering engine for the dense matrix (default: greedy_fast)")
+    parser.add_argument("--mode", choices=["dense", "knn", "clustered"], default="dense",
+                        help="Solve from the dense matrix, the sparse top-k graph or the scene clusters (default: dense)")
+    parser.add_argument("--local_search", type=float, default=0.0,
+                        help="Seconds of 2-opt/Or-opt improvement after the initial order (default: off)")
+    parser.add_argument("--starts", type=int, default=8,
+                        help="Start frames tried by the multistart solver (default: 8)")
+    args = parser.parse_args()
+
+    solver_options = {'starts': args.starts} if args.solver == 'multistart' else None
+    solve_tsp(solver=args.solver, mode=args.mode, local_search=args.local_search,
+              solver_options=solver_options)
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+# Job workspaces.
+#
+# A Workspace holds the paths of everything one pipeline job reads and writes:
+# its frames, features, similarity graph or scene clusters, order, ground-truth
+# shuffle, video metadata and stage manifests under <root>/data, and its video
+# and report under the output directory. Every stage takes an optional `workspace`. Without
+# one, the stages use the repository's own data/ and output/ directories, as
+# before. Jobs with different workspaces can run at the same time without
+# touching each other's files.
+#
+# The feature cache and the exported-graph cache are content-addressed and safe
+# to share, so by default every workspace uses the repository's data/cache.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Workspace:
+    """
+    Paths of one pipeline job's intermediate files and outputs.
+
+    Args:
+        root: Directory the job's data/ tree lives in. Defaults to the repository.
+        output_dir: Where the reconstructed video and report go. Defaults to <root>/output.
+        cache_dir: Shared cache directory. Defaults to the repository's data/cache.
+    """
+
+    def __init__(self, root=None, output_dir=None, cache_dir=None):
+        self.root = os.path.abspath(str(root or REPO_DIR))
+        self.data_dir = os.path.join(self.root, 'data')
+        self.output_dir = os.path.abspath(str(output_dir or os.path.join(self.root, 'output')))
+        self.cache_dir = os.path.abspath(str(cache_dir or os.path.join(REPO_DIR, 'data', 'cache')))
+
+        self.frames_dir = os.path.join(self.data_dir, 'frames')
+        self.frames_jumbled_dir = os.path.join(self.data_dir, 'frames_jumbled')
+        self.features_dir = os.path.join(self.data_dir, 'features')
+        self.features_path = os.path.join(self.features_dir, 'frame_features.npy')
+        self.similarity_path = os.path.join(self.data_dir, 'similarity_matrix.npy')
+        self.knn_path = os.path.join(self.data_dir, 'similarity_knn.npz')
+        self.clusters_path = os.path.join(self.data_dir, 'scene_clusters.npz')
+        self.order_path = os.path.join(self.data_dir, 'frame_order_final.npy')
+        self.permutation_path = os.path.join(self.data_dir, 'frame_permutation.npy')
+        self.metadata_path = os.path.join(self.data_dir, 'video_metadata.json')
+        self.manifests_dir = os.path.join(self.data_dir, 'manifests')
+        self.feature_cache_path = os.path.join(self.cache_dir, 'feature_cache.sqlite')
+        self.output_video = os.path.join(self.output_dir, 'reconstructed_video.mp4')
+        self.report_path = os.path.join(self.output_dir, 'reconstructed_video.report.json')
+
+    def __repr__(self):
+        return f"Workspace({self.root!r}, output_dir={self.output_dir!r})"
+
+    def create(self):
+        """Create the data, features and output directories."""
+        for path in (self.data_dir, self.features_dir, self.output_dir):
+            os.makedirs(path, exist_ok=True)
+        return self
+
+    def remove_data(self):
+        """Delete the job's intermediate files, keeping its outputs (and the shared cache)."""
+        if os.path.abspath(self.root) == REPO_DIR:
+            raise ValueError("Refusing to delete the repository's own data directory")
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        try:
+            os.rmdir(self.root)  # only succeeds if nothing else (e.g. the output) is left
+        except OSError:
+            pass
+
+
+def job_workspace(jobs_dir, name, output_dir=None):
+    """
+    Workspace of a named job: data under <jobs_dir>/<name>, outputs under
+    <output_dir>/<name> (or <jobs_dir>/<name>/output).
+    """
+    root = os.path.join(str(jobs_dir), name)
+    return Workspace(root, output_dir=None if output_dir is None else os.path.join(str(output_dir), name))